@@ -6,6 +6,10 @@ import datetime
 st.set_page_config(page_title="Upload Documents", layout="wide")
 
 API_BASE_URL = "http://127.0.0.1:8000"
+# Files larger than this are sent in parts through a resumable upload instead of one request.
+RESUMABLE_UPLOAD_THRESHOLD_BYTES = 64 * 1024 * 1024
+# Times a failed part is retried, resuming from what the server has, before giving up.
+PART_RETRIES = 3
 
 def get_categories(token: str) -> List[dict]:
     """
@@ -55,6 +59,44 @@ def upload_files(token: str, files, expires_at: Optional[str] = None, category_i
     response.raise_for_status()
     return response.json()
 
+def upload_file_resumable(token: str, file, expires_at: Optional[str] = None, category_ids: Optional[List[int]] = None, progress=None):
+    """
+    Uploads one large file in parts through a resumable upload session. When a part fails,
+    asks the server how far it got and carries on from there.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"filename": file.name, "size": file.size, "category_ids": category_ids or None}
+    if expires_at:
+        payload["expires_at"] = datetime.datetime.fromisoformat(expires_at).isoformat()
+    response = requests.post(f"{API_BASE_URL}/documents/uploads", json=payload, headers=headers)
+    response.raise_for_status()
+    upload = response.json()
+    upload_url = f"{API_BASE_URL}/documents/uploads/{upload['id']}"
+
+    failures = 0
+    while upload["next_part"] < upload["total_parts"]:
+        part_number = upload["next_part"]
+        file.seek(part_number * upload["part_size"])
+        part = file.read(upload["part_size"])
+        try:
+            response = requests.put(f"{upload_url}/parts/{part_number}", files={"part": (file.name, part)}, headers=headers)
+            response.raise_for_status()
+            upload = response.json()
+            failures = 0
+        except requests.exceptions.RequestException:
+            failures += 1
+            if failures > PART_RETRIES:
+                raise
+            response = requests.get(upload_url, headers=headers)
+            response.raise_for_status()
+            upload = response.json()
+        if progress is not None:
+            progress.progress(upload["received_bytes"] / upload["total_size"], text=f"Uploading {file.name}...")
+
+    response = requests.post(f"{upload_url}/complete", headers=headers)
+    response.raise_for_status()
+    return response.json()
+
 
 st.title("Upload New Documents")
 
@@ -122,14 +164,22 @@ else:
 
                     expires_at_iso = expires_at_date.isoformat() if expires_at_date else None
 
-                    with st.spinner("Uploading and processing files..."):
-                        upload_files(
-                            st.session_state.token,
-                            uploaded_files,
-                            expires_at_iso,
-                            selected_category_ids
-                        )
+                    small_files = [file for file in uploaded_files if file.size <= RESUMABLE_UPLOAD_THRESHOLD_BYTES]
+                    large_files = [file for file in uploaded_files if file.size > RESUMABLE_UPLOAD_THRESHOLD_BYTES]
+                    with st.spinner("Uploading files..."):
+                        if small_files:
+                            upload_files(
+                                st.session_state.token,
+                                small_files,
+                                expires_at_iso,
+                                selected_category_ids
+                            )
+                        for large_file in large_files:
+                            progress = st.progress(0.0, text=f"Uploading {large_file.name}...")
+                            upload_file_resumable(st.session_state.token, large_file, expires_at_iso, selected_category_ids, progress)
+                            progress.empty()
                     st.success(f"{len(uploaded_files)} file(s) uploaded successfully!")
+                    st.info("The files are being processed in the background. You will get a notification when they are ready to query.")
                 else:
                     st.error("Please select at least one file to upload.")
 
@@ -1,3 +1,4 @@
+import json
 import streamlit as st
 import requests
 from typing import List, Dict, Optional
@@ -33,10 +34,8 @@ def get_user_data() -> Dict:
         "mappings": mappings_response.json()
     }
 
-def run_query(question: str, doc_ids: Optional[List[int]] = None, cat_id: Optional[int] = None, llm_config_id: Optional[int] = None) -> Dict:
-    # ... (same as before)
-    headers = get_auth_headers()
-    payload = {"question": question}
+def build_query_payload(question: str, doc_ids: Optional[List[int]] = None, cat_id: Optional[int] = None, llm_config_id: Optional[int] = None, mode: str = "answer") -> Dict:
+    payload = {"question": question, "mode": mode}
     if cat_id is not None:
         payload["category_id"] = cat_id
     elif doc_ids:
@@ -45,10 +44,41 @@ def run_query(question: str, doc_ids: Optional[List[int]] = None, cat_id: Option
         raise ValueError("Either doc_ids or cat_id must be provided.")
     if llm_config_id is not None:
         payload["llm_config_id"] = llm_config_id
+    return payload
+
+def run_query(question: str, doc_ids: Optional[List[int]] = None, cat_id: Optional[int] = None, llm_config_id: Optional[int] = None, mode: str = "answer") -> Dict:
+    headers = get_auth_headers()
+    payload = build_query_payload(question, doc_ids, cat_id, llm_config_id, mode)
     response = requests.post(f"{API_BASE_URL}/query/", json=payload, headers=headers)
     response.raise_for_status()
     return response.json()
 
+def stream_query(question: str, doc_ids: Optional[List[int]] = None, cat_id: Optional[int] = None, llm_config_id: Optional[int] = None):
+    """
+    Yields the answer's tokens as the server streams them (server-sent events).
+    The query id from the final event is stored in the session state.
+    Raises RuntimeError if the server reports that the LLM failed.
+    """
+    headers = get_auth_headers()
+    payload = build_query_payload(question, doc_ids, cat_id, llm_config_id)
+    with requests.post(f"{API_BASE_URL}/query/stream", json=payload, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "token":
+                    yield data
+                elif event == "done":
+                    st.session_state.last_query_id = data["query_id"]
+                elif event == "error":
+                    # The tokens shown so far are not a complete answer and were not logged.
+                    st.session_state.last_answer = None
+                    st.session_state.last_query_id = None
+                    raise RuntimeError(data["detail"])
+
 def save_query_as_document(query_id: int, filename: str):
     # ... (same as before)
     headers = get_auth_headers()
@@ -110,9 +140,15 @@ try:
             llm_config_name = st.selectbox("Model", list(llm_config_map.keys()))
             selected_llm_config_id = llm_config_map.get(llm_config_name)
         st.slider("Creativity Control", 0.0, 1.0, 0.7)
+        answer_mode = st.radio(
+            "Answer from",
+            [("answer", "The most relevant passages"), ("extractive", "Quotes only (fast, no LLM)"), ("map_reduce", "Everything (summaries, slower)")],
+            format_func=lambda x: x[1]
+        )[0]
 
     question = st.text_area("3. Ask your question", height=150)
 
+    answer_streamed = False
     if st.button("Get Answer"):
         # ... (same as before)
         is_valid_selection = (query_target == "Category" and selected_cat_id is not None) or \
@@ -121,17 +157,25 @@ try:
             st.warning("Please enter a question.")
         elif not is_valid_selection:
             st.warning("Please select at least one document or a category.")
-        else:
+        elif (query_target == "Category" and selected_cat_id in mapped_cat_ids) or answer_mode != "answer":
+            # Google Drive categories are read on the fly, and extractive and map-reduce answers are not generated token by token.
             with st.spinner("Finding answers..."):
-                result = run_query(question, selected_doc_ids, selected_cat_id, selected_llm_config_id)
+                result = run_query(question, selected_doc_ids, selected_cat_id, selected_llm_config_id, answer_mode)
                 st.session_state.last_answer = result.get("answer")
                 st.session_state.last_query_id = result.get("query_id")
+        else:
+            st.markdown("---")
+            st.subheader("Answer")
+            st.session_state.last_answer = st.write_stream(
+                stream_query(question, selected_doc_ids, selected_cat_id, selected_llm_config_id)
+            )
+            answer_streamed = True
 
     if st.session_state.get("last_answer"):
-        # ... (same as before)
-        st.markdown("---")
-        st.subheader("Answer")
-        st.markdown(st.session_state.last_answer)
+        if not answer_streamed:
+            st.markdown("---")
+            st.subheader("Answer")
+            st.markdown(st.session_state.last_answer)
 
         with st.expander("Save or Append this Result"):
             tab1, tab2 = st.tabs(["Save as New Document", "Append to Existing Document"])
@@ -1,5 +1,7 @@
 import os
+import datetime
 from typing import List
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
@@ -10,6 +12,10 @@ import secrets
 from src.backend.data.models import User, LLMConfig, QueryLog, AuditLog
 from src.backend.api.auth import get_current_active_user, get_current_admin_user, get_password_hash
 from src.backend.core.audit import create_audit_log
+from src.backend.core.llm_cache import llm_client_cache
+from src.backend.core.answer_cache import answer_cache
+from src.backend.core.llm_scheduler import llm_scheduler
+from src.backend.core.llm_router import llm_router
 
 router = APIRouter()
 
@@ -33,8 +39,17 @@ def list_all_users(db: Session = Depends(get_db)):
 def get_all_query_history(db: Session = Depends(get_db)):
     return db.query(QueryLog).order_by(QueryLog.created_at.desc()).all()
 
+def _validate_hedge_config(db: Session, hedge_config_id: int, config_id: int = None):
+    if hedge_config_id is None:
+        return
+    if hedge_config_id == config_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="An LLM config cannot hedge to itself.")
+    if not db.query(LLMConfig).filter(LLMConfig.id == hedge_config_id).first():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Hedge LLM config not found.")
+
 @router.post("/configs/", response_model=schemas.LLMConfig, dependencies=[Depends(get_current_admin_user)])
 def create_llm_config(config: schemas.LLMConfigCreate, db: Session = Depends(get_db)):
+    _validate_hedge_config(db, config.hedge_config_id)
     if config.is_default:
         existing_default = db.query(LLMConfig).filter(LLMConfig.is_default == True).first()
         if existing_default:
@@ -53,11 +68,118 @@ def get_queries_per_day(db: Session = Depends(get_db)):
     ).group_by(func.date(QueryLog.created_at)).order_by(func.date(QueryLog.created_at)).all()
     return [{"date": row.date, "queries": row.query_count} for row in result]
 
+# Per-query figures summarized by the latency analytics.
+QUERY_STAGES = ("embed_ms", "retrieve_ms", "rerank_ms", "prompt_ms", "llm_ms", "prompt_tokens", "completion_tokens")
+
+def _percentiles(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+def _summarize_queries(rows: list) -> dict:
+    hits = sum(1 for row in rows if row.cache_hit)
+    fallbacks = sum(1 for row in rows if row.fallback)
+    coalesced = sum(1 for row in rows if row.coalesced)
+    return {
+        "queries": len(rows),
+        "cache_hit_rate": hits / len(rows) if rows else 0.0,
+        "coalesced_rate": coalesced / len(rows) if rows else 0.0,
+        "fallback_rate": fallbacks / len(rows) if rows else 0.0,
+        "stages": {stage: _percentiles([getattr(row, stage) for row in rows]) for stage in QUERY_STAGES},
+    }
+
+@router.get("/analytics/query_latency/", dependencies=[Depends(get_current_admin_user)])
+def get_query_latency(days: int = 7, db: Session = Depends(get_db)):
+    """
+    Reports p50/p95/p99 of each query stage's milliseconds and of the token counts over the last
+    `days` days, overall and per LLM config, and the share of answers degraded by a fallback.
+    Cache hits, coalesced answers and fallback answers have no LLM config; coalesced answers
+    have no retrieval, prompt or LLM figures either, since another query did that work.
+    """
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    rows = db.query(
+        QueryLog.llm_config_id, QueryLog.cache_hit, QueryLog.coalesced, QueryLog.fallback, *[getattr(QueryLog, stage) for stage in QUERY_STAGES]
+    ).filter(QueryLog.created_at >= since).all()
+    config_names = dict(db.query(LLMConfig.id, LLMConfig.name).all())
+
+    rows_by_config = {}
+    for row in rows:
+        rows_by_config.setdefault(row.llm_config_id, []).append(row)
+
+    return {
+        "days": days,
+        **_summarize_queries(rows),
+        "by_llm_config": [
+            {"llm_config_id": config_id, "name": config_names.get(config_id), **_summarize_queries(config_rows)}
+            for config_id, config_rows in rows_by_config.items()
+        ],
+    }
+
+@router.get("/analytics/answer_cache/", dependencies=[Depends(get_current_admin_user)])
+def get_answer_cache_stats():
+    """Reports the answer cache's hit rate and the LLM time it saved since the server started."""
+    return answer_cache.stats()
+
+@router.get("/analytics/llm_queues/", dependencies=[Depends(get_current_admin_user)])
+def get_llm_queue_stats():
+    """Reports active and waiting LLM calls per config."""
+    return llm_scheduler.stats()
+
+@router.get("/routing/", dependencies=[Depends(get_current_admin_user)])
+def get_llm_routing(db: Session = Depends(get_db)):
+    """
+    Reports how queries that do not name an LLM config are routed: each config's prices, pin
+    and exclusion flags and the router's moving averages of latency, error rate and cost.
+    """
+    router_stats = llm_router.stats()
+    configs = db.query(LLMConfig).order_by(LLMConfig.id).all()
+    return {
+        "latency_slo_ms": llm_router.latency_slo_ms,
+        "max_error_rate": llm_router.max_error_rate,
+        "configs": [
+            {
+                "llm_config_id": config.id,
+                "name": config.name,
+                "is_default": config.is_default,
+                "pinned": config.routing_pinned,
+                "excluded": config.routing_excluded,
+                "cost_per_1k_prompt_tokens": config.cost_per_1k_prompt_tokens,
+                "cost_per_1k_completion_tokens": config.cost_per_1k_completion_tokens,
+                "stats": router_stats.get(str(config.id)),
+            }
+            for config in configs
+        ],
+    }
+
+@router.put("/routing/{config_id}", response_model=schemas.LLMConfig)
+def update_llm_routing(config_id: int, routing: schemas.LLMRoutingUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+    """
+    Pins a config, so every query that does not name one uses it, or excludes it from routing.
+    Pinning a config unpins the others; a config cannot be pinned and excluded at once.
+    """
+    db_config = db.query(LLMConfig).filter(LLMConfig.id == config_id).first()
+    if not db_config:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Config not found")
+    pinned = db_config.routing_pinned if routing.pinned is None else routing.pinned
+    excluded = db_config.routing_excluded if routing.excluded is None else routing.excluded
+    if pinned and excluded:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="An LLM config cannot be both pinned and excluded.")
+    if pinned and not db_config.routing_pinned:
+        db.query(LLMConfig).filter(LLMConfig.id != config_id, LLMConfig.routing_pinned == True).update({LLMConfig.routing_pinned: False})
+    db_config.routing_pinned, db_config.routing_excluded = pinned, excluded
+    db.commit()
+    db.refresh(db_config)
+    create_audit_log(db, current_user, "llm_routing_update", {"llm_config_id": config_id, "pinned": pinned, "excluded": excluded})
+    return db_config
+
 @router.put("/configs/{config_id}", response_model=schemas.LLMConfig, dependencies=[Depends(get_current_admin_user)])
 def update_llm_config(config_id: int, config: schemas.LLMConfigCreate, db: Session = Depends(get_db)):
     db_config = db.query(LLMConfig).filter(LLMConfig.id == config_id).first()
     if not db_config:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Config not found")
+    _validate_hedge_config(db, config.hedge_config_id, config_id)
     if config.is_default and not db_config.is_default:
         existing_default = db.query(LLMConfig).filter(LLMConfig.is_default == True).first()
         if existing_default and existing_default.id != config_id:
@@ -67,6 +189,7 @@ def update_llm_config(config_id: int, config: schemas.LLMConfigCreate, db: Sessi
         setattr(db_config, key, value)
     db.commit()
     db.refresh(db_config)
+    llm_client_cache.invalidate(config_id)
     return db_config
 
 @router.delete("/configs/{config_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(get_current_admin_user)])
@@ -76,6 +199,7 @@ def delete_llm_config(config_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Config not found")
     db.delete(db_config)
     db.commit()
+    llm_client_cache.invalidate(config_id)
     return None
 
 @router.get("/audit-log/", response_model=List[schemas.AuditLogOut], dependencies=[Depends(get_current_admin_user)])
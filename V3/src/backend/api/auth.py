@@ -46,7 +46,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 # --- Dependency to get current user ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+# A plain def so FastAPI runs the blocking user lookup in its threadpool instead of on the event loop.
+# It stays on the sync Session on purpose: FastAPI shares get_db within a request, so the sync
+# endpoints that update the returned user (storage_used, credentials) commit it through their own db.
+# A user loaded from an AsyncSession would be attached to a session those endpoints never commit.
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
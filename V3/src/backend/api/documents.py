@@ -1,36 +1,110 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
+import hashlib
 import uuid
 import io
 from src.backend.data import schemas
 from src.backend.data.database import get_db
-from src.backend.data.models import Document, User, Setting, Category, document_category_association, QueryLog
+from src.backend.data.models import Document, User, Setting, Category, document_category_association, QueryLog, IngestionJob, UploadSession
 from src.backend.core.rag_system import RAGSystem
 from src.backend.api.auth import get_current_active_user
 from src.backend.core.audit import create_audit_log
-# TODO: This utility is file-processing logic and should be moved to a shared core library
-# to avoid a backend dependency on the frontend.
-from src.frontend.utils import read_file_content
-from src.backend.core.services.storage import CloudStorageService
+from src.backend.core.services.storage import CloudStorageService, StorageQuotaExceededError
 from src.backend.core.services.export import ExportService
+from src.backend.core.services.text_store import ExtractedTextStore
+from src.backend.core.services.ingestion import enqueue_ingestion, wake_ingestion_workers, find_near_duplicates
 
 router = APIRouter()
 
 rag_system = RAGSystem()
 storage_service = CloudStorageService()
 export_service = ExportService()
+text_store = ExtractedTextStore(storage_service)
 
 # (The rest of the file content remains the same as I have already updated it)
 # ...
 # ... (rest of the file)
-@router.post("/upload", response_model=List[schemas.DocumentOut])
+# Files are sent in parts of this size when uploaded through an upload session; a multiple of 256 KiB, as GCS requires.
+UPLOAD_PART_SIZE = max(int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024)) // (256 * 1024), 1) * 256 * 1024
+# Hours an unfinished upload session can be resumed.
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get("UPLOAD_SESSION_TTL_HOURS", 24))
+
+def _storage_limit() -> int:
+    return int(os.environ.get("USER_STORAGE_LIMIT_MB", 1024)) * 1024 * 1024
+
+def _get_categories(db: Session, category_ids: Optional[List[int]]) -> List[Category]:
+    if not category_ids:
+        return []
+    categories = db.query(Category).filter(Category.id.in_(category_ids)).all()
+    if len(categories) != len(category_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="One or more categories not found.")
+    return categories
+
+def _register_stored_file(
+    db: Session,
+    current_user: User,
+    unique_filename: str,
+    original_filename: str,
+    file_size: int,
+    content_hash: str,
+    categories: List[Category],
+    expires_at_dt: Optional[datetime],
+) -> schemas.DocumentUploadOut:
+    """
+    Creates the document for a file already in storage and queues it for indexing. An exact
+    duplicate of one of the user's documents is dropped from storage and the existing document
+    is returned instead. The caller wakes the ingestion workers.
+    """
+    existing_document = db.query(Document).filter(
+        Document.owner_id == current_user.id,
+        Document.content_hash == content_hash
+    ).first()
+    if existing_document:
+        # Exact duplicate: keep the existing document's blob and vectors and drop the copy just stored.
+        storage_service.delete(unique_filename)
+        existing_document.categories.extend(c for c in categories if c not in existing_document.categories)
+        db.commit()
+        create_audit_log(db, current_user, "document_upload_duplicate", {"document_id": existing_document.id, "filename": original_filename})
+        doc_out = schemas.DocumentUploadOut.model_validate(existing_document)
+        doc_out.is_duplicate = True
+        return doc_out
+
+    db_document = Document(
+        filename=unique_filename,
+        original_filename=original_filename,
+        version=1,
+        owner_id=current_user.id,
+        created_at=datetime.utcnow(),
+        expires_at=expires_at_dt,
+        size=file_size,
+        content_hash=content_hash,
+    )
+
+    db_document.categories.extend(categories)
+
+    db.add(db_document)
+    # Extraction and indexing run in the ingestion workers; see GET /documents/{id}/status.
+    enqueue_ingestion(db, db_document)
+    current_user.storage_used += file_size
+
+    try:
+        db.commit()
+        db.refresh(db_document)
+        create_audit_log(db, current_user, "document_upload", {"document_id": db_document.id, "filename": db_document.original_filename})
+        return schemas.DocumentUploadOut.model_validate(db_document)
+    except Exception as e:
+        db.rollback()
+        storage_service.delete(unique_filename)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to save document to database: {e}")
+
+@router.post("/upload", response_model=List[schemas.DocumentUploadOut])
 def upload_documents(
     files: List[UploadFile] = File(...),
     expires_at: Optional[str] = Form(None),
@@ -38,57 +112,364 @@ def upload_documents(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    total_upload_size = sum(file.size for file in files)
-    if current_user.storage_used + total_upload_size > int(os.environ.get("USER_STORAGE_LIMIT_MB", 1024)) * 1024 * 1024:
+    """
+    Stores the files and queues them for indexing. Exact duplicates are flagged with
+    is_duplicate at once; documents with very similar content are only known once the text has
+    been extracted, and are listed by GET /documents/{id}/status.
+    """
+    storage_limit = _storage_limit()
+    # The sizes the client declares only allow an early rejection; the quota is enforced on the bytes received.
+    total_upload_size = sum(file.size or 0 for file in files)
+    if current_user.storage_used + total_upload_size > storage_limit:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"Upload would exceed your storage limit."
         )
 
+    categories = _get_categories(db, category_ids)
+    expires_at_dt = datetime.fromisoformat(expires_at) if expires_at else None
+
     uploaded_docs = []
     for file in files:
-        file_content_bytes = file.file.read()
-        file.file.seek(0)
-        file_size = len(file_content_bytes)
-
         unique_filename = f"{uuid.uuid4()}.{file.filename.split('.')[-1]}"
 
+        # Stream the file into storage, hashing and counting it on the way, so it is never held in memory whole.
         try:
-            storage_service.upload(unique_filename, file_content_bytes)
+            file_size, content_hash = storage_service.upload_stream(unique_filename, file.file, max_bytes=storage_limit - current_user.storage_used)
+        except StorageQuotaExceededError:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Upload would exceed your storage limit.")
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to upload file to storage: {e}")
 
-        expires_at_dt = datetime.fromisoformat(expires_at) if expires_at else None
+        uploaded_docs.append(_register_stored_file(db, current_user, unique_filename, file.filename, file_size, content_hash, categories, expires_at_dt))
+
+    wake_ingestion_workers()
+    return uploaded_docs
+
+# --- Resumable uploads ---
+def _upload_session_out(upload_session: UploadSession) -> schemas.UploadSessionOut:
+    return schemas.UploadSessionOut(
+        id=upload_session.id,
+        original_filename=upload_session.original_filename,
+        total_size=upload_session.total_size,
+        part_size=upload_session.part_size,
+        received_bytes=upload_session.received_bytes,
+        next_part=upload_session.received_bytes // upload_session.part_size,
+        total_parts=-(-upload_session.total_size // upload_session.part_size),
+        expires_at=upload_session.expires_at,
+    )
+
+def _abort_upload_session(db: Session, upload_session: UploadSession):
+    try:
+        storage_service.abort_resumable(upload_session.filename, upload_session.gcs_session_url)
+    except Exception as e:
+        print(f"Warning: Failed to discard upload {upload_session.id} from storage: {e}")
+    db.delete(upload_session)
+    db.commit()
+
+def _get_upload_session(db: Session, upload_id: str, current_user: User) -> UploadSession:
+    upload_session = db.query(UploadSession).filter(UploadSession.id == upload_id, UploadSession.user_id == current_user.id).first()
+    if not upload_session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if upload_session.expires_at <= datetime.utcnow():
+        _abort_upload_session(db, upload_session)
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Upload has expired; start it again.")
+    return upload_session
+
+@router.post("/uploads", response_model=schemas.UploadSessionOut, status_code=status.HTTP_201_CREATED)
+def create_upload_session(
+    upload_input: schemas.UploadSessionCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Starts a resumable upload for a large file. The client then sends the file in parts of
+    part_size bytes, in order, with PUT /uploads/{id}/parts/{n}, and finishes with
+    POST /uploads/{id}/complete. After a dropped connection, GET /uploads/{id} tells which part
+    to send next. Parts go straight to storage (a GCS resumable session, or a local partial
+    file), so neither the file nor a worker is tied up for the whole transfer.
+    """
+    if current_user.storage_used + upload_input.size > _storage_limit():
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Upload would exceed your storage limit.")
+    _get_categories(db, upload_input.category_ids)
+
+    # Clear out the user's abandoned uploads while we are here.
+    for stale in db.query(UploadSession).filter(UploadSession.user_id == current_user.id, UploadSession.expires_at <= datetime.utcnow()).all():
+        _abort_upload_session(db, stale)
+
+    unique_filename = f"{uuid.uuid4()}.{upload_input.filename.split('.')[-1]}"
+    upload_session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=unique_filename,
+        original_filename=upload_input.filename,
+        total_size=upload_input.size,
+        part_size=UPLOAD_PART_SIZE,
+        gcs_session_url=storage_service.start_resumable(unique_filename, upload_input.size),
+        category_ids=upload_input.category_ids,
+        document_expires_at=upload_input.expires_at,
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS),
+    )
+    db.add(upload_session)
+    db.commit()
+    return _upload_session_out(upload_session)
+
+@router.get("/uploads/{upload_id}", response_model=schemas.UploadSessionOut)
+def get_upload_session(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Reports how much of the file has arrived, as checked against storage, so an interrupted upload can resume."""
+    upload_session = _get_upload_session(db, upload_id, current_user)
+    try:
+        stored = storage_service.resumable_offset(upload_session.filename, upload_session.gcs_session_url, upload_session.total_size)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to check upload in storage: {e}")
+    if stored != upload_session.received_bytes:
+        upload_session.received_bytes = stored
+        db.commit()
+    return _upload_session_out(upload_session)
+
+@router.put("/uploads/{upload_id}/parts/{part_number}", response_model=schemas.UploadSessionOut)
+def upload_part(
+    upload_id: str,
+    part_number: int,
+    part: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Stores one part. Sending a part that has already arrived again is harmless; sending one
+    ahead of the next expected part is a 409.
+    """
+    upload_session = _get_upload_session(db, upload_id, current_user)
+    offset = part_number * upload_session.part_size
+    if part_number < 0 or offset >= upload_session.total_size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Part number out of range.")
+    expected_length = min(upload_session.part_size, upload_session.total_size - offset)
 
-        db_document = Document(
-            filename=unique_filename,
-            original_filename=file.filename,
-            version=1,
-            owner_id=current_user.id,
-            created_at=datetime.utcnow(),
-            expires_at=expires_at_dt,
-            size=file_size
+    content = part.file.read(expected_length + 1)
+    if len(content) != expected_length:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Part {part_number} must be {expected_length} bytes.")
+    if offset + expected_length <= upload_session.received_bytes:
+        return _upload_session_out(upload_session)
+    if offset > upload_session.received_bytes:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Expected part {upload_session.received_bytes // upload_session.part_size} next.")
+
+    # Storage may already hold the start of this part from an interrupted attempt; send only the rest.
+    stored = upload_session.received_bytes
+    try:
+        upload_session.received_bytes = storage_service.write_part(
+            upload_session.filename, upload_session.gcs_session_url, stored, content[stored - offset:], upload_session.total_size
         )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to store part {part_number}: {e}")
+    db.commit()
+    return _upload_session_out(upload_session)
 
-        if category_ids:
-            categories = db.query(Category).filter(Category.id.in_(category_ids)).all()
-            if len(categories) != len(category_ids):
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="One or more categories not found.")
-            db_document.categories.extend(categories)
+@router.post("/uploads/{upload_id}/complete", response_model=schemas.DocumentUploadOut)
+def complete_upload_session(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Turns a fully received upload into a document and queues it for indexing, like POST /upload."""
+    upload_session = _get_upload_session(db, upload_id, current_user)
+    if upload_session.received_bytes != upload_session.total_size:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Upload is incomplete: {upload_session.received_bytes} of {upload_session.total_size} bytes received.")
+    if current_user.storage_used + upload_session.total_size > _storage_limit():
+        _abort_upload_session(db, upload_session)
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Upload would exceed your storage limit.")
 
-        db.add(db_document)
-        current_user.storage_used += file_size
+    categories = _get_categories(db, upload_session.category_ids)
+    try:
+        file_size, content_hash = storage_service.hash_stored(upload_session.filename)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to read upload from storage: {e}")
 
-        try:
-            db.commit()
-            db.refresh(db_document)
-            create_audit_log(db, current_user, "document_upload", {"document_id": db_document.id, "filename": db_document.original_filename})
-            uploaded_docs.append(db_document)
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to save document to database: {e}")
+    unique_filename, original_filename, expires_at_dt = upload_session.filename, upload_session.original_filename, upload_session.document_expires_at
+    db.delete(upload_session)
+    doc_out = _register_stored_file(db, current_user, unique_filename, original_filename, file_size, content_hash, categories, expires_at_dt)
+    wake_ingestion_workers()
+    return doc_out
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+def abort_upload_session(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    upload_session = _get_upload_session(db, upload_id, current_user)
+    _abort_upload_session(db, upload_session)
+    return None
+
+@router.get("/{document_id}/status", response_model=schemas.DocumentStatusOut)
+def get_document_status(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Reports how far the document's latest ingestion job has got. Near-duplicates are listed
+    once the job has extracted the text.
+    """
+    document = db.query(Document).filter(Document.id == document_id, Document.owner_id == current_user.id).first()
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found or not owned by user")
+    job = db.query(IngestionJob).filter(IngestionJob.document_id == document_id).order_by(IngestionJob.id.desc()).first()
+    near_duplicate_ids = find_near_duplicates(db, current_user.id, document.minhash, exclude_document_id=document.id)
+    if not job:
+        return schemas.DocumentStatusOut(document_id=document_id, status="unknown", near_duplicate_ids=near_duplicate_ids)
+    return schemas.DocumentStatusOut(
+        document_id=document_id,
+        status=job.status,
+        attempts=job.attempts,
+        error=job.error,
+        queued_at=job.created_at,
+        finished_at=job.finished_at,
+        near_duplicate_ids=near_duplicate_ids,
+    )
+
+def _get_user_document(db: Session, document_id: int, current_user: User) -> Document:
+    document = db.query(Document).filter(Document.id == document_id, Document.owner_id == current_user.id).first()
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found or not owned by user")
+    return document
+
+def _read_document_text(document: Document) -> str:
+    try:
+        return text_store.get_or_extract(document)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to read document text: {e}")
+
+def _save_new_version(db: Session, document: Document, current_user: User, text: str) -> Document:
+    """
+    Stores text as the document's next version, as a .txt file with its sidecar already in
+    place, and queues the document for re-indexing. The previous version's files are removed.
+    """
+    content = text.encode("utf-8")
+    size_change = len(content) - document.size
+    if current_user.storage_used + size_change > _storage_limit():
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="The new version would exceed your storage limit.")
+
+    old_filename, old_version = document.filename, document.version
+    new_filename = f"{uuid.uuid4()}.txt"
+    storage_service.upload(new_filename, content)
+    text_store.put(new_filename, old_version + 1, text)
+
+    document.filename = new_filename
+    document.version = old_version + 1
+    document.size = len(content)
+    document.content_hash = hashlib.sha256(content).hexdigest()
+    document.minhash = None
+    current_user.storage_used += size_change
+    enqueue_ingestion(db, document)
+    try:
+        db.commit()
+        db.refresh(document)
+    except Exception as e:
+        db.rollback()
+        storage_service.delete(new_filename)
+        text_store.delete(new_filename, old_version + 1)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to save the new version: {e}")
+
+    try:
+        storage_service.delete(old_filename)
+        text_store.delete(old_filename, old_version)
+    except Exception as e:
+        print(f"Warning: Failed to delete the previous version {old_filename} from storage: {e}")
+    wake_ingestion_workers()
+    return document
+
+@router.get("/{document_id}/content")
+def get_document_content(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Returns the extracted text of the document's current version."""
+    document = _get_user_document(db, document_id, current_user)
+    return Response(content=_read_document_text(document), media_type="text/plain; charset=utf-8")
+
+@router.put("/{document_id}", response_model=schemas.DocumentOut)
+def update_document_content(
+    document_id: int,
+    update_data: schemas.DocumentUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Replaces the document's text. This creates a new version, which is re-indexed in the background."""
+    document = _get_user_document(db, document_id, current_user)
+    document = _save_new_version(db, document, current_user, update_data.content)
+    create_audit_log(db, current_user, "document_update", {"document_id": document.id, "version": document.version})
+    return document
+
+@router.get("/{document_id}/export")
+def export_document(
+    document_id: int,
+    format: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Exports the document's text in a specified format (PDF, DOCX, TXT).
+    """
+    document = _get_user_document(db, document_id, current_user)
+    content = _read_document_text(document)
+
+    if format == "pdf":
+        file_buffer = export_service.to_pdf(content)
+        media_type = "application/pdf"
+        filename = f"{document.original_filename}.pdf"
+    elif format == "docx":
+        file_buffer = export_service.to_docx(content)
+        media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        filename = f"{document.original_filename}.docx"
+    else:
+        file_buffer = export_service.to_txt(content)
+        media_type = "text/plain"
+        filename = f"{document.original_filename}.txt"
+
+    return StreamingResponse(
+        file_buffer,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@router.post("/{document_id}/append", response_model=schemas.DocumentOut)
+def append_to_document(
+    document_id: int,
+    append_data: schemas.DocumentAppend,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Appends a formatted query result to the document's text as a new version.
+    """
+    document = _get_user_document(db, document_id, current_user)
+    query_log = db.query(QueryLog).filter(QueryLog.id == append_data.query_id, QueryLog.user_id == current_user.id).first()
+    if not query_log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Query log not found")
+
+    query_content = f"Question: {query_log.query_text}\n\nAnswer: {query_log.answer_text}"
+    if append_data.formatting_method == 'simple':
+        formatted_append_text = f"\n\n---\n\n{query_content}"
+    elif append_data.formatting_method == 'informative':
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
+        formatted_append_text = f"\n\n--- Appended on {timestamp} ---\n\n{query_content}"
+    elif append_data.formatting_method == 'structured':
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d')
+        formatted_append_text = f"\n\n## Query Result\n**Date:** {timestamp}\n**Question:** {query_log.query_text}\n\n**Answer:**\n{query_log.answer_text}"
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid formatting method")
+
+    document = _save_new_version(db, document, current_user, _read_document_text(document) + formatted_append_text)
+    create_audit_log(db, current_user, "document_append", {"document_id": document.id, "query_id": query_log.id})
+    return document
 
-    return uploaded_docs
 # ... (rest of the file)
 @router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_document(
@@ -108,9 +489,12 @@ def delete_document(
 
     try:
         storage_service.delete(document.filename)
+        text_store.delete(document.filename, document.version)
     except Exception as e:
         print(f"Warning: Failed to delete file {document.filename} from storage: {e}")
 
+    # Drops the document's chunks and centroid, and the cached answers and session candidates built on them.
+    rag_system.delete_document(document.id)
     db.delete(document)
     current_user.storage_used -= document_size
     if current_user.storage_used < 0:
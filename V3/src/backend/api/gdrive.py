@@ -10,7 +10,9 @@ from src.backend.data.database import get_db
 from src.backend.data.models import User, Document
 from src.backend.api.auth import get_current_active_user
 from src.backend.core.services.google_drive import GoogleDriveService
-from src.backend.core.services.storage import CloudStorageService
+from src.backend.core.services.storage import CloudStorageService, StorageQuotaExceededError
+from src.backend.core.services.ingestion import enqueue_ingestion, wake_ingestion_workers
+from src.backend.core.extraction import SUPPORTED_EXTENSIONS
 
 router = APIRouter()
 storage_service = CloudStorageService()
@@ -19,6 +21,29 @@ storage_service = CloudStorageService()
 USER_STORAGE_LIMIT_MB = int(os.environ.get("USER_STORAGE_LIMIT_MB", 1024))
 USER_STORAGE_LIMIT_BYTES = USER_STORAGE_LIMIT_MB * 1024 * 1024
 
+# Drive MIME types that can be indexed, with the extension extract_text knows them by.
+DRIVE_MIME_EXTENSIONS = {
+    "application/pdf": ".pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "text/plain": ".txt",
+}
+# Google Docs files have no content of their own; they are exported as plain text.
+GOOGLE_DOCS_MIME_TYPE = "application/vnd.google-apps.document"
+
+def _drive_file_format(metadata: dict) -> tuple[str, Optional[str]]:
+    """
+    Returns the storage extension for a Drive file, which extract_text must support, and the
+    MIME type to export it to, if it has to be exported. Raises ValueError for other files.
+    """
+    if metadata.get("mimeType") == GOOGLE_DOCS_MIME_TYPE:
+        return ".txt", "text/plain"
+    extension = os.path.splitext(metadata.get("name") or "")[1].lower()
+    if extension in SUPPORTED_EXTENSIONS:
+        return extension, None
+    if metadata.get("mimeType") in DRIVE_MIME_EXTENSIONS:
+        return DRIVE_MIME_EXTENSIONS[metadata["mimeType"]], None
+    raise ValueError(f"Unsupported file type: {metadata.get('name')} ({metadata.get('mimeType')})")
+
 @router.get("/files")
 def list_drive_files(
     folder_id: Optional[str] = 'root',
@@ -48,28 +73,36 @@ def ingest_from_google_drive(
 
     for file_id in ingest_request.file_ids:
         try:
-            file_content_buffer = gdrive_service.download_file(file_id)
-            file_size = len(file_content_buffer.getvalue())
-
-            if current_user.storage_used + file_size > USER_STORAGE_LIMIT_BYTES:
-                raise HTTPException(
-                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                    detail=f"Ingesting this file would exceed your storage limit of {USER_STORAGE_LIMIT_MB} MB."
-                )
-
-            unique_filename = f"{uuid.uuid4()}.gdoc"
-            storage_service.upload(unique_filename, file_content_buffer.getvalue())
+            metadata = gdrive_service.get_file_metadata(file_id)
+            extension, export_mime_type = _drive_file_format(metadata)
+            unique_filename = f"{uuid.uuid4()}{extension}"
+            with gdrive_service.download_file(file_id, export_mime_type=export_mime_type) as file_content_buffer:
+                try:
+                    file_size, content_hash = storage_service.upload_stream(
+                        unique_filename, file_content_buffer, max_bytes=USER_STORAGE_LIMIT_BYTES - current_user.storage_used
+                    )
+                except StorageQuotaExceededError:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Ingesting this file would exceed your storage limit of {USER_STORAGE_LIMIT_MB} MB."
+                    )
 
+            original_filename = metadata.get("name") or f"gdrive_{file_id}"
+            if not original_filename.lower().endswith(extension):
+                original_filename += extension
             db_document = Document(
                 filename=unique_filename,
-                original_filename=f"gdrive_{file_id}",
+                original_filename=original_filename,
                 version=1,
                 owner_id=current_user.id,
                 created_at=datetime.utcnow(),
-                size=file_size
+                size=file_size,
+                content_hash=content_hash
             )
 
             db.add(db_document)
+            # Indexed in the background like a direct upload; see GET /documents/{id}/status.
+            enqueue_ingestion(db, db_document)
             current_user.storage_used += file_size
 
             db.commit()
@@ -82,4 +115,5 @@ def ingest_from_google_drive(
             db.rollback()
             print(f"Failed to ingest file {file_id}: {e}")
 
+    wake_ingestion_workers()
     return ingested_docs
@@ -1,94 +1,400 @@
+import os
+import json
+import asyncio
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, status, Form
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from typing import List, Optional
 import uuid
 import io
 
 from src.backend.data import schemas
-from src.backend.data.database import get_db
+from src.backend.data.database import get_db, get_async_db
 from src.backend.data.models import QueryLog, User, Document, Category, LLMConfig, GoogleDriveFolderMapping
 from src.backend.core.services.export import ExportService
 from src.backend.core.services.storage import CloudStorageService
 from src.backend.core.services.google_drive import GoogleDriveService
-from src.backend.core.rag_system import RAGSystem
+from src.backend.core.services.ingestion import enqueue_ingestion, wake_ingestion_workers
+from src.backend.core.rag_system import RAGSystem, MapReduceTooLargeError, LLMCallError
+from src.backend.core.llm_scheduler import llm_scheduler, LLMOverloadedError
+from src.backend.core.llm_router import llm_router
 from src.backend.api.auth import get_current_active_user
-from src.backend.core.audit import create_audit_log
+from src.backend.core.audit import create_audit_log, acreate_audit_log
 
 router = APIRouter()
 rag_system = RAGSystem()
 export_service = ExportService()
 storage_service = CloudStorageService()
 
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", 200))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 4))
+
+def _build_llm_config(llm_config_db: LLMConfig, include_hedge: bool = True) -> dict:
+    """
+    Converts an LLMConfig row into the config dict expected by the RAG system.
+    The hedge config, if any, is nested under "hedge" (one level only).
+    """
+    llm_config = {
+        "id": llm_config_db.id,
+        "name": llm_config_db.name,
+        "type": llm_config_db.llm_type,
+        "options": llm_config_db.llm_options,
+        "model_name": llm_config_db.model_name,
+        "api_key_env": llm_config_db.api_key_env,
+        "api_endpoint": llm_config_db.api_endpoint,
+        "context_window": llm_config_db.context_window,
+        "max_concurrency": llm_config_db.max_concurrency,
+        "max_queue": llm_config_db.max_queue,
+        "cost_per_1k_prompt_tokens": llm_config_db.cost_per_1k_prompt_tokens,
+        "cost_per_1k_completion_tokens": llm_config_db.cost_per_1k_completion_tokens,
+    }
+    if include_hedge and llm_config_db.hedge_config is not None:
+        llm_config["hedge"] = _build_llm_config(llm_config_db.hedge_config, include_hedge=False)
+    return llm_config
+
+# QueryLog columns filled from the trace the RAG system returns with each answer.
+QUERY_TRACE_COLUMNS = ("llm_config_id", "embed_ms", "retrieve_ms", "rerank_ms", "prompt_ms", "llm_ms", "prompt_tokens", "completion_tokens", "cache_hit", "coalesced", "fallback", "llm_error")
+
+def _trace_columns(trace: dict) -> dict:
+    return {column: trace[column] for column in QUERY_TRACE_COLUMNS if column in trace}
+
+def _llm_http_error(error: Exception) -> HTTPException:
+    """
+    Maps a failed LLM call to an HTTP error, so failures are reported instead of saved as answers.
+    """
+    if isinstance(error, LLMOverloadedError):
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error during LLM query: {error}")
+
+def _ensure_llm_capacity(llm_config: dict):
+    """Rejects a streaming request up front when the LLM config's queue is already full."""
+    try:
+        llm_scheduler.ensure_capacity(llm_config)
+    except LLMOverloadedError as e:
+        raise _llm_http_error(e)
+
+def _route_llm_config(llm_configs_db: List[LLMConfig]) -> Optional[LLMConfig]:
+    """
+    Picks the config for a query that does not name one: a pinned config if there is one,
+    otherwise the router's choice among the configs that are not excluded.
+    """
+    candidates = [row for row in llm_configs_db if not row.routing_excluded]
+    if not candidates:
+        return None
+    pinned = [row for row in candidates if row.routing_pinned]
+    if pinned:
+        return pinned[0]
+    rows_by_id = {row.id: row for row in candidates}
+    default_id = next((row.id for row in candidates if row.is_default), None)
+    chosen = llm_router.choose([_build_llm_config(row, include_hedge=False) for row in candidates], default_id)
+    return rows_by_id[chosen["id"]]
+
+async def _get_llm_config_db(db: AsyncSession, llm_config_id: Optional[int]) -> LLMConfig:
+    llm_config_db = None
+    with_hedge = select(LLMConfig).options(selectinload(LLMConfig.hedge_config))
+    if llm_config_id is not None:
+        llm_config_db = (await db.execute(with_hedge.where(LLMConfig.id == llm_config_id))).scalar_one_or_none()
+    else:
+        llm_config_db = _route_llm_config(list((await db.execute(with_hedge)).scalars().all()))
+    if llm_config_db is None:
+        llm_config_db = (await db.execute(with_hedge.where(LLMConfig.is_default == True))).scalars().first()
+    if not llm_config_db:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No LLM configuration found.")
+    return llm_config_db
+
+async def _get_user_category(db: AsyncSession, category_id: int, current_user: User) -> Category:
+    result = await db.execute(
+        select(Category)
+        .options(selectinload(Category.gdrive_mapping))
+        .where(Category.id == category_id, Category.user_id == current_user.id)
+    )
+    category = result.scalar_one_or_none()
+    if not category:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+    return category
+
+async def _get_category_document_ids(db: AsyncSession, category_id: int) -> List[int]:
+    result = await db.execute(select(Document.id).where(Document.categories.any(Category.id == category_id)))
+    return list(result.scalars().all())
+
+async def _get_accessible_document_ids(db: AsyncSession, document_ids: List[int], current_user: User) -> List[int]:
+    result = await db.execute(select(Document.id).where(Document.id.in_(document_ids), Document.owner_id == current_user.id))
+    valid_doc_ids = list(result.scalars().all())
+    if len(valid_doc_ids) != len(document_ids):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to one or more documents.")
+    return valid_doc_ids
+
+async def _get_document_versions(db: AsyncSession, document_ids: List[int]) -> dict:
+    """Returns {document_id: version}; the answer cache is keyed on it."""
+    result = await db.execute(select(Document.id, Document.version).where(Document.id.in_(document_ids)))
+    return {doc_id: version for doc_id, version in result.all()}
+
+async def _answer_from_documents(db: AsyncSession, query_input: schemas.QueryInput, document_ids: List[int], llm_config: dict, trace: dict) -> tuple[str, Optional[list]]:
+    """
+    Answers a query over indexed documents in the requested mode, mapping failures to HTTP errors.
+    Returns the answer and, in extractive mode, the sentences it was built from.
+    """
+    try:
+        if query_input.mode == "extractive":
+            sentences = await asyncio.to_thread(rag_system.extract_answer, query_input.question, document_ids, expand_neighbors=query_input.expand_neighbors, timings=trace)
+            extracted = [schemas.ExtractedSentence(text=s["text"], document_id=int(s["document_id"]), chunk_id=s["chunk_id"], score=s["score"]) for s in sentences]
+            return rag_system.format_extracted_sentences(sentences), extracted
+        if query_input.mode == "map_reduce":
+            return await rag_system.amap_reduce(query_input.question, document_ids, llm_config, trace=trace), None
+        document_versions = await _get_document_versions(db, document_ids)
+        answer = await rag_system.aquery(question=query_input.question, document_ids=document_ids, llm_config=llm_config, expand_neighbors=query_input.expand_neighbors, document_versions=document_versions, trace=trace)
+        return answer, None
+    except MapReduceTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except (LLMCallError, LLMOverloadedError) as e:
+        raise _llm_http_error(e)
+
+async def _get_indexed_document_ids(db: AsyncSession, category_id: Optional[int], document_ids: Optional[List[int]], current_user: User, action: str) -> List[int]:
+    """
+    Resolves the documents a request may search, for endpoints that only work on
+    indexed documents and so cannot serve categories mapped to Google Drive.
+    """
+    if category_id:
+        category = await _get_user_category(db, category_id, current_user)
+        if category.gdrive_mapping:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{action} is not available for categories mapped to Google Drive.")
+        return await _get_category_document_ids(db, category.id)
+    if document_ids:
+        return await _get_accessible_document_ids(db, document_ids, current_user)
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Either category_id or document_ids must be provided.")
+
+def _read_drive_folder(google_credentials, folder_id: str) -> str:
+    """
+    Downloads every file in a Google Drive folder and returns their combined text.
+    Blocking; the Drive client is not thread-safe, so one call uses one client for all files.
+    """
+    gdrive_service = GoogleDriveService(google_credentials)
+    drive_files = gdrive_service.list_files(folder_id=folder_id)
+
+    contents = []
+    for file in drive_files:
+        if file['mimeType'] != 'application/vnd.google-apps.folder':
+            with gdrive_service.download_file(file['id']) as content_buffer:
+                contents.append(content_buffer.read().decode('utf-8') + "\n\n")
+    return "".join(contents)
+
+def _sse_event(event: str, data) -> str:
+    """Formats one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("/", response_model=schemas.QueryOutput)
-def query_documents(
+async def query_documents(
     query_input: schemas.QueryInput,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    llm_config_db = db.query(LLMConfig).filter(LLMConfig.id == query_input.llm_config_id).first() or \
-                    db.query(LLMConfig).filter(LLMConfig.is_default == True).first()
-    if not llm_config_db:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No LLM configuration found.")
-
-    llm_config_for_rag = { "name": llm_config_db.name, "model_name": llm_config_db.model_name, "api_key_env": llm_config_db.api_key_env }
+    llm_config_db = await _get_llm_config_db(db, query_input.llm_config_id)
+    llm_config_for_rag = _build_llm_config(llm_config_db)
 
     answer = ""
+    sentences = None
     queried_doc_ids = []
+    trace = {}
 
     if query_input.category_id:
-        category = db.query(Category).filter(Category.id == query_input.category_id, Category.user_id == current_user.id).first()
-        if not category:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+        category = await _get_user_category(db, query_input.category_id, current_user)
 
         if category.gdrive_mapping:
             if not current_user.google_credentials:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Google account not connected.")
+            if query_input.mode != "answer":
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only the default answer mode is available for categories mapped to Google Drive.")
 
-            gdrive_service = GoogleDriveService(current_user.google_credentials)
-            drive_files = gdrive_service.list_files(folder_id=category.gdrive_mapping.folder_id)
-
-            combined_content = ""
-            for file in drive_files:
-                if file['mimeType'] != 'application/vnd.google-apps.folder':
-                    content_buffer = gdrive_service.download_file(file['id'])
-                    combined_content += content_buffer.getvalue().decode('utf-8') + "\n\n"
+            combined_content = await asyncio.to_thread(_read_drive_folder, current_user.google_credentials, category.gdrive_mapping.folder_id)
 
             if not combined_content:
                 answer = "No queryable files found in the mapped Google Drive folder."
             else:
-                answer = rag_system.query_on_the_fly(question=query_input.question, content=combined_content, llm_config=llm_config_for_rag)
+                try:
+                    answer = await rag_system.aquery_on_the_fly(question=query_input.question, content=combined_content, llm_config=llm_config_for_rag, trace=trace)
+                except (LLMCallError, LLMOverloadedError) as e:
+                    raise _llm_http_error(e)
 
         else:
-            doc_ids_to_query = [doc.id for doc in category.documents]
+            doc_ids_to_query = await _get_category_document_ids(db, category.id)
             if not doc_ids_to_query:
                  answer = "No documents found in this category."
             else:
-                answer = rag_system.query(question=query_input.question, document_ids=doc_ids_to_query, llm_config=llm_config_for_rag)
+                answer, sentences = await _answer_from_documents(db, query_input, doc_ids_to_query, llm_config_for_rag, trace)
                 queried_doc_ids = doc_ids_to_query
 
     elif query_input.document_ids:
-        valid_docs = db.query(Document).filter(Document.id.in_(query_input.document_ids), Document.owner_id == current_user.id).all()
-        if len(valid_docs) != len(query_input.document_ids):
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to one or more documents.")
-
-        doc_ids_to_query = [doc.id for doc in valid_docs]
-        answer = rag_system.query(question=query_input.question, document_ids=doc_ids_to_query, llm_config=llm_config_for_rag)
+        doc_ids_to_query = await _get_accessible_document_ids(db, query_input.document_ids, current_user)
+        answer, sentences = await _answer_from_documents(db, query_input, doc_ids_to_query, llm_config_for_rag, trace)
         queried_doc_ids = doc_ids_to_query
 
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Either category_id or document_ids must be provided.")
 
-    db_query_log = QueryLog(user_id=current_user.id, query_text=query_input.question, answer_text=answer, queried_documents={"ids": queried_doc_ids})
+    db_query_log = QueryLog(user_id=current_user.id, query_text=query_input.question, answer_text=answer, queried_documents={"ids": queried_doc_ids}, **_trace_columns(trace))
     db.add(db_query_log)
 
     # Create audit log before final commit
-    create_audit_log(db, current_user, "document_query", {"question": query_input.question, "num_docs": len(queried_doc_ids)})
+    await acreate_audit_log(db, current_user, "document_query", {"question": query_input.question, "num_docs": len(queried_doc_ids), "mode": query_input.mode})
 
-    db.commit()
-    db.refresh(db_query_log)
+    await db.commit()
+
+    return schemas.QueryOutput(answer=answer, query_id=db_query_log.id, sentences=sentences)
+
+@router.post("/batch")
+async def batch_query_documents(
+    batch_input: schemas.BatchQueryInput,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Answers a list of questions against the same category or documents.
+
+    Results are streamed as newline-delimited JSON, one object per question as soon as it is
+    answered: `{"index", "question", "status": "ok", "answer"}`, or
+    `{"index", "question", "status": "error", "error"}` if the LLM call failed. A final
+    `{"done": true, "query_ids": [...]}` object follows, with the ids in question order.
+    The QueryLog rows are written in a single transaction once every answer is in; failed
+    questions get none, and their query_id is null.
+    """
+    questions = batch_input.questions
+    if not questions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one question must be provided.")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"A batch may contain at most {BATCH_MAX_QUESTIONS} questions.")
+
+    llm_config_for_rag = _build_llm_config(await _get_llm_config_db(db, batch_input.llm_config_id))
+
+    doc_ids_to_query = await _get_indexed_document_ids(db, batch_input.category_id, batch_input.document_ids, current_user, "Batch querying")
+    _ensure_llm_capacity(llm_config_for_rag)
+
+    await acreate_audit_log(db, current_user, "document_batch_query", {"num_questions": len(questions), "num_docs": len(doc_ids_to_query)})
+    user_id = current_user.id
+
+    async def no_documents():
+        for i in range(len(questions)):
+            yield i, "No documents found in this category.", None
+
+    traces = [{} for _ in questions]
+
+    async def stream_results():
+        if doc_ids_to_query:
+            results = rag_system.aquery_batch(questions, doc_ids_to_query, llm_config_for_rag, max_concurrency=BATCH_LLM_CONCURRENCY, expand_neighbors=batch_input.expand_neighbors, traces=traces)
+        else:
+            results = no_documents()
+
+        answers = {}
+        async for index, answer, error in results:
+            if error is not None:
+                yield json.dumps({"index": index, "question": questions[index], "status": "error", "error": error}) + "\n"
+                continue
+            answers[index] = answer
+            yield json.dumps({"index": index, "question": questions[index], "status": "ok", "answer": answer}) + "\n"
+
+        query_logs = {
+            i: QueryLog(user_id=user_id, query_text=questions[i], answer_text=answers[i], queried_documents={"ids": doc_ids_to_query}, **_trace_columns(traces[i]))
+            for i in range(len(questions)) if i in answers
+        }
+        db.add_all(query_logs.values())
+        await db.flush()
+        query_ids = [query_logs[i].id if i in query_logs else None for i in range(len(questions))]
+        await db.commit()
+        yield json.dumps({"done": True, "query_ids": query_ids}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.post("/stream")
+async def stream_query_documents(
+    query_input: schemas.QueryInput,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Answers a question as a stream of server-sent events.
+
+    A `retrieval` event with the chunks used comes first, then one `token` event per piece
+    of the answer as the LLM generates it, and finally a `done` event carrying the query_id.
+    The QueryLog row is written once the answer is complete. If the LLM fails, the stream
+    ends with an `error` event carrying `{"detail"}` instead, and no QueryLog row is written.
+    """
+    if query_input.mode != "answer":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only the default answer mode can be streamed; use POST /query/.")
+    llm_config_for_rag = _build_llm_config(await _get_llm_config_db(db, query_input.llm_config_id))
+    doc_ids_to_query = await _get_indexed_document_ids(db, query_input.category_id, query_input.document_ids, current_user, "Streaming")
+    _ensure_llm_capacity(llm_config_for_rag)
+    document_versions = await _get_document_versions(db, doc_ids_to_query)
+    user_id = current_user.id
+
+    async def no_documents():
+        yield "retrieval", []
+        yield "token", "No documents found in this category."
+
+    async def event_stream():
+        answer_parts = []
+        trace = {}
+        if doc_ids_to_query:
+            events = rag_system.astream_query(query_input.question, doc_ids_to_query, llm_config_for_rag, expand_neighbors=query_input.expand_neighbors, document_versions=document_versions, trace=trace)
+        else:
+            events = no_documents()
+        async for event, data in events:
+            if event == "error":
+                yield _sse_event("error", {"detail": data})
+                return
+            if event == "token":
+                answer_parts.append(data)
+            yield _sse_event(event, data)
+
+        db_query_log = QueryLog(user_id=user_id, query_text=query_input.question, answer_text="".join(answer_parts), queried_documents={"ids": doc_ids_to_query}, **_trace_columns(trace))
+        db.add(db_query_log)
+        await db.flush()
+        query_id = db_query_log.id
+        await db.commit()
+        yield _sse_event("done", {"query_id": query_id})
+
+    await acreate_audit_log(db, current_user, "document_query", {"question": query_input.question, "num_docs": len(doc_ids_to_query), "stream": True})
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/retrieve", response_model=schemas.RetrieveOutput)
+async def retrieve_passages(
+    retrieve_input: schemas.RetrieveInput,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Returns the most relevant chunks for a question without calling an LLM.
+    A QueryLog row is only written when `log_query` is set.
+    """
+    doc_ids_to_query = await _get_indexed_document_ids(db, retrieve_input.category_id, retrieve_input.document_ids, current_user, "Retrieval")
+
+    passages = await asyncio.to_thread(rag_system.retrieve, retrieve_input.question, doc_ids_to_query, top_k=retrieve_input.top_k) if doc_ids_to_query else []
+    results = [
+        schemas.RetrievedChunk(
+            chunk_id=p["chunk_id"],
+            document_id=int(p["document_id"]),
+            text=p["text"],
+            score=p["score"],
+            start=p["start"],
+            end=p["end"],
+        )
+        for p in passages
+    ]
+
+    query_id = None
+    if retrieve_input.log_query:
+        db_query_log = QueryLog(user_id=current_user.id, query_text=retrieve_input.question, answer_text="", queried_documents={"ids": doc_ids_to_query})
+        db.add(db_query_log)
+        await acreate_audit_log(db, current_user, "document_retrieve", {"question": retrieve_input.question, "num_docs": len(doc_ids_to_query)})
+        await db.commit()
+        query_id = db_query_log.id
 
-    return schemas.QueryOutput(answer=answer, query_id=db_query_log.id)
+    return schemas.RetrieveOutput(results=results, query_id=query_id)
 
 @router.post("/{query_id}/save_as_document", response_model=schemas.DocumentOut)
 def save_query_as_document(
@@ -106,7 +412,7 @@ def save_query_as_document(
     file_buffer = export_service.to_txt(content)
 
     unique_filename = f"{uuid.uuid4()}_{new_filename}.txt"
-    storage_service.upload(file_buffer.getvalue(), unique_filename)
+    storage_service.upload(unique_filename, file_buffer.getvalue())
 
     categories = []
     if category_ids:
@@ -119,12 +425,14 @@ def save_query_as_document(
         original_filename=new_filename,
         owner_id=current_user.id,
         created_at=datetime.utcnow(),
+        size=len(file_buffer.getvalue()),
         categories=categories,
     )
     db.add(db_document)
+    enqueue_ingestion(db, db_document)
     db.commit()
     db.refresh(db_document)
-    rag_system.process_document(document_id=db_document.id, document_text=content)
+    wake_ingestion_workers()
     return db_document
 
 @router.get("/{query_id}/export")
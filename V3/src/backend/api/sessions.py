@@ -0,0 +1,123 @@
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List
+
+from src.backend.data import schemas
+from src.backend.data.database import get_async_db
+from src.backend.data.models import ChatSession, ChatTurn, QueryLog, User
+from src.backend.api.auth import get_current_active_user
+from src.backend.api.query import rag_system, _build_llm_config, _get_llm_config_db, _get_indexed_document_ids, _llm_http_error, _trace_columns
+from src.backend.core.audit import acreate_audit_log
+from src.backend.core.rag_system import LLMCallError
+from src.backend.core.llm_scheduler import LLMOverloadedError
+from src.backend.core.conversation import format_history, history_tokens, session_candidates, SESSION_HISTORY_TOKENS, SESSION_RECENT_TURNS
+
+router = APIRouter()
+
+async def _get_user_session(db: AsyncSession, session_id: int, current_user: User) -> ChatSession:
+    result = await db.execute(
+        select(ChatSession)
+        .options(selectinload(ChatSession.turns))
+        .where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
+    )
+    chat_session = result.scalar_one_or_none()
+    if not chat_session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+    return chat_session
+
+@router.post("/", response_model=schemas.ChatSessionOut, status_code=status.HTTP_201_CREATED)
+async def create_chat_session(
+    session_input: schemas.ChatSessionCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Starts a chat session over a set of documents or a category. The documents are resolved
+    once, when the session is created. Without an llm_config_id, every turn is routed.
+    """
+    document_ids = await _get_indexed_document_ids(db, session_input.category_id, session_input.document_ids, current_user, "Chat")
+    if session_input.llm_config_id is not None:
+        await _get_llm_config_db(db, session_input.llm_config_id)
+    chat_session = ChatSession(user_id=current_user.id, title=session_input.title, document_ids=document_ids, llm_config_id=session_input.llm_config_id)
+    db.add(chat_session)
+    await db.commit()
+    await acreate_audit_log(db, current_user, "chat_session_create", {"session_id": chat_session.id, "num_docs": len(document_ids)})
+    return chat_session
+
+@router.get("/", response_model=List[schemas.ChatSessionOut])
+async def list_chat_sessions(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user),
+    limit: int = 100,
+):
+    result = await db.execute(
+        select(ChatSession).where(ChatSession.user_id == current_user.id).order_by(ChatSession.updated_at.desc()).limit(limit)
+    )
+    return result.scalars().all()
+
+@router.get("/{session_id}", response_model=schemas.ChatSessionDetail)
+async def get_chat_session(
+    session_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    return await _get_user_session(db, session_id, current_user)
+
+@router.post("/{session_id}/messages", response_model=schemas.ChatTurnOut)
+async def send_chat_message(
+    session_id: int,
+    message: schemas.ChatMessageInput,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Answers a question in the context of the session.
+
+    The conversation so far is sent as the rolling summary plus the latest turns, capped at
+    SESSION_HISTORY_TOKENS. Once the turns no longer fit, all but the last SESSION_RECENT_TURNS
+    are folded into the summary after answering, so the prompt stays the same size however
+    long the conversation runs. Each turn is also written to the query history.
+    """
+    chat_session = await _get_user_session(db, session_id, current_user)
+    llm_config_for_rag = _build_llm_config(await _get_llm_config_db(db, chat_session.llm_config_id))
+    open_turns = [turn for turn in chat_session.turns if not turn.summarized]
+    history = format_history(chat_session.summary, [(turn.question, turn.answer) for turn in open_turns])
+
+    trace = {}
+    try:
+        answer = await rag_system.achat(chat_session.id, message.question, history, chat_session.document_ids, llm_config_for_rag, expand_neighbors=message.expand_neighbors, trace=trace)
+    except (LLMCallError, LLMOverloadedError) as e:
+        raise _llm_http_error(e)
+
+    db_query_log = QueryLog(user_id=current_user.id, query_text=message.question, answer_text=answer, queried_documents={"ids": chat_session.document_ids}, **_trace_columns(trace))
+    db.add(db_query_log)
+    await db.flush()
+    turn = ChatTurn(session_id=chat_session.id, question=message.question, answer=answer, query_log_id=db_query_log.id)
+    db.add(turn)
+    open_turns.append(turn)
+
+    turns_text = [(t.question, t.answer) for t in open_turns]
+    if len(open_turns) > SESSION_RECENT_TURNS and history_tokens(chat_session.summary, turns_text) > SESSION_HISTORY_TOKENS:
+        folded = open_turns[:-SESSION_RECENT_TURNS]
+        chat_session.summary = await rag_system.asummarize_history(chat_session.summary, turns_text[:-SESSION_RECENT_TURNS], llm_config_for_rag, SESSION_HISTORY_TOKENS // 2)
+        for folded_turn in folded:
+            folded_turn.summarized = True
+    chat_session.updated_at = datetime.datetime.utcnow()
+    await db.commit()
+    await acreate_audit_log(db, current_user, "document_query", {"question": message.question, "num_docs": len(chat_session.document_ids), "session_id": chat_session.id})
+    return turn
+
+@router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_chat_session(
+    session_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    chat_session = await _get_user_session(db, session_id, current_user)
+    await db.delete(chat_session)
+    await db.commit()
+    session_candidates.invalidate(session_id)
+    return None
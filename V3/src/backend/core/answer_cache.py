@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+# Maximum number of cached answers kept in memory.
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 1024))
+# Seconds an answer stays valid even if none of its documents change.
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+# Minimum cosine similarity between question embeddings for a semantic hit. Set above 1 to disable.
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?.!]+$")
+
+def normalize_question(question: str) -> str:
+    """Lower-cases the question and collapses whitespace and trailing punctuation."""
+    return _TRAILING_PUNCTUATION_RE.sub("", _WHITESPACE_RE.sub(" ", question.strip().lower()))
+
+class AnswerCache:
+    """
+    A thread-safe LRU cache of LLM answers with a time-to-live.
+
+    Entries are keyed by the normalized question and a scope: the searched documents with
+    their versions, the LLM config and the prompt. A question that misses exactly can still
+    hit an entry of the same scope whose question embedding is similar enough.
+    Entries are dropped when one of their documents is reindexed or deleted.
+    """
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS, similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._keys_by_document = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._semantic_hits = 0
+        self._misses = 0
+        self._llm_ms_saved = 0.0
+
+    @staticmethod
+    def make_scope(document_versions: dict, llm_key: tuple, prompt_key: str) -> tuple:
+        return (tuple(sorted((int(doc_id), version) for doc_id, version in document_versions.items())), llm_key, prompt_key)
+
+    def get(self, question: str, scope: tuple, question_embedding: Optional[list[float]] = None) -> Optional[str]:
+        """
+        Returns the cached answer for the question within the scope, or None on a miss.
+        """
+        key = (normalize_question(question), scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None and question_embedding is not None:
+                key, entry = self._find_similar(scope, question_embedding, now)
+                if entry is not None:
+                    self._semantic_hits += 1
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._llm_ms_saved += entry["llm_ms"]
+            return entry["answer"]
+
+    def _find_similar(self, scope: tuple, question_embedding: list[float], now: float) -> tuple:
+        """Returns the live entry of the scope with the most similar question, if similar enough."""
+        query = np.asarray(question_embedding, dtype=np.float64)
+        query_norm = np.linalg.norm(query)
+        if not query_norm:
+            return None, None
+        best_key, best_entry, best_similarity = None, None, self.similarity
+        for key, entry in self._entries.items():
+            if key[1] != scope or entry["embedding"] is None or entry["expires_at"] <= now:
+                continue
+            similarity = float(entry["embedding"] @ query) / (entry["norm"] * query_norm)
+            if similarity >= best_similarity:
+                best_key, best_entry, best_similarity = key, entry, similarity
+        return best_key, best_entry
+
+    def set(self, question: str, scope: tuple, answer: str, llm_ms: float, question_embedding: Optional[list[float]] = None):
+        """
+        Stores an answer together with the LLM time it took, which is counted as saved on every hit.
+        """
+        key = (normalize_question(question), scope)
+        embedding = np.asarray(question_embedding, dtype=np.float64) if question_embedding is not None else None
+        entry = {
+            "answer": answer,
+            "llm_ms": llm_ms,
+            "embedding": embedding,
+            "norm": float(np.linalg.norm(embedding)) if embedding is not None else 0.0,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            for doc_id, _ in scope[0]:
+                self._keys_by_document.setdefault(doc_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        if self._entries.pop(key, None) is None:
+            return
+        for doc_id, _ in key[1][0]:
+            keys = self._keys_by_document.get(doc_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_document[doc_id]
+
+    def invalidate_document(self, document_id: int):
+        """Drops every cached answer that was built from the document."""
+        with self._lock:
+            for key in list(self._keys_by_document.get(int(document_id), ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_document.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "semantic_hits": self._semantic_hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "llm_ms_saved": round(self._llm_ms_saved, 1),
+            }
+
+# Shared by every RAGSystem instance and reported by the admin API.
+answer_cache = AnswerCache()
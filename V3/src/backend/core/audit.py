@@ -1,4 +1,5 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.backend.data.models import AuditLog, User
 
 def create_audit_log(
@@ -17,3 +18,20 @@ def create_audit_log(
     )
     db.add(log_entry)
     db.commit()
+
+async def acreate_audit_log(
+    db: AsyncSession,
+    user: User,
+    action: str,
+    details: dict = None
+):
+    """
+    Creates an entry in the audit log using an async session.
+    """
+    log_entry = AuditLog(
+        user_id=user.id if user else None,
+        action=action,
+        details=details
+    )
+    db.add(log_entry)
+    await db.commit()
@@ -0,0 +1,102 @@
+import tiktoken
+
+PASSAGE_SEPARATOR = "\n\n---\n\n"
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """
+    Returns the approximate number of tokens in the text.
+    """
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts the text down to at most max_tokens tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def merge_passages(passages: list[dict]) -> list[dict]:
+    """
+    Merges overlapping or adjacent passages from the same document.
+
+    Each passage is a dict with "text", "document_id", "score" and, for chunks indexed
+    with offsets, "chunk_index", "start" and "end". Overlapping text is kept only once.
+    Passages without offsets are returned unchanged.
+    """
+    by_document = {}
+    merged = []
+    for passage in passages:
+        if passage.get("start") is None:
+            merged.append(dict(passage))
+        else:
+            by_document.setdefault(passage["document_id"], []).append(passage)
+
+    for items in by_document.values():
+        items.sort(key=lambda p: p["start"])
+        current = dict(items[0])
+        for passage in items[1:]:
+            if passage["start"] <= current["end"]:
+                # Overlap: only append the part of the passage that is not already included.
+                if passage["end"] > current["end"]:
+                    current["text"] += passage["text"][current["end"] - passage["start"]:]
+                    current["end"] = passage["end"]
+            elif passage.get("chunk_index") is not None and passage["chunk_index"] == current.get("chunk_index", -2) + 1:
+                # Consecutive chunks separated only by whitespace the splitter stripped.
+                current["text"] += "\n" + passage["text"]
+                current["end"] = passage["end"]
+            else:
+                merged.append(current)
+                current = dict(passage)
+                continue
+            current["chunk_index"] = passage.get("chunk_index")
+            current["score"] = max(current["score"], passage["score"])
+        merged.append(current)
+    return merged
+
+def pack_context(passages: list[dict], token_budget: int) -> str:
+    """
+    Builds the context string for the prompt from the retrieved passages.
+
+    Passages are merged, then selected greedily by score until the token budget is used up,
+    and finally emitted grouped by document in reading order.
+    """
+    merged = merge_passages(passages)
+    if not merged:
+        return ""
+
+    by_score = sorted(merged, key=lambda p: p["score"], reverse=True)
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    selected = []
+    used = 0
+    for passage in by_score:
+        cost = count_tokens(passage["text"]) + (separator_tokens if selected else 0)
+        if used + cost > token_budget:
+            continue
+        selected.append(passage)
+        used += cost
+
+    if not selected:
+        # Even the best passage does not fit on its own; send as much of it as we can.
+        best = dict(by_score[0])
+        best["text"] = truncate_to_tokens(best["text"], token_budget)
+        selected = [best] if best["text"] else []
+
+    # Documents keep the order of their best passage, passages within a document their position.
+    document_rank = {}
+    for passage in selected:
+        document_rank.setdefault(passage["document_id"], len(document_rank))
+    selected.sort(key=lambda p: (document_rank[p["document_id"]], p.get("start") or 0))
+    return PASSAGE_SEPARATOR.join(p["text"] for p in selected)
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+from src.backend.core.context import count_tokens
+
+# Number of chat sessions whose retrieval candidates are kept in memory.
+SESSION_CANDIDATE_CACHE_SIZE = int(os.environ.get("SESSION_CANDIDATE_CACHE_SIZE", 256))
+# Maximum number of candidate chunks kept per session; the least relevant to the latest turn go first.
+SESSION_MAX_CANDIDATES = int(os.environ.get("SESSION_MAX_CANDIDATES", 50))
+# Minimum cosine similarity between a follow-up and the previous question for the candidates to be reused as they are.
+SESSION_REUSE_SIMILARITY = float(os.environ.get("SESSION_REUSE_SIMILARITY", 0.8))
+# Token cap for the conversation history sent with each question: rolling summary plus recent turns.
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", 1000))
+# Number of latest turns kept word for word; older turns are folded into the rolling summary.
+SESSION_RECENT_TURNS = int(os.environ.get("SESSION_RECENT_TURNS", 2))
+# Seconds a turn waits for the LLM to update the rolling summary before keeping the folded turns as plain text.
+SESSION_SUMMARY_TIMEOUT_SECONDS = float(os.environ.get("SESSION_SUMMARY_TIMEOUT_SECONDS", 10))
+
+def format_turn(question: str, answer: str) -> str:
+    return f"User: {question}\nAssistant: {answer}"
+
+def history_tokens(summary: str, turns: list[tuple[str, str]]) -> int:
+    """Returns the token count of the full, uncapped history."""
+    return count_tokens(summary) + sum(count_tokens(format_turn(question, answer)) for question, answer in turns)
+
+def format_history(summary: str, turns: list[tuple[str, str]], max_tokens: int = SESSION_HISTORY_TOKENS) -> str:
+    """
+    Returns the conversation so far as prompt text: the rolling summary, then as many of the
+    latest (question, answer) turns as fit in max_tokens. Older turns that do not fit are left
+    out; they are expected to be in the summary already.
+    """
+    parts = [f"Summary of the conversation so far: {summary}"] if summary else []
+    budget = max_tokens - sum(count_tokens(part) for part in parts)
+    recent = []
+    for question, answer in reversed(turns):
+        text = format_turn(question, answer)
+        budget -= count_tokens(text)
+        if budget < 0:
+            break
+        recent.insert(0, text)
+    return "\n\n".join(parts + recent)
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+class CandidateSet:
+    """
+    The chunks retrieved so far in a chat session, with their embeddings.
+
+    Follow-up questions are ranked against these embeddings directly, so reusing the
+    candidates costs neither a vector search nor re-embedding any chunk.
+    """
+    def __init__(self, document_ids: list[int]):
+        self.document_ids = sorted(int(doc_id) for doc_id in document_ids)
+        self.passages = []
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.last_query_embedding = None
+        # Held while a turn searches and re-ranks, in case two turns of a session overlap.
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def is_follow_up(self, query_embedding: list[float], top_k: int) -> bool:
+        """Returns whether the question is close enough to the previous one to answer from the held candidates."""
+        if self.last_query_embedding is None or len(self.passages) < top_k:
+            return False
+        query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        return float(query @ self.last_query_embedding) >= SESSION_REUSE_SIMILARITY
+
+    def merge(self, passages: list[dict], embeddings: list[list[float]]):
+        """Adds newly retrieved chunks; chunks already held are skipped."""
+        held = {passage["chunk_id"] for passage in self.passages}
+        new = [(passage, embedding) for passage, embedding in zip(passages, embeddings) if passage["chunk_id"] not in held]
+        if not new:
+            return
+        new_embeddings = _normalize_rows(np.asarray([embedding for _, embedding in new], dtype=np.float32))
+        self.passages += [passage for passage, _ in new]
+        self.embeddings = new_embeddings if not len(self.embeddings) else np.vstack([self.embeddings, new_embeddings])
+
+    def rank(self, query_embedding: list[float], top_k: int) -> list[dict]:
+        """
+        Returns the top_k held chunks by cosine similarity to the question, which becomes the
+        previous question for the next turn. Beyond SESSION_MAX_CANDIDATES, the chunks least
+        similar to it are dropped.
+        """
+        if not self.passages:
+            return []
+        query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        self.last_query_embedding = query
+        scores = self.embeddings @ query
+        order = np.argsort(-scores)
+        if len(order) > SESSION_MAX_CANDIDATES:
+            keep = np.sort(order[:SESSION_MAX_CANDIDATES])
+            self.passages = [self.passages[i] for i in keep]
+            self.embeddings = self.embeddings[keep]
+            scores = scores[keep]
+            order = np.argsort(-scores)
+        return [{**self.passages[i], "score": float(scores[i])} for i in order[:top_k]]
+
+class SessionCandidateCache:
+    """
+    A thread-safe LRU map from chat session id to its CandidateSet.
+
+    Only a speed-up: a session whose candidates were evicted, or were dropped because one of
+    its documents changed, simply retrieves from scratch on its next turn.
+    """
+    def __init__(self, max_size: int = SESSION_CANDIDATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: int, document_ids: list[int]) -> Optional[CandidateSet]:
+        """Returns the session's candidates, or None if there are none for these documents."""
+        with self._lock:
+            candidates = self._entries.get(session_id)
+            if candidates is None:
+                return None
+            if candidates.document_ids != sorted(int(doc_id) for doc_id in document_ids):
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return candidates
+
+    def set(self, session_id: int, candidates: CandidateSet):
+        with self._lock:
+            self._entries[session_id] = candidates
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: int):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def invalidate_document(self, document_id: int):
+        """Drops the candidates of every session that searches the document."""
+        with self._lock:
+            for session_id in [sid for sid, c in self._entries.items() if int(document_id) in c.document_ids]:
+                del self._entries[session_id]
+
+# Shared by every RAGSystem instance.
+session_candidates = SessionCandidateCache()
@@ -0,0 +1,132 @@
+import io
+import os
+import shutil
+import signal
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from typing import BinaryIO, Optional, Union
+import pypdf
+import docx
+
+try:
+    import resource
+except ImportError: # Not available on Windows; extraction then runs without a memory cap.
+    resource = None
+
+# File types whose text can be extracted for indexing.
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+# Processes extracting PDF pages in parallel.
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+# Pages per task handed to a process; smaller ranges spread long PDFs more evenly.
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 25))
+# Seconds a single page may take before it is skipped, so one malformed page cannot stall ingestion.
+PDF_PAGE_TIMEOUT_SECONDS = float(os.environ.get("PDF_PAGE_TIMEOUT_SECONDS", 10))
+# Address-space cap of each extraction process in MB; 0 disables it.
+PDF_EXTRACTION_MEMORY_MB = int(os.environ.get("PDF_EXTRACTION_MEMORY_MB", 2048))
+
+class _PageTimeout(Exception):
+    pass
+
+def _raise_page_timeout(signum, frame):
+    raise _PageTimeout()
+
+def _init_extraction_process(memory_mb: int):
+    if resource is not None and memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+def _extract_page_range(path: str, start: int, stop: int, page_timeout: float) -> tuple[list[str], list[int]]:
+    """
+    Runs in an extraction process. Returns the text of pages start to stop - 1 and the numbers
+    of the pages skipped because they timed out, ran out of memory or failed to parse.
+    """
+    reader = pypdf.PdfReader(path)
+    texts, skipped = [], []
+    use_alarm = hasattr(signal, "setitimer") and page_timeout > 0
+    for page_number in range(start, stop):
+        try:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, page_timeout)
+            texts.append(reader.pages[page_number].extract_text() or "")
+        except Exception: # _PageTimeout, MemoryError past the cap, or a page pypdf cannot parse
+            skipped.append(page_number)
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    return texts, skipped
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the API process runs threads, which do not survive a fork safely.
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_extraction_process,
+                initargs=(PDF_EXTRACTION_MEMORY_MB,),
+            )
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def extract_pdf_text(path: str) -> str:
+    """
+    Returns the text of the PDF at path. Page ranges are extracted in parallel by a process
+    pool; each page gets PDF_PAGE_TIMEOUT_SECONDS and each process at most
+    PDF_EXTRACTION_MEMORY_MB. Pages that exceed either are skipped with a warning rather than
+    failing the whole document.
+    """
+    page_count = len(pypdf.PdfReader(path).pages)
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    pool = _get_pool()
+    try:
+        futures = [pool.submit(_extract_page_range, path, start, stop, PDF_PAGE_TIMEOUT_SECONDS) for start, stop in ranges]
+        results = [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        # A process died (e.g. killed for memory); start a fresh pool for the next document.
+        _reset_pool()
+        raise RuntimeError(f"PDF extraction process failed: {e}")
+
+    skipped = [page_number for _, range_skipped in results for page_number in range_skipped]
+    if skipped:
+        print(f"WARNING: Skipped {len(skipped)} unreadable PDF page(s) in '{path}': {[n + 1 for n in skipped][:20]}")
+    return "".join(text for texts, _ in results for text in texts)
+
+def extract_text(filename: str, content: Union[bytes, BinaryIO]) -> str:
+    """
+    Returns the text of a PDF, DOCX or TXT file, chosen by the filename's extension.
+    content is the file's bytes or a binary file-like object positioned at its start.
+    Raises ValueError for other file types.
+    """
+    stream = io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
+    filename = filename.lower()
+
+    if filename.endswith(".pdf"):
+        # The extraction processes read the PDF from disk rather than each getting a copy of the bytes.
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+            shutil.copyfileobj(stream, pdf_file)
+        try:
+            return extract_pdf_text(pdf_file.name)
+        finally:
+            os.remove(pdf_file.name)
+    if filename.endswith(".docx"):
+        doc = docx.Document(stream)
+        return "".join(para.text + "\n" for para in doc.paragraphs)
+    if filename.endswith(".txt"):
+        return stream.read().decode("utf-8")
+    raise ValueError(f"Unsupported file type: {filename}")
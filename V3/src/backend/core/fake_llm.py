@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from pydantic import PrivateAttr
+
+_WORD_RE = re.compile(r"\w+")
+
+class FakeLLMError(RuntimeError):
+    """Raised by FakeLLM for injected failures."""
+
+class FakeLLM(LLM):
+    """
+    An offline LLM for load tests and CI.
+
+    The answer is derived only from the prompt, so the same prompt always gets the same
+    answer. Timing is simulated: the time to first token is drawn from the configured latency
+    distribution, after which tokens arrive at tokens_per_second. A share of calls given by
+    error_rate fails with FakeLLMError before the first token. Latency and errors are drawn
+    from a generator seeded with seed, so a load test run can be repeated exactly.
+
+    Options are set through an LLMConfig's llm_options, e.g.
+    {"latency_distribution": "lognormal", "ttft_ms": 800, "latency_sigma": 0.5, "tokens_per_second": 40}.
+    """
+    latency_distribution: str = "fixed" # "fixed", "uniform" or "lognormal"
+    ttft_ms: float = 200.0 # Median time to first token
+    latency_sigma: float = 0.5 # Spread: sigma of the lognormal, or +/- fraction of ttft_ms for uniform
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 30
+    error_rate: float = 0.0
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {
+            "latency_distribution": self.latency_distribution,
+            "ttft_ms": self.ttft_ms,
+            "tokens_per_second": self.tokens_per_second,
+            "answer_tokens": self.answer_tokens,
+            "error_rate": self.error_rate,
+        }
+
+    def _answer_tokens(self, prompt: str) -> List[str]:
+        """Picks answer words from the prompt, seeded by the prompt's hash."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        prompt_rng = random.Random(int.from_bytes(digest[:8], "big"))
+        words = _WORD_RE.findall(prompt) or ["fake"]
+        picked = [prompt_rng.choice(words) for _ in range(self.answer_tokens)]
+        return [f"[fake:{digest[:4].hex()}]"] + [f" {word}" for word in picked]
+
+    def _time_to_first_token(self) -> float:
+        """Draws the time to first token in seconds and decides whether this call fails."""
+        if self.latency_distribution == "lognormal":
+            ttft_ms = self._rng.lognormvariate(0.0, self.latency_sigma) * self.ttft_ms
+        elif self.latency_distribution == "uniform":
+            ttft_ms = self._rng.uniform(self.ttft_ms * (1 - self.latency_sigma), self.ttft_ms * (1 + self.latency_sigma))
+        else:
+            ttft_ms = self.ttft_ms
+        if self._rng.random() < self.error_rate:
+            raise FakeLLMError("Injected fake LLM failure.")
+        return max(ttft_ms, 0.0) / 1000
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        tokens = self._answer_tokens(prompt)
+        time.sleep(self._time_to_first_token() + self._token_delay() * (len(tokens) - 1))
+        return "".join(tokens)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        tokens = self._answer_tokens(prompt)
+        await asyncio.sleep(self._time_to_first_token() + self._token_delay() * (len(tokens) - 1))
+        return "".join(tokens)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        tokens = self._answer_tokens(prompt)
+        time.sleep(self._time_to_first_token())
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self._token_delay())
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        tokens = self._answer_tokens(prompt)
+        await asyncio.sleep(self._time_to_first_token())
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self._token_delay())
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
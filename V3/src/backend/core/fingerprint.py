@@ -0,0 +1,81 @@
+import hashlib
+import random
+import re
+import numpy as np
+
+SIMHASH_BITS = 64
+# The fingerprint is split into LSH_BANDS bands. Two fingerprints within NEAR_DUPLICATE_DISTANCE
+# bits of each other always share at least one band (NEAR_DUPLICATE_DISTANCE < LSH_BANDS),
+# so band equality finds every near-duplicate candidate.
+LSH_BANDS = 4
+BAND_BITS = SIMHASH_BITS // LSH_BANDS
+NEAR_DUPLICATE_DISTANCE = 3
+
+# MinHash signatures estimate the Jaccard similarity of two documents' shingle sets.
+MINHASH_PERMUTATIONS = 64
+NEAR_DUPLICATE_JACCARD = 0.8
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_MINHASH_BLOCK_SIZE = 10000
+# Fixed seed: signatures are stored and must stay comparable across processes and restarts.
+_permutation_rng = random.Random(20240501)
+_PERMUTATION_A = np.array([_permutation_rng.randrange(1, (1 << 61) - 1) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+_PERMUTATION_B = np.array([_permutation_rng.randrange(0, (1 << 61) - 1) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+
+_WORD_RE = re.compile(r"\w+")
+
+def _shingles(text: str, size: int = 3) -> list[str]:
+    """Returns the overlapping word n-grams of the normalized text."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+def simhash(text: str) -> int:
+    """
+    Computes a 64-bit SimHash of the text over word 3-gram shingles.
+    Texts that differ in only a few words get fingerprints a few bits apart.
+    """
+    weights = [0] * SIMHASH_BITS
+    for shingle in _shingles(text):
+        value = _hash64(shingle)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (value >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def is_near_duplicate(a: int, b: int) -> bool:
+    return hamming_distance(a, b) <= NEAR_DUPLICATE_DISTANCE
+
+def lsh_bands(fingerprint: int) -> list[int]:
+    """Splits a fingerprint into its LSH band values."""
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(LSH_BANDS)]
+
+def minhash_signature(text: str) -> list[int]:
+    """
+    Computes a MinHash signature of the text's word 3-gram shingles.
+    Returns an empty list for text without words.
+    """
+    shingle_hashes = np.array(sorted({_hash64(s) & 0xFFFFFFFF for s in _shingles(text)}), dtype=np.uint64)
+    if not len(shingle_hashes):
+        return []
+    signature = np.full(MINHASH_PERMUTATIONS, _MAX_HASH, dtype=np.uint64)
+    # Hash in blocks so very long documents do not build one huge (shingles x permutations) matrix.
+    for start in range(0, len(shingle_hashes), _MINHASH_BLOCK_SIZE):
+        block = shingle_hashes[start:start + _MINHASH_BLOCK_SIZE]
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(block, _PERMUTATION_A) + _PERMUTATION_B) % _MERSENNE_PRIME & _MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.tolist()
+
+def estimate_jaccard(signature_a: list[int], signature_b: list[int]) -> float:
+    """Estimates the Jaccard similarity of two documents from their MinHash signatures."""
+    if not signature_a or len(signature_a) != len(signature_b):
+        return 0.0
+    return float(np.mean(np.asarray(signature_a) == np.asarray(signature_b)))
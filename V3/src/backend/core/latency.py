@@ -0,0 +1,35 @@
+import os
+import threading
+from collections import deque
+from typing import Optional
+import numpy as np
+
+# Number of recent call durations kept per LLM config.
+LATENCY_WINDOW = int(os.environ.get("LLM_LATENCY_WINDOW", 200))
+# Percentiles are only reported once this many calls have been observed.
+LATENCY_MIN_SAMPLES = int(os.environ.get("LLM_LATENCY_MIN_SAMPLES", 20))
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of recent successful call durations per LLM config.
+    """
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, config_id, seconds: float):
+        with self._lock:
+            self._samples.setdefault(config_id, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, config_id, percent: float) -> Optional[float]:
+        """Returns the percentile of recent durations in seconds, or None while there are too few samples."""
+        with self._lock:
+            samples = list(self._samples.get(config_id, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, percent))
+
+# Shared by every RAGSystem instance; hedging reads each config's p95 from it.
+llm_latency = LatencyTracker()
@@ -0,0 +1,143 @@
+import os
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
+import httpx
+
+# Maximum number of ready LLM chains (and their connection pools) kept alive.
+LLM_CLIENT_CACHE_SIZE = int(os.environ.get("LLM_CLIENT_CACHE_SIZE", 16))
+# Idle keep-alive connections each cached client may hold to its provider.
+LLM_MAX_IDLE_CONNECTIONS = int(os.environ.get("LLM_MAX_IDLE_CONNECTIONS", 4))
+
+# The config entries that change which client gets built. Others, such as the context window,
+# only affect prompt assembly and must not fragment the cache.
+_CLIENT_CONFIG_KEYS = ("id", "type", "model_name", "api_key_env", "api_endpoint", "options")
+
+# Keeps the tasks closing async clients alive until they finish.
+_closing_tasks = set()
+
+def close_http_clients(clients: list):
+    """
+    Closes the HTTP clients of a chain that is no longer cached. Async clients are closed on
+    the running event loop if there is one.
+    """
+    for client in clients:
+        try:
+            if isinstance(client, httpx.AsyncClient):
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    asyncio.run(client.aclose())
+                else:
+                    task = loop.create_task(client.aclose())
+                    _closing_tasks.add(task)
+                    task.add_done_callback(_closing_tasks.discard)
+            else:
+                client.close()
+        except Exception as e:
+            print(f"WARNING: Failed to close an LLM HTTP client: {e}")
+
+class _CachedChain:
+    """A cached chain with the HTTP clients it owns and the number of calls using it."""
+    def __init__(self, chain, clients: list):
+        self.chain = chain
+        self.clients = clients
+        self.users = 0
+        self.dropped = False
+        self.closed = False
+
+class LLMClientCache:
+    """
+    A thread-safe, size-bounded LRU cache of ready LLM chains keyed by their effective config.
+    Reusing a chain reuses its HTTP connection pool, so queries skip connection and TLS setup.
+
+    Chains are leased for the duration of a call. The pools of chains that are evicted or
+    invalidated are closed once the last call using them has finished, so a call in flight
+    (a long stream, say) never loses its connection to a cache change.
+    """
+    def __init__(self, max_size: int = LLM_CLIENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict() # key -> _CachedChain
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(llm_config: dict) -> tuple:
+        def hashable(value):
+            return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+        return tuple((key, hashable(llm_config.get(key))) for key in _CLIENT_CONFIG_KEYS)
+
+    @contextmanager
+    def lease(self, llm_config: dict, factory: Callable[[dict], tuple]):
+        """
+        Yields the cached chain for the config, keeping its clients open until the block exits.
+        On a miss, factory builds the chain and returns (chain, http_clients), the clients being
+        what to close once the chain has left the cache and is no longer in use.
+        """
+        key = self.make_key(llm_config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+
+        if entry is None:
+            # Build outside the lock so a slow client setup does not block other configs.
+            built = _CachedChain(*factory(llm_config))
+            evicted = []
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # Another thread built the same chain first; keep a single instance.
+                    self._entries.move_to_end(key)
+                    evicted.append(built)
+                else:
+                    entry = self._entries[key] = built
+                    while len(self._entries) > self.max_size:
+                        evicted.append(self._entries.popitem(last=False)[1])
+                entry.users += 1
+            self._drop(evicted)
+
+        try:
+            yield entry.chain
+        finally:
+            with self._lock:
+                entry.users -= 1
+                close = self._should_close(entry)
+            if close:
+                close_http_clients(entry.clients)
+
+    @staticmethod
+    def _should_close(entry: _CachedChain) -> bool:
+        """Marks a dropped, unused entry closed and tells whether to close it. Call with the lock held."""
+        if entry.dropped and entry.users == 0 and not entry.closed:
+            entry.closed = True
+            return True
+        return False
+
+    def _drop(self, entries: list):
+        """Closes the clients of entries removed from the cache, or leaves that to their last user."""
+        with self._lock:
+            for entry in entries:
+                entry.dropped = True
+            to_close = [entry for entry in entries if self._should_close(entry)]
+        for entry in to_close:
+            close_http_clients(entry.clients)
+
+    def invalidate(self, config_id: int):
+        """Drops every cached chain built from the LLMConfig with the given id."""
+        with self._lock:
+            stale_keys = [key for key in self._entries if dict(key).get("id") == config_id]
+            stale = [self._entries.pop(key) for key in stale_keys]
+        self._drop(stale)
+
+    def clear(self):
+        with self._lock:
+            stale = list(self._entries.values())
+            self._entries.clear()
+        self._drop(stale)
+
+# Shared by every RAGSystem instance and invalidated by the admin API.
+llm_client_cache = LLMClientCache()
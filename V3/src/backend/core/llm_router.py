@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from src.backend.core.llm_scheduler import llm_scheduler
+
+# Target LLM latency; configs whose average stays below it are chosen by cost.
+LLM_ROUTER_LATENCY_SLO_MS = float(os.environ.get("LLM_ROUTER_LATENCY_SLO_MS", 5000))
+# Configs whose average error rate is above this are avoided while another config is healthy.
+LLM_ROUTER_MAX_ERROR_RATE = float(os.environ.get("LLM_ROUTER_MAX_ERROR_RATE", 0.2))
+# Weight of the newest call in the moving averages.
+LLM_ROUTER_ALPHA = float(os.environ.get("LLM_ROUTER_ALPHA", 0.2))
+# Seconds after which a config's averages are considered stale, so a slow or failing config is tried again.
+LLM_ROUTER_STATS_TTL_SECONDS = float(os.environ.get("LLM_ROUTER_STATS_TTL_SECONDS", 300))
+
+# Token counts assumed per call before any call has been measured.
+DEFAULT_PROMPT_TOKENS = 1000
+DEFAULT_COMPLETION_TOKENS = 200
+
+def call_cost(llm_config: dict, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """
+    Returns the price of one call from the config's per-1k-token prices, or None if either
+    price is unknown. A price of 0.0 means the model is free, not that its price is missing.
+    """
+    prompt_price = llm_config.get("cost_per_1k_prompt_tokens")
+    completion_price = llm_config.get("cost_per_1k_completion_tokens")
+    if prompt_price is None or completion_price is None:
+        return None
+    return prompt_tokens / 1000 * prompt_price + completion_tokens / 1000 * completion_price
+
+class LLMRouter:
+    """
+    Picks the LLM config for queries that do not name one.
+
+    Keeps exponential moving averages of latency, error rate and cost per call for each
+    config. Among the configs whose queue is not full and whose error rate is acceptable, the
+    cheapest one that meets the latency SLO wins; configs without recent measurements count
+    as meeting it, so new or recovered configs get tried. Configs without prices cannot be
+    compared by cost and are only chosen when no priced config meets the SLO.
+    If none meets the SLO, the fastest one is used. Pinning and excluding configs is left to the caller.
+    """
+    def __init__(self, latency_slo_ms: float = LLM_ROUTER_LATENCY_SLO_MS, max_error_rate: float = LLM_ROUTER_MAX_ERROR_RATE, alpha: float = LLM_ROUTER_ALPHA, stats_ttl_seconds: float = LLM_ROUTER_STATS_TTL_SECONDS):
+        self.latency_slo_ms = latency_slo_ms
+        self.max_error_rate = max_error_rate
+        self.alpha = alpha
+        self.stats_ttl_seconds = stats_ttl_seconds
+        self._stats = {}
+        self._prompt_tokens = float(DEFAULT_PROMPT_TOKENS)
+        self._completion_tokens = float(DEFAULT_COMPLETION_TOKENS)
+        self._lock = threading.Lock()
+
+    def _average(self, current: Optional[float], value: float) -> float:
+        return value if current is None else (1 - self.alpha) * current + self.alpha * value
+
+    def _entry(self, config_id) -> dict:
+        entry = self._stats.get(config_id)
+        if entry is None:
+            entry = self._stats[config_id] = {"latency_ms": None, "error_rate": 0.0, "cost": None, "calls": 0, "errors": 0, "updated_at": 0.0}
+        return entry
+
+    def record_success(self, llm_config: dict, latency_ms: float, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            entry = self._entry(llm_config.get("id"))
+            entry["latency_ms"] = self._average(entry["latency_ms"], latency_ms)
+            entry["error_rate"] = self._average(entry["error_rate"], 0.0)
+            cost = call_cost(llm_config, prompt_tokens, completion_tokens)
+            if cost is not None:
+                entry["cost"] = self._average(entry["cost"], cost)
+            entry["calls"] += 1
+            entry["updated_at"] = time.monotonic()
+            self._prompt_tokens = self._average(self._prompt_tokens, prompt_tokens)
+            self._completion_tokens = self._average(self._completion_tokens, completion_tokens)
+
+    def record_error(self, llm_config: dict):
+        with self._lock:
+            entry = self._entry(llm_config.get("id"))
+            entry["error_rate"] = self._average(entry["error_rate"], 1.0)
+            entry["calls"] += 1
+            entry["errors"] += 1
+            entry["updated_at"] = time.monotonic()
+
+    def _fresh_entry(self, config_id, now: float) -> Optional[dict]:
+        entry = self._stats.get(config_id)
+        if entry is None or now - entry["updated_at"] > self.stats_ttl_seconds:
+            return None
+        return entry
+
+    def choose(self, llm_configs: list[dict], default_id: Optional[int] = None) -> dict:
+        """
+        Returns the config to use out of a non-empty list; ties go to the default config.
+        Configs are compared by their expected cost for a typical call, not by what past calls
+        happened to cost, since the questions each config answered differ.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = {llm_config.get("id"): self._fresh_entry(llm_config.get("id"), now) for llm_config in llm_configs}
+            prompt_tokens, completion_tokens = self._prompt_tokens, self._completion_tokens
+
+        available = [llm_config for llm_config in llm_configs if not llm_scheduler.is_full(llm_config)] or llm_configs
+        healthy = [
+            llm_config for llm_config in available
+            if entries[llm_config.get("id")] is None or entries[llm_config.get("id")]["error_rate"] <= self.max_error_rate
+        ] or available
+
+        def latency(llm_config: dict) -> float:
+            entry = entries[llm_config.get("id")]
+            return 0.0 if entry is None or entry["latency_ms"] is None else entry["latency_ms"]
+
+        within_slo = [llm_config for llm_config in healthy if latency(llm_config) <= self.latency_slo_ms]
+        priced = [llm_config for llm_config in within_slo if call_cost(llm_config, prompt_tokens, completion_tokens) is not None]
+        if priced:
+            return min(priced, key=lambda llm_config: (call_cost(llm_config, prompt_tokens, completion_tokens), llm_config.get("id") != default_id, latency(llm_config)))
+        if within_slo:
+            return min(within_slo, key=lambda llm_config: (llm_config.get("id") != default_id, latency(llm_config)))
+        return min(healthy, key=lambda llm_config: (latency(llm_config), llm_config.get("id") != default_id))
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                str(config_id): {
+                    "latency_ms": round(entry["latency_ms"], 1) if entry["latency_ms"] is not None else None,
+                    "error_rate": round(entry["error_rate"], 3),
+                    "cost_per_call": entry["cost"],
+                    "calls": entry["calls"],
+                    "errors": entry["errors"],
+                    "stale": now - entry["updated_at"] > self.stats_ttl_seconds,
+                }
+                for config_id, entry in self._stats.items()
+            }
+
+# Shared by every RAGSystem instance; fed by each LLM call and read when routing queries.
+llm_router = LLMRouter()
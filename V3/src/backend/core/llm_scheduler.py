@@ -0,0 +1,130 @@
+import asyncio
+import heapq
+import itertools
+import math
+from contextlib import asynccontextmanager
+import time
+
+# Priority classes; lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Used for configs that do not set their own limits.
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_QUEUE = 100
+# Assumed duration of one LLM call before any has been measured, used for Retry-After.
+DEFAULT_CALL_SECONDS = 5.0
+
+class LLMOverloadedError(Exception):
+    """Raised when an LLM config's queue is full. retry_after is a suggested wait in seconds."""
+    def __init__(self, llm_name: str, retry_after: int):
+        super().__init__(f"The LLM provider '{llm_name}' is overloaded.")
+        self.retry_after = retry_after
+
+class _ProviderQueue:
+    """Concurrency slots for one LLM config, handed out in priority order."""
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._average_call_seconds = DEFAULT_CALL_SECONDS
+
+    def is_full(self) -> bool:
+        return self.active >= self.max_concurrency and len(self._waiting) >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Estimates the seconds until the queue has drained enough to accept a new call."""
+        rounds = (len(self._waiting) + 1) / max(self.max_concurrency, 1)
+        return max(1, math.ceil(rounds * self._average_call_seconds))
+
+    async def acquire(self, priority: int, llm_name: str):
+        if self.active < self.max_concurrency and not self._waiting:
+            self.active += 1
+            return
+        if len(self._waiting) >= self.max_queue:
+            raise LLMOverloadedError(llm_name, self.retry_after())
+
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting, entry)
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed over just as we were cancelled; pass it on.
+                self.release()
+            else:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            raise
+
+    def release(self):
+        # Hand the slot straight to the most urgent waiter, if any.
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def record_call(self, seconds: float):
+        self._average_call_seconds = 0.8 * self._average_call_seconds + 0.2 * seconds
+
+class LLMScheduler:
+    """
+    Limits the number of concurrent calls to each LLM config.
+
+    Calls beyond an LLMConfig's max_concurrency wait in a bounded queue, where interactive
+    queries are served before batch work. Once max_queue calls are waiting, new calls are
+    rejected straight away with LLMOverloadedError instead of piling up.
+
+    Must be used from a single event loop.
+    """
+    def __init__(self):
+        self._queues = {}
+
+    def _queue_for(self, llm_config: dict) -> _ProviderQueue:
+        key = llm_config.get("id") or llm_config.get("name")
+        max_concurrency = llm_config.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY
+        max_queue = llm_config.get("max_queue")
+        if max_queue is None:
+            max_queue = DEFAULT_MAX_QUEUE
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ProviderQueue(max_concurrency, max_queue)
+        else:
+            # Limits edited in the admin API apply from the next call on.
+            queue.max_concurrency, queue.max_queue = max_concurrency, max_queue
+        return queue
+
+    def is_full(self, llm_config: dict) -> bool:
+        """Returns whether a new call to the config would be rejected."""
+        return self._queue_for(llm_config).is_full()
+
+    def ensure_capacity(self, llm_config: dict):
+        """Raises LLMOverloadedError if a new call to the config would be rejected."""
+        queue = self._queue_for(llm_config)
+        if queue.is_full():
+            raise LLMOverloadedError(llm_config.get("name") or "default", queue.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, llm_config: dict, priority: int = PRIORITY_INTERACTIVE):
+        """Holds one of the config's concurrency slots for the duration of the block."""
+        queue = self._queue_for(llm_config)
+        await queue.acquire(priority, llm_config.get("name") or "default")
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            queue.record_call(time.perf_counter() - started)
+            queue.release()
+
+    def stats(self) -> dict:
+        return {
+            str(key): {"active": queue.active, "waiting": len(queue._waiting), "max_concurrency": queue.max_concurrency, "max_queue": queue.max_queue}
+            for key, queue in self._queues.items()
+        }
+
+# Shared by every RAGSystem instance so limits hold across all requests in the process.
+llm_scheduler = LLMScheduler()
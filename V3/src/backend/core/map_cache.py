@@ -0,0 +1,45 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Maximum number of per-chunk map outputs kept in memory.
+MAP_CACHE_SIZE = int(os.environ.get("MAP_CACHE_SIZE", 20000))
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class MapSummaryCache:
+    """
+    A thread-safe LRU cache of map-step outputs for map-reduce queries.
+
+    Entries are keyed by the SHA-256 of the chunk text, the map prompt version and the LLM
+    config, not by document: after an edit, unchanged chunks keep hitting the cache and only
+    changed chunks are mapped again.
+    """
+    def __init__(self, max_size: int = MAP_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def set(self, key: tuple, summary: str):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every RAGSystem instance.
+map_summary_cache = MapSummaryCache()
@@ -1,5 +1,12 @@
 import os
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
+import asyncio
+import hashlib
+import re
+import time
+import uuid
+from typing import AsyncIterator, ContextManager
+import numpy as np
 import chromadb
 # Corrected import for HuggingFaceEmbeddings based on deprecation warning
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -10,10 +17,124 @@ from langchain_community.llms import Ollama
 from langchain_core.runnables import Runnable
 from langchain.chains import LLMChain
 from together import Together
+import httpx
+import openai
 
 # Import ChromaDB's LangChain adapter
 from chromadb.utils.embedding_functions.chroma_langchain_embedding_function import create_langchain_embedding
 
+from src.backend.core.context import count_tokens, pack_context, truncate_to_tokens, PASSAGE_SEPARATOR
+from src.backend.core.fingerprint import simhash, lsh_bands, is_near_duplicate
+from src.backend.core.llm_cache import llm_client_cache, LLM_MAX_IDLE_CONNECTIONS
+from src.backend.core.answer_cache import answer_cache, normalize_question
+from src.backend.core.single_flight import query_single_flight
+from src.backend.core.llm_scheduler import llm_scheduler, LLMOverloadedError, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from src.backend.core.latency import llm_latency
+from src.backend.core.llm_router import llm_router
+from src.backend.core.fake_llm import FakeLLM
+from src.backend.core.map_cache import map_summary_cache, chunk_hash
+from src.backend.core.conversation import CandidateSet, session_candidates, format_history, SESSION_SUMMARY_TIMEOUT_SECONDS
+
+QA_PROMPT_TEMPLATE = """
+            You are an assistant for question-answering tasks.
+            Use the following pieces of retrieved context to answer the question.
+            If you don't know the answer, just say that you don't know.
+            Use three sentences maximum and keep the answer concise.
+
+            Context: {context}
+            Question: {question}
+            Answer:
+            """
+# Part of every answer cache key, so editing the prompt retires answers produced by the old one.
+QA_PROMPT_HASH = hashlib.sha256(QA_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:16]
+
+# Map-reduce mode: every chunk is summarized on its own, then the summaries are combined.
+MAP_PROMPT_TEMPLATE = """
+            Summarize the following passage in a few sentences.
+            Keep names, numbers, dates and conclusions.
+
+            Passage: {context}
+            Summary:
+            """
+REDUCE_PROMPT_TEMPLATE = """
+            You are given summaries of parts of a document collection.
+            Using only these summaries, respond to the request below.
+            If the request asks for a summary, combine them into one coherent summary that keeps the key facts.
+
+            Summaries: {context}
+            Request: {question}
+            Answer:
+            """
+# Map outputs are cached per chunk and map prompt version; editing the map prompt retires them.
+MAP_PROMPT_HASH = hashlib.sha256(MAP_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:16]
+MAP_REDUCE_CONCURRENCY = int(os.environ.get("MAP_REDUCE_CONCURRENCY", 8))
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get("MAP_REDUCE_MAX_CHUNKS", 2000))
+
+# Chat sessions: older turns are folded into a rolling summary with this prompt.
+SUMMARY_PROMPT_TEMPLATE = """
+            Update the summary of a conversation between a user and an assistant about the user's documents.
+            Keep the facts, names, numbers and open questions that later questions may refer to.
+            Reply with the updated summary only.
+
+            Conversation: {context}
+            Summary:
+            """
+
+# Trace entries that describe a shared answer rather than the work behind it; callers coalesced
+# onto another caller's computation copy only these.
+COALESCED_TRACE_KEYS = ("fallback", "llm_error")
+
+# Batch questions, map-reduce calls and history summaries wait out an overloaded provider for at
+# most this many seconds in total; after that the overload is reported like any other request's.
+LLM_OVERLOAD_MAX_WAIT_SECONDS = float(os.environ.get("LLM_OVERLOAD_MAX_WAIT_SECONDS", 60))
+
+# Chunking used at ingest. Smaller chunks embed more precisely; neighbour expansion at
+# query time restores the surrounding context.
+CHUNK_SIZE = int(os.environ.get("RAG_CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 200))
+
+# Two-stage retrieval: searches over more than ROUTING_MIN_DOCUMENTS documents first pick the
+# ROUTING_TOP_DOCUMENTS documents whose centroid is closest to the question, then search only their chunks.
+ROUTING_MIN_DOCUMENTS = int(os.environ.get("RAG_ROUTING_MIN_DOCUMENTS", 50))
+ROUTING_TOP_DOCUMENTS = int(os.environ.get("RAG_ROUTING_TOP_DOCUMENTS", 20))
+
+# Near-duplicate lookups at ingest check this many chunks per vector store request.
+DUPLICATE_LOOKUP_BATCH_SIZE = 25
+
+# Used when an LLM config does not specify its context window.
+DEFAULT_CONTEXT_WINDOW = 4096
+# Tokens kept free in the context window for the model's answer.
+ANSWER_TOKEN_RESERVE = 512
+
+# A hedged config sends the prompt to its secondary once the primary is slower than this percentile.
+HEDGE_PERCENTILE = 95
+
+# Extractive answers: the best sentences of the retrieved chunks, found without an LLM call.
+EXTRACTIVE_TOP_SENTENCES = 3
+EXTRACTIVE_MAX_SENTENCES = 64
+EXTRACTIVE_MIN_SENTENCE_CHARS = 20
+# When the LLM fails (other than being overloaded), answer extractively instead of failing.
+EXTRACTIVE_FALLBACK = os.environ.get("RAG_EXTRACTIVE_FALLBACK", "true").lower() == "true"
+EXTRACTIVE_FALLBACK_NOTICE = "The language model is unavailable right now. These are the most relevant passages:\n\n"
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+class MapReduceTooLargeError(Exception):
+    """
+    Raised when a map-reduce query would have to map more than MAP_REDUCE_MAX_CHUNKS chunks,
+    or when the LLM's context window is too small to combine two summaries at once.
+    """
+
+class LLMCallError(Exception):
+    """
+    Raised when building or calling an LLM chain fails, whatever the provider's own exception
+    type; that exception is the __cause__. Lets callers tell LLM failures from other errors.
+    """
+
 
 class RAGSystem:
     def __init__(self):
@@ -34,21 +155,27 @@ class RAGSystem:
             embedding_function=chroma_embedding_function # <--- Use the adapted function here
         )
 
+        # Document-level index holding one centroid of chunk embeddings per document
+        self.centroid_collection = self.client.get_or_create_collection(
+            name="rag_document_centroids",
+            embedding_function=chroma_embedding_function,
+            metadata={"hnsw:space": "cosine"}
+        )
+
 
-    def _get_llm_chain(self, llm_config: dict) -> Runnable[dict, str]:
-        """Dynamically creates an LLM chain based on the provided config."""
+    def _lease_llm_chain(self, llm_config: dict) -> ContextManager[Runnable[dict, str]]:
+        """Returns a context manager yielding a ready LLM chain for the config, reusing a cached one when possible."""
+        return llm_client_cache.lease(llm_config, self._create_llm_chain)
+
+    @staticmethod
+    def _create_llm_chain(llm_config: dict) -> tuple[Runnable[dict, str], list]:
+        """
+        Dynamically creates an LLM chain based on the provided config. Returns the chain and
+        the HTTP clients it owns, for the client cache to close when it drops the chain.
+        """
         prompt_template = PromptTemplate(
             input_variables=["context", "question"],
-            template="""
-            You are an assistant for question-answering tasks.
-            Use the following pieces of retrieved context to answer the question.
-            If you don't know the answer, just say that you don't know.
-            Use three sentences maximum and keep the answer concise.
-
-            Context: {context}
-            Question: {question}
-            Answer:
-            """
+            template=QA_PROMPT_TEMPLATE
         )
 
         llm_type = llm_config.get("type", "openai")
@@ -56,10 +183,21 @@ class RAGSystem:
         api_key_env = llm_config.get("api_key_env")
 
         llm = None
+        http_clients = []
         if llm_type == "openai":
             if not model_name:
                 model_name = "gpt-3.5-turbo"
-            llm = ChatOpenAI(model_name=model_name, api_key=os.getenv(api_key_env or "OPENAI_API_KEY"))
+            api_key = os.getenv(api_key_env or "OPENAI_API_KEY")
+            # Dedicated pools per cached chain, with a bounded number of idle connections. The
+            # async client is a separate httpx.AsyncClient; openai rejects a sync one there.
+            limits = httpx.Limits(max_keepalive_connections=LLM_MAX_IDLE_CONNECTIONS)
+            http_clients = [httpx.Client(limits=limits), httpx.AsyncClient(limits=limits)]
+            llm = ChatOpenAI(
+                model_name=model_name,
+                api_key=api_key,
+                client=openai.OpenAI(api_key=api_key, http_client=http_clients[0]).chat.completions,
+                async_client=openai.AsyncOpenAI(api_key=api_key, http_client=http_clients[1]).chat.completions,
+            )
         elif llm_type == "anthropic":
             if not model_name:
                 model_name = "claude-2"
@@ -67,7 +205,7 @@ class RAGSystem:
         elif llm_type == "ollama":
             if not model_name:
                 model_name = "llama2"
-            llm = Ollama(model=model_name, base_url=llm_config.get("api_endpoint", "http://localhost:11434"))
+            llm = Ollama(model=model_name, base_url=llm_config.get("api_endpoint") or "http://localhost:11434")
         elif llm_type == "together":
             if not model_name:
                 model_name = "mistralai/Mixtral-8x7B-Instruct-v0.1"
@@ -75,109 +213,976 @@ class RAGSystem:
                 model_name=model_name,
                 together_api_key=os.getenv(api_key_env or "TOGETHER_API_KEY"),
             )
+        elif llm_type == "fake":
+            # Offline provider for load tests and CI; timing and failures come from the config's options.
+            llm = FakeLLM(**(llm_config.get("options") or {}))
         else:
             raise ValueError(f"Unsupported LLM type: {llm_type}")
 
         llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-        return llm_chain
+        return llm_chain, http_clients
+
+    def _build_context(self, passages: list[dict], question: str, llm_config: dict) -> str:
+        """
+        Packs the retrieved passages into a context that fits the LLM's context window.
+        """
+        context_window = llm_config.get("context_window") or DEFAULT_CONTEXT_WINDOW
+        prompt_tokens = count_tokens(QA_PROMPT_TEMPLATE.format(context="", question=question))
+        token_budget = max(0, context_window - prompt_tokens - ANSWER_TOKEN_RESERVE)
+        return pack_context(passages, token_budget)
+
+    def _build_traced_context(self, passages: list[dict], question: str, llm_config: dict, trace: dict) -> str:
+        """Like _build_context, recording the prompt assembly time and prompt size in the trace."""
+        started = time.perf_counter()
+        context = self._build_context(passages, question, llm_config)
+        trace["prompt_tokens"] = count_tokens(QA_PROMPT_TEMPLATE.format(context=context, question=question))
+        trace["prompt_ms"] = _elapsed_ms(started)
+        return context
+
+    @staticmethod
+    def _split_with_offsets(text: str) -> list[dict]:
+        """
+        Splits text into chunks and records each chunk's position in the text.
+        """
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len,
+            add_start_index=True
+        )
+        chunks = []
+        for i, chunk in enumerate(text_splitter.create_documents([text])):
+            start = chunk.metadata["start_index"]
+            chunks.append({
+                "text": chunk.page_content,
+                "chunk_index": i,
+                "start": start,
+                "end": start + len(chunk.page_content),
+            })
+        return chunks
+
+    @staticmethod
+    def _to_passages(results: dict, query_index: int = 0) -> list[dict]:
+        """
+        Converts one query's ChromaDB results into passage dicts for the context packer.
+        """
+        passages = []
+        ids = (results.get("ids") or [])[query_index:query_index + 1] or [[]]
+        metadatas = (results.get("metadatas") or [])[query_index:query_index + 1] or [[]]
+        distances = (results.get("distances") or [])[query_index:query_index + 1] or [[]]
+        for i, text in enumerate(results["documents"][query_index]):
+            metadata = (metadatas[0][i] if metadatas[0] else None) or {}
+            distance = distances[0][i] if distances[0] else 0.0
+            passages.append({
+                "chunk_id": ids[0][i] if ids[0] else None,
+                "text": text,
+                "document_id": metadata.get("document_id"),
+                "chunk_index": metadata.get("chunk_index"),
+                "start": metadata.get("start"),
+                "end": metadata.get("end"),
+                "duplicate_of_document": metadata.get("duplicate_of_document"),
+                "score": 1.0 / (1.0 + distance),
+            })
+        return passages
+
+    @staticmethod
+    def _drop_redundant_duplicates(passages: list[dict], searched_document_ids: list[str], top_k: int) -> list[dict]:
+        """
+        Removes chunks flagged as near-duplicates of a chunk in another searched document,
+        since the original is already a candidate, and keeps the best top_k of the rest.
+        """
+        searched = set(searched_document_ids)
+        kept = [p for p in passages if p.get("duplicate_of_document") not in searched]
+        return kept[:top_k]
+
+    def _find_duplicate_chunks(self, chunks: list[dict], document_id: int, owner_id: int) -> dict:
+        """
+        Looks up chunks of the owner's other documents that are near-duplicates of the given chunks.
+
+        Candidates come from the per-owner LSH index: every stored chunk carries its owner id and
+        SimHash band values in its metadata, so a band match is a plain metadata filter.
+        Returns a mapping of chunk_index to the metadata-plus-id of the original chunk.
+        """
+        duplicates = {}
+        for batch_start in range(0, len(chunks), DUPLICATE_LOOKUP_BATCH_SIZE):
+            batch = chunks[batch_start:batch_start + DUPLICATE_LOOKUP_BATCH_SIZE]
+            band_clauses = [
+                {f"lsh_{band}": value}
+                for chunk in batch
+                for band, value in enumerate(lsh_bands(chunk["fingerprint"]))
+            ]
+            candidates = self.collection.get(
+                where={"$and": [
+                    {"owner_id": owner_id},
+                    {"document_id": {"$ne": str(document_id)}},
+                    {"$or": band_clauses},
+                ]},
+                include=["metadatas"]
+            )
+            # Only compare against originals; flagged chunks point at their original already.
+            originals = [
+                (chunk_id, metadata) for chunk_id, metadata in zip(candidates["ids"], candidates["metadatas"])
+                if metadata and "simhash" in metadata and "duplicate_of" not in metadata
+            ]
+            for chunk in batch:
+                for chunk_id, metadata in originals:
+                    if is_near_duplicate(chunk["fingerprint"], int(metadata["simhash"], 16)):
+                        duplicates[chunk["chunk_index"]] = {"chunk_id": chunk_id, "document_id": metadata["document_id"]}
+                        break
+        return duplicates
+
+    def _release_duplicates(self, document_id: int):
+        """
+        Re-points the chunks flagged as near-duplicates of a removed document's chunks.
 
+        Each such chunk is flagged again with another original of the owner's if one is left,
+        and otherwise becomes an original itself. Documents are handled in id order, so of
+        several copies of the same removed chunk the first becomes the original of the others.
+        """
+        flagged = self.collection.get(
+            where={"duplicate_of_document": str(document_id)},
+            include=["embeddings", "documents", "metadatas"]
+        )
+        copies_by_document = {}
+        for chunk_id, embedding, text, metadata in zip(flagged["ids"], flagged["embeddings"], flagged["documents"], flagged["metadatas"]):
+            copies_by_document.setdefault(int(metadata["document_id"]), []).append((chunk_id, embedding, text, metadata))
 
-    def process_document(self, document_id: int, document_text: str):
+        for copy_document_id in sorted(copies_by_document):
+            copies = copies_by_document[copy_document_id]
+            chunks = [{"chunk_index": metadata["chunk_index"], "fingerprint": int(metadata["simhash"], 16)} for _, _, _, metadata in copies]
+            duplicates = self._find_duplicate_chunks(chunks, copy_document_id, copies[0][3]["owner_id"])
+            metadatas = []
+            for _, _, _, metadata in copies:
+                metadata = {key: value for key, value in metadata.items() if key not in ("duplicate_of", "duplicate_of_document")}
+                original = duplicates.get(metadata["chunk_index"])
+                if original:
+                    metadata["duplicate_of"] = original["chunk_id"]
+                    metadata["duplicate_of_document"] = original["document_id"]
+                metadatas.append(metadata)
+            # Chroma merges upserted metadata into the stored one, so dropping a flag means re-adding the chunk.
+            chunk_ids = [chunk_id for chunk_id, _, _, _ in copies]
+            self.collection.delete(ids=chunk_ids)
+            self.collection.add(
+                ids=chunk_ids,
+                embeddings=[embedding for _, embedding, _, _ in copies],
+                documents=[text for _, _, text, _ in copies],
+                metadatas=metadatas
+            )
+            answer_cache.invalidate_document(copy_document_id)
+
+    def process_document(self, document_id: int, document_text: str, owner_id: int = None):
         """
         Processes a document, splits it into chunks, embeds them, and stores them in the vector store.
 
+        Each chunk gets a SimHash fingerprint. Near-duplicates of an earlier chunk in the same
+        document (repeated headers, footers, disclaimers) are not stored at all. When owner_id
+        is given, near-duplicates of chunks in the owner's other documents are stored but
+        flagged with the original, so retrieval can skip them when the original is also searched.
+
         Args:
             document_id (int): The unique ID of the document.
             document_text (str): The text content of the document.
+            owner_id (int): The ID of the document's owner, whose documents are checked for duplicates.
         """
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(document_text)
+        # Cached answers and chat candidates built from an earlier state of the document are no longer valid.
+        answer_cache.invalidate_document(document_id)
+        session_candidates.invalidate_document(document_id)
+
+        chunks = []
+        seen_fingerprints = []
+        for chunk in self._split_with_offsets(document_text):
+            chunk["fingerprint"] = simhash(chunk["text"])
+            if any(is_near_duplicate(chunk["fingerprint"], seen) for seen in seen_fingerprints):
+                continue
+            seen_fingerprints.append(chunk["fingerprint"])
+            chunks.append(chunk)
+        if not chunks:
+            return
 
-        metadatas = [{"document_id": str(document_id)} for _ in chunks]
+        duplicates = self._find_duplicate_chunks(chunks, document_id, owner_id) if owner_id is not None else {}
 
-        chunk_ids = [f"{document_id}_{i}" for i, _ in enumerate(chunks)]
+        metadatas = []
+        for c in chunks:
+            metadata = {
+                "document_id": str(document_id),
+                "chunk_index": c["chunk_index"],
+                "start": c["start"],
+                "end": c["end"],
+                "simhash": format(c["fingerprint"], "016x"),
+            }
+            metadata.update({f"lsh_{band}": value for band, value in enumerate(lsh_bands(c["fingerprint"]))})
+            if owner_id is not None:
+                metadata["owner_id"] = owner_id
+            original = duplicates.get(c["chunk_index"])
+            if original:
+                metadata["duplicate_of"] = original["chunk_id"]
+                metadata["duplicate_of_document"] = original["document_id"]
+            metadatas.append(metadata)
+
+        chunk_ids = [f"{document_id}_{c['chunk_index']}" for c in chunks]
+        embeddings = self.embedding_model.embed_documents([c["text"] for c in chunks])
 
         self.collection.add(
             ids=chunk_ids,
-            documents=chunks,
+            embeddings=embeddings,
+            documents=[c["text"] for c in chunks],
             metadatas=metadatas
         )
+        self._update_centroid(document_id, embeddings)
 
-    def query(self, question: str, document_ids: list[int], llm_config: dict) -> str:
+    def _update_centroid(self, document_id: int, embeddings: list[list[float]]):
         """
-        Performs a RAG query using a dynamically configured LLM chain.
+        Folds newly indexed chunk embeddings into the document's centroid.
+        The running chunk count is kept in the centroid's metadata so updates stay incremental.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float64)
+        total = vectors.sum(axis=0)
+        count = len(vectors)
+
+        existing = self.centroid_collection.get(ids=[str(document_id)], include=["embeddings", "metadatas"])
+        if existing["ids"]:
+            existing_count = (existing["metadatas"][0] or {}).get("chunk_count", 0)
+            total += np.asarray(existing["embeddings"][0], dtype=np.float64) * existing_count
+            count += existing_count
+
+        self.centroid_collection.upsert(
+            ids=[str(document_id)],
+            embeddings=[(total / count).tolist()],
+            metadatas=[{"document_id": str(document_id), "chunk_count": count}]
+        )
+
+    def _route_documents(self, query_embeddings: list[list[float]], document_ids: list[int]) -> list[str]:
+        """
+        Stage one of retrieval: narrows a large document set down to the documents whose
+        centroids are closest to the query embeddings (the union over all queries).
+        Small document sets are returned unchanged.
+        """
+        str_ids = [str(doc_id) for doc_id in document_ids]
+        if len(str_ids) <= ROUTING_MIN_DOCUMENTS:
+            return str_ids
+
+        results = self.centroid_collection.query(
+            query_embeddings=query_embeddings,
+            n_results=ROUTING_TOP_DOCUMENTS,
+            where={"document_id": {"$in": str_ids}},
+            include=[]
+        )
+        routed = {doc_id for ids in results["ids"] for doc_id in ids}
+        # Documents indexed before centroids existed have none; keep them so they stay searchable.
+        with_centroid = set(self.centroid_collection.get(ids=str_ids, include=[])["ids"])
+        routed.update(doc_id for doc_id in str_ids if doc_id not in with_centroid)
+        return list(routed)
+
+    def _expand_neighbors(self, passages: list[dict]) -> list[dict]:
+        """
+        Adds the chunks directly before and after each hit.
+
+        Chunk ids are "{document_id}_{chunk_index}", so the neighbours of all hits are fetched
+        with a single batched get. Neighbours shared between hits are fetched once and take the
+        best score of the hits that pulled them in.
+        """
+        hit_ids = {p["chunk_id"] for p in passages}
+        neighbor_scores = {}
+        for passage in passages:
+            if passage.get("document_id") is None or passage.get("chunk_index") is None:
+                continue
+            for index in (passage["chunk_index"] - 1, passage["chunk_index"] + 1):
+                chunk_id = f"{passage['document_id']}_{index}"
+                if index < 0 or chunk_id in hit_ids:
+                    continue
+                neighbor_scores[chunk_id] = max(neighbor_scores.get(chunk_id, 0.0), passage["score"])
+        if not neighbor_scores:
+            return passages
+
+        results = self.collection.get(ids=list(neighbor_scores), include=["documents", "metadatas"])
+        neighbors = []
+        for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+            metadata = metadata or {}
+            neighbors.append({
+                "chunk_id": chunk_id,
+                "text": text,
+                "document_id": metadata.get("document_id"),
+                "chunk_index": metadata.get("chunk_index"),
+                "start": metadata.get("start"),
+                "end": metadata.get("end"),
+                "score": neighbor_scores[chunk_id],
+            })
+        return passages + neighbors
+
+    def retrieve(self, question: str, document_ids: list[int], top_k: int = 5, expand_neighbors: bool = False, query_embedding: list[float] = None, timings: dict = None) -> list[dict]:
+        """
+        Finds the chunks most similar to the question within the given documents.
+
+        Returns passage dicts ordered by descending score; higher scores are more relevant.
+        With expand_neighbors, the adjacent chunks of every hit are appended as well.
+        An already computed query_embedding of the question can be passed to skip embedding it again.
+        If a timings dict is given, embed_ms, retrieve_ms (routing and vector search) and rerank_ms
+        (duplicate filtering and neighbour expansion) are stored in it.
         """
-        where_filter = {"document_id": {"$in": [str(doc_id) for doc_id in document_ids]}}
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        if query_embedding is None:
+            query_embedding = self.embedding_model.embed_query(question)
+            timings["embed_ms"] = _elapsed_ms(started)
+            started = time.perf_counter()
+        searched_ids = self._route_documents([query_embedding], document_ids)
+        where_filter = {"document_id": {"$in": searched_ids}}
+        # Over-fetch so that dropping redundant near-duplicates still leaves top_k chunks.
         results = self.collection.query(
-            query_texts=[question],
-            n_results=5,
-            where=where_filter
+            query_embeddings=[query_embedding],
+            n_results=top_k * 2,
+            where=where_filter,
+            include=["documents", "metadatas", "distances"]
         )
-        retrieved_docs = results['documents'][0]
-        if not retrieved_docs:
-            return "I could not find any relevant information in the selected documents."
-        context = "\n\n---\n\n".join(retrieved_docs)
+        timings["retrieve_ms"] = _elapsed_ms(started)
+        started = time.perf_counter()
+        passages = self._drop_redundant_duplicates(self._to_passages(results), searched_ids, top_k)
+        if expand_neighbors:
+            passages = self._expand_neighbors(passages)
+        timings["rerank_ms"] = _elapsed_ms(started)
+        return passages
+
+    def retrieve_batch(self, questions: list[str], document_ids: list[int], top_k: int = 5, expand_neighbors: bool = False) -> list[list[dict]]:
+        """
+        Retrieves passages for several questions at once.
+
+        All questions are embedded in a single batch and searched with one multi-query
+        vector search. Returns one passage list per question, in the same order.
+        """
+        query_embeddings = self.embedding_model.embed_documents(questions)
+        searched_ids = self._route_documents(query_embeddings, document_ids)
+        where_filter = {"document_id": {"$in": searched_ids}}
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=top_k * 2,
+            where=where_filter,
+            include=["documents", "metadatas", "distances"]
+        )
+        passages_per_question = [
+            self._drop_redundant_duplicates(self._to_passages(results, query_index=i), searched_ids, top_k)
+            for i in range(len(questions))
+        ]
+        if expand_neighbors:
+            passages_per_question = [self._expand_neighbors(passages) for passages in passages_per_question]
+        return passages_per_question
 
+    async def _acall_single_llm(self, context: str, question: str, llm_config: dict, priority: int, prompt: PromptTemplate = None) -> str:
+        """
+        Awaits one config's answer within its concurrency limit and records how long it took.
+        Uses the QA prompt unless another prompt taking context and question is given.
+        Raises LLMOverloadedError when the config's queue is full, and LLMCallError on failure.
+        """
         try:
-            llm_chain = self._get_llm_chain(llm_config)
-            answer = llm_chain.invoke({"context": context, "question": question})
-            return answer['text']
+            with self._lease_llm_chain(llm_config) as llm_chain:
+                async with llm_scheduler.slot(llm_config, priority):
+                    started = time.perf_counter()
+                    if prompt is None:
+                        answer = await llm_chain.ainvoke({"context": context, "question": question})
+                    else:
+                        answer = await (prompt | llm_chain.llm).ainvoke({"context": context, "question": question})
+        except LLMOverloadedError:
+            raise
         except Exception as e:
-            return f"Error during LLM query: {e}"
+            llm_router.record_error(llm_config)
+            raise LLMCallError(str(e)) from e
+        if prompt is not None:
+            return getattr(answer, "content", answer)
+        # Only QA calls feed the latency used for hedging and routing; other prompts have other timings.
+        seconds = time.perf_counter() - started
+        answer = answer.get('text', str(answer))
+        llm_latency.record(llm_config.get("id"), seconds)
+        llm_router.record_success(llm_config, seconds * 1000, count_tokens(context) + count_tokens(question), count_tokens(answer))
+        return answer
 
-    def query_on_the_fly(self, question: str, content: str, llm_config: dict) -> str:
+    async def _acall_llm(self, context: str, question: str, llm_config: dict, priority: int = PRIORITY_INTERACTIVE, trace: dict = None, prompt: PromptTemplate = None) -> str:
         """
-        Performs a RAG query on raw text content without persistent storage.
+        Awaits the LLM's answer for an already built context, using the QA prompt unless another is given.
+
+        If the config has a hedge config (llm_config["hedge"]), the prompt is also sent to it
+        when the primary fails, or has not answered within its observed p95 latency; the first
+        successful answer wins and the other call is cancelled. The id of the config that
+        served the answer is stored in trace["llm_config_id"]. Raises if every call fails.
         """
-        if not content:
-            return "The provided content is empty."
+        hedge_config = llm_config.get("hedge")
+        if not hedge_config:
+            answer = await self._acall_single_llm(context, question, llm_config, priority, prompt)
+            served_config = llm_config
+        else:
+            answer, served_config = await self._acall_hedged(context, question, llm_config, hedge_config, priority, prompt)
+        if trace is not None:
+            trace["llm_config_id"] = served_config.get("id")
+        return answer
 
-        # 1. Split the text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_text(content)
+    async def _acall_hedged(self, context: str, question: str, llm_config: dict, hedge_config: dict, priority: int, prompt: PromptTemplate = None) -> tuple[str, dict]:
+        """Returns (answer, config that served it) from the primary or its hedge, whichever succeeds first."""
+        primary = asyncio.ensure_future(self._acall_single_llm(context, question, llm_config, priority, prompt))
+        configs_by_task = {primary: llm_config}
+        try:
+            # Without enough samples for a p95, only a failure of the primary triggers the hedge.
+            hedge_delay = llm_latency.percentile(llm_config.get("id"), HEDGE_PERCENTILE)
+            await asyncio.wait({primary}, timeout=hedge_delay)
+            if primary.done() and primary.exception() is None:
+                return primary.result(), llm_config
 
-        # 2. Create a temporary, in-memory vector store for this query
-        # We can use ChromaDB's ephemeral client for this
-        ephemeral_client = chromadb.EphemeralClient()
-        ephemeral_collection = ephemeral_client.create_collection(name="temp_on_the_fly")
+            secondary = asyncio.ensure_future(self._acall_single_llm(context, question, hedge_config, priority, prompt))
+            configs_by_task[secondary] = hedge_config
+            pending = {task for task in configs_by_task if not task.done()}
+            error = primary.exception() if primary.done() else None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), configs_by_task[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in configs_by_task:
+                if not task.done():
+                    task.cancel()
+
+    async def _acall_llm_patiently(self, context: str, question: str, llm_config: dict, trace: dict = None, prompt: PromptTemplate = None) -> str:
+        """
+        Like _acall_llm at batch priority, but waits and retries when the provider is overloaded
+        instead of giving up at once. Used for work that runs many calls per request. Gives up
+        with the last LLMOverloadedError once the next retry would end past
+        LLM_OVERLOAD_MAX_WAIT_SECONDS, so the caller can still answer with a 503 and Retry-After.
+        """
+        deadline = time.monotonic() + LLM_OVERLOAD_MAX_WAIT_SECONDS
+        while True:
+            try:
+                return await self._acall_llm(context, question, llm_config, priority=PRIORITY_BATCH, trace=trace, prompt=prompt)
+            except LLMOverloadedError as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                await asyncio.sleep(e.retry_after)
 
-        ephemeral_collection.add(
-            ids=[f"chunk_{i}" for i, _ in enumerate(chunks)],
-            documents=chunks
+    @staticmethod
+    def _answer_cache_scope(document_versions: dict, llm_config: dict, expand_neighbors: bool) -> tuple:
+        """Returns everything besides the question that an answer depends on."""
+        llm_key = llm_client_cache.make_key(llm_config) + (("context_window", llm_config.get("context_window")),)
+        return answer_cache.make_scope(document_versions, llm_key, f"{QA_PROMPT_HASH}:neighbors={expand_neighbors}")
+
+    async def aquery(self, question: str, document_ids: list[int], llm_config: dict, expand_neighbors: bool = False, document_versions: dict = None, trace: dict = None) -> str:
+        """
+        Async version of query(). Embedding and vector search run in a worker thread;
+        the LLM call is awaited, so no thread is held while waiting on the provider.
+
+        When document_versions ({document_id: version}) is given, answers are served from and
+        stored in the answer cache. Failed LLM calls are never cached.
+        Concurrent calls for the same question, documents and config share one computation.
+        LLM failures, including LLMOverloadedError, are raised rather than returned as the answer.
+        If a trace dict is given, the id of the LLM config that served the answer, per-stage
+        timings in milliseconds, token counts and whether the cache answered are stored in it.
+        A caller whose question was answered by another caller's computation gets
+        trace["coalesced"] = True and only its own embedding time; the retrieval, prompt and
+        LLM figures stay with the caller that did the work, so they are not counted twice.
+        """
+        trace = trace if trace is not None else {}
+        started = time.perf_counter()
+        query_embedding = await asyncio.to_thread(self.embedding_model.embed_query, question)
+        trace["embed_ms"] = _elapsed_ms(started)
+        trace["cache_hit"] = False
+        scope = None
+        if document_versions is not None:
+            scope = self._answer_cache_scope(document_versions, llm_config, expand_neighbors)
+            cached_answer = answer_cache.get(question, scope, query_embedding)
+            if cached_answer is not None:
+                trace["cache_hit"] = True
+                return cached_answer
+
+        flight_key = (
+            normalize_question(question),
+            tuple(sorted(int(doc_id) for doc_id in document_ids)),
+            scope or self._answer_cache_scope({}, llm_config, expand_neighbors),
         )
+        computed = False
+
+        def compute():
+            nonlocal computed
+            computed = True
+            return self._aanswer(question, document_ids, llm_config, expand_neighbors, scope, query_embedding)
+
+        answer, shared_trace = await query_single_flight.do(flight_key, compute)
+        if computed:
+            trace.update(shared_trace)
+        else:
+            trace["coalesced"] = True
+            trace.update({key: shared_trace[key] for key in COALESCED_TRACE_KEYS if key in shared_trace})
+        return answer
+
+    async def _aanswer(self, question: str, document_ids: list[int], llm_config: dict, expand_neighbors: bool, scope: tuple, query_embedding: list[float]) -> tuple[str, dict]:
+        """
+        Retrieves and answers an uncached question, storing the answer when a cache scope is given.
+        Returns the answer and its trace.
+        """
+        trace = {}
+        passages = await asyncio.to_thread(self.retrieve, question, document_ids, expand_neighbors=expand_neighbors, query_embedding=query_embedding, timings=trace)
+        if not passages:
+            return "I could not find any relevant information in the selected documents.", trace
+        context = self._build_traced_context(passages, question, llm_config, trace)
+
+        started = time.perf_counter()
+        try:
+            answer = await self._acall_llm(context, question, llm_config, trace=trace)
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            if not EXTRACTIVE_FALLBACK:
+                raise
+            # Not cached: the next question should try the LLM again.
+            return await self._aextractive_fallback(passages, query_embedding, e, trace), trace
+        trace["llm_ms"] = _elapsed_ms(started)
+        trace["completion_tokens"] = count_tokens(answer)
+        if scope is not None:
+            answer_cache.set(question, scope, answer, trace["llm_ms"], query_embedding)
+        return answer, trace
+
+    async def aquery_batch(self, questions: list[str], document_ids: list[int], llm_config: dict, max_concurrency: int = 4, expand_neighbors: bool = False, traces: list[dict] = None) -> AsyncIterator[tuple[int, str, str]]:
+        """
+        Answers several questions against the same documents.
+
+        Retrieval is done in one batch; LLM calls run concurrently, at most max_concurrency at a time,
+        at batch priority. A call rejected because the provider is overloaded is retried after the
+        suggested delay, for up to LLM_OVERLOAD_MAX_WAIT_SECONDS. Yields (question_index, answer, error) tuples in completion order: error is
+        None on success, and when the LLM call fails answer is None and error describes the failure.
+        If traces (one dict per question) is given, each question's trace is stored in it. Embedding
+        and retrieval are shared by the whole batch, so only prompt and LLM figures are traced.
+        """
+        if traces is None:
+            traces = [{} for _ in questions]
+        passages_per_question = await asyncio.to_thread(self.retrieve_batch, questions, document_ids, expand_neighbors=expand_neighbors)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(i: int) -> tuple[int, str, str]:
+            passages = passages_per_question[i]
+            if not passages:
+                return i, "I could not find any relevant information in the selected documents.", None
+            context = self._build_traced_context(passages, questions[i], llm_config, traces[i])
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result = await self._acall_llm_patiently(context, questions[i], llm_config, trace=traces[i])
+                except Exception as e:
+                    return i, None, f"Error during LLM query: {e}"
+                traces[i]["llm_ms"] = _elapsed_ms(started)
+                traces[i]["completion_tokens"] = count_tokens(result)
+                return i, result, None
+
+        tasks = [asyncio.create_task(answer(i)) for i in range(len(questions))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Stop pending questions if the consumer goes away (e.g. the client disconnects).
+            for task in tasks:
+                task.cancel()
 
-        # 3. Query this temporary collection
-        results = ephemeral_collection.query(
-            query_texts=[question],
-            n_results=5
+    async def astream_query(self, question: str, document_ids: list[int], llm_config: dict, expand_neighbors: bool = False, document_versions: dict = None, trace: dict = None) -> AsyncIterator[tuple[str, object]]:
+        """
+        Performs a RAG query and streams the answer as the LLM generates it.
+        Streams are not hedged: once tokens have been sent, the answer cannot switch providers.
+
+        Yields ("retrieval", chunks) once with the chunks found, then ("token", text) for each
+        piece of the answer. If the LLM fails, a final ("error", message) event ends the stream;
+        tokens sent before it are an incomplete answer.
+        With document_versions, a cached answer is sent as a single token; retrieval still
+        runs so the chunks behind the answer are reported. A trace dict is filled as in aquery().
+        """
+        trace = trace if trace is not None else {}
+        trace["cache_hit"] = False
+        started = time.perf_counter()
+        query_embedding = await asyncio.to_thread(self.embedding_model.embed_query, question)
+        trace["embed_ms"] = _elapsed_ms(started)
+        passages = await asyncio.to_thread(self.retrieve, question, document_ids, expand_neighbors=expand_neighbors, query_embedding=query_embedding, timings=trace)
+        yield "retrieval", [
+            {key: p.get(key) for key in ("chunk_id", "document_id", "score", "start", "end")}
+            for p in passages
+        ]
+        if not passages:
+            yield "token", "I could not find any relevant information in the selected documents."
+            return
+
+        scope = None
+        if document_versions is not None:
+            scope = self._answer_cache_scope(document_versions, llm_config, expand_neighbors)
+            cached_answer = answer_cache.get(question, scope, query_embedding)
+            if cached_answer is not None:
+                trace["cache_hit"] = True
+                yield "token", cached_answer
+                return
+        context = self._build_traced_context(passages, question, llm_config, trace)
+
+        answer_parts = []
+        started = time.perf_counter()
+        trace["llm_config_id"] = llm_config.get("id")
+        try:
+            with self._lease_llm_chain(llm_config) as llm_chain:
+                async with llm_scheduler.slot(llm_config, PRIORITY_INTERACTIVE):
+                    # LLMChain only returns the final text; stream straight from its prompt and model instead.
+                    async for chunk in (llm_chain.prompt | llm_chain.llm).astream({"context": context, "question": question}):
+                        text = getattr(chunk, "content", chunk)
+                        if text:
+                            answer_parts.append(text)
+                            yield "token", text
+        except Exception as e:
+            if answer_parts or not EXTRACTIVE_FALLBACK or isinstance(e, LLMOverloadedError):
+                yield "error", f"Error during LLM query: {e}"
+            else:
+                yield "token", await self._aextractive_fallback(passages, query_embedding, e, trace)
+            return
+        answer = "".join(answer_parts)
+        trace["llm_ms"] = _elapsed_ms(started)
+        trace["completion_tokens"] = count_tokens(answer)
+        if scope is not None:
+            answer_cache.set(question, scope, answer, trace["llm_ms"], query_embedding)
+
+    def _rank_sentences(self, passages: list[dict], query_embedding: list[float], top_n: int = EXTRACTIVE_TOP_SENTENCES) -> list[dict]:
+        """
+        Splits the passages into sentences, embeds them in one batch and returns the top_n
+        sentences by cosine similarity to the query embedding, best first.
+        """
+        sentences = []
+        seen = set()
+        for passage in sorted(passages, key=lambda p: p["score"], reverse=True):
+            for text in _SENTENCE_SPLIT_RE.split(passage["text"]):
+                text = text.strip()
+                if len(text) < EXTRACTIVE_MIN_SENTENCE_CHARS or text in seen:
+                    continue
+                seen.add(text)
+                sentences.append({"text": text, "document_id": passage.get("document_id"), "chunk_id": passage.get("chunk_id")})
+        sentences = sentences[:EXTRACTIVE_MAX_SENTENCES]
+        if not sentences:
+            return []
+
+        vectors = np.asarray(self.embedding_model.embed_documents([s["text"] for s in sentences]), dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = np.argsort(-scores)[:top_n]
+        return [{**sentences[i], "score": float(scores[i])} for i in best]
+
+    def extract_answer(self, question: str, document_ids: list[int], top_n: int = EXTRACTIVE_TOP_SENTENCES, expand_neighbors: bool = False, timings: dict = None) -> list[dict]:
+        """
+        Answers without an LLM: returns the sentences of the retrieved chunks that are most similar
+        to the question, each with its document_id, chunk_id and score.
+        Timings are recorded as in retrieve(); sentence scoring counts towards rerank_ms.
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        query_embedding = self.embedding_model.embed_query(question)
+        timings["embed_ms"] = _elapsed_ms(started)
+        passages = self.retrieve(question, document_ids, expand_neighbors=expand_neighbors, query_embedding=query_embedding, timings=timings)
+        started = time.perf_counter()
+        sentences = self._rank_sentences(passages, query_embedding, top_n)
+        timings["rerank_ms"] = timings.get("rerank_ms", 0.0) + _elapsed_ms(started)
+        return sentences
+
+    @staticmethod
+    def format_extracted_sentences(sentences: list[dict]) -> str:
+        if not sentences:
+            return "I could not find any relevant information in the selected documents."
+        return "\n".join(f"- {s['text']}" for s in sentences)
+
+    async def _aextractive_fallback(self, passages: list[dict], query_embedding: list[float], error: Exception, trace: dict) -> str:
+        """
+        Answers from the best sentences when the LLM call failed, saying so in the answer.
+        The trace records the fallback and the error, so the QueryLog shows the answer was degraded.
+        """
+        sentences = await asyncio.to_thread(self._rank_sentences, passages, query_embedding)
+        trace["fallback"] = "extractive"
+        trace["llm_error"] = str(error) or type(error).__name__
+        trace.pop("llm_config_id", None)
+        print(f"LLM call failed, answering extractively: {error}")
+        return EXTRACTIVE_FALLBACK_NOTICE + self.format_extracted_sentences(sentences)
+
+    def _search_with_embeddings(self, query_embedding: list[float], document_ids: list[int], n_results: int) -> tuple[list[dict], list]:
+        """
+        Vector search like retrieve(), also returning the stored embedding of each chunk found
+        so it can be ranked again later without another search. Near-duplicates are dropped.
+        """
+        searched_ids = self._route_documents([query_embedding], document_ids)
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where={"document_id": {"$in": searched_ids}},
+            include=["documents", "metadatas", "distances", "embeddings"]
         )
+        searched = set(searched_ids)
+        kept = [
+            (passage, embedding)
+            for passage, embedding in zip(self._to_passages(results), results["embeddings"][0])
+            if passage.get("duplicate_of_document") not in searched
+        ]
+        return [passage for passage, _ in kept], [embedding for _, embedding in kept]
 
-        retrieved_docs = results['documents'][0]
-        if not retrieved_docs:
-            return "I could not find any relevant information in the provided content."
+    def retrieve_for_session(self, session_id: int, question: str, document_ids: list[int], top_k: int = 5, expand_neighbors: bool = False, timings: dict = None) -> tuple[list[dict], list[float]]:
+        """
+        Retrieval for one turn of a chat session. Returns the passages and the question's embedding.
+
+        The chunks found in earlier turns are kept with their embeddings. A follow-up close to the
+        previous question is answered from them without a vector search; otherwise a search runs
+        and only the chunks not held yet are added. Either way the held chunks are re-ranked by
+        cosine similarity to the question, so scores are cosine similarities here.
+        Timings are recorded as in retrieve(), plus candidates_reused.
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        query_embedding = self.embedding_model.embed_query(question)
+        timings["embed_ms"] = _elapsed_ms(started)
+
+        candidates = session_candidates.get(session_id, document_ids) or CandidateSet(document_ids)
+        with candidates.lock:
+            started = time.perf_counter()
+            reused = candidates.is_follow_up(query_embedding, top_k)
+            if not reused:
+                candidates.merge(*self._search_with_embeddings(query_embedding, document_ids, top_k * 2))
+            timings["retrieve_ms"] = _elapsed_ms(started)
+            started = time.perf_counter()
+            passages = candidates.rank(query_embedding, top_k)
+        session_candidates.set(session_id, candidates)
+        if expand_neighbors:
+            passages = self._expand_neighbors(passages)
+        timings["rerank_ms"] = _elapsed_ms(started)
+        timings["candidates_reused"] = reused
+        return passages, query_embedding
 
-        context = "\n\n---\n\n".join(retrieved_docs)
+    async def achat(self, session_id: int, question: str, history: str, document_ids: list[int], llm_config: dict, expand_neighbors: bool = False, trace: dict = None) -> str:
+        """
+        Answers one turn of a chat session.
+
+        history is the conversation so far (see conversation.format_history) and is sent to the
+        LLM with the question; retrieval uses the question alone and reuses the session's
+        candidates (see retrieve_for_session). Answers depend on the history, so they are not
+        cached. LLM failures are handled as in aquery(). A trace dict is filled as in aquery().
+        """
+        trace = trace if trace is not None else {}
+        trace["cache_hit"] = False
+        passages, query_embedding = await asyncio.to_thread(self.retrieve_for_session, session_id, question, document_ids, expand_neighbors=expand_neighbors, timings=trace)
+        if not passages:
+            return "I could not find any relevant information in the selected documents."
+        prompt_question = f"{history}\n\nFollow-up question: {question}" if history else question
+        context = self._build_traced_context(passages, prompt_question, llm_config, trace)
+
+        started = time.perf_counter()
+        try:
+            answer = await self._acall_llm(context, prompt_question, llm_config, trace=trace)
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            if not EXTRACTIVE_FALLBACK:
+                raise
+            return await self._aextractive_fallback(passages, query_embedding, e, trace)
+        trace["llm_ms"] = _elapsed_ms(started)
+        trace["completion_tokens"] = count_tokens(answer)
+        return answer
+
+    async def asummarize_history(self, summary: str, turns: list[tuple[str, str]], llm_config: dict, max_tokens: int) -> str:
+        """
+        Folds (question, answer) turns into the rolling summary of a chat session and returns the
+        new summary, cut to max_tokens. If the LLM call fails or takes longer than
+        SESSION_SUMMARY_TIMEOUT_SECONDS, the summary and turns are kept as plain text instead,
+        cut the same way; the chat turn waiting on it is not held up by a slow or busy provider.
+        """
+        context_window = llm_config.get("context_window") or DEFAULT_CONTEXT_WINDOW
+        token_budget = max(1, context_window - count_tokens(SUMMARY_PROMPT_TEMPLATE) - ANSWER_TOKEN_RESERVE)
+        conversation = format_history(summary, turns, max_tokens=token_budget)
+        try:
+            new_summary = await asyncio.wait_for(
+                self._acall_llm_patiently(conversation, "", llm_config, prompt=PromptTemplate.from_template(SUMMARY_PROMPT_TEMPLATE)),
+                timeout=SESSION_SUMMARY_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            print(f"Summarizing the conversation took over {SESSION_SUMMARY_TIMEOUT_SECONDS}s; keeping it as plain text.")
+            new_summary = conversation
+        except Exception as e:
+            print(f"Could not summarize the conversation: {e}")
+            new_summary = conversation
+        return truncate_to_tokens(new_summary.strip(), max_tokens)
+
+    def _get_document_chunks(self, document_ids: list[int]) -> list[dict]:
+        """
+        Returns every stored chunk of the documents in reading order. Chunks flagged as
+        near-duplicates of a chunk in another of the documents are left out.
+        """
+        str_ids = [str(doc_id) for doc_id in document_ids]
+        results = self.collection.get(where={"document_id": {"$in": str_ids}}, include=["documents", "metadatas"])
+        chunks = []
+        for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+            metadata = metadata or {}
+            if metadata.get("duplicate_of_document") in str_ids:
+                continue
+            chunks.append({"chunk_id": chunk_id, "text": text, "document_id": metadata.get("document_id"), "chunk_index": metadata.get("chunk_index") or 0})
+        document_order = {doc_id: i for i, doc_id in enumerate(str_ids)}
+        chunks.sort(key=lambda c: (document_order.get(c["document_id"], len(document_order)), c["chunk_index"]))
+        return chunks
+
+    @staticmethod
+    def _group_by_tokens(texts: list[str], token_budget: int) -> list[list[str]]:
+        """
+        Packs texts into groups that each fit the token budget. Every text is first cut to half
+        the budget, so groups hold at least two texts and each reduce level shrinks the list.
+        """
+        separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+        groups, current, used = [], [], 0
+        for text in texts:
+            text = truncate_to_tokens(text, max(1, token_budget // 2 - separator_tokens))
+            cost = count_tokens(text) + separator_tokens
+            if current and used + cost > token_budget:
+                groups.append(current)
+                current, used = [], 0
+            current.append(text)
+            used += cost
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    async def _gather_or_cancel(coroutines) -> list:
+        """Like asyncio.gather, but cancels the remaining calls as soon as one fails."""
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def amap_reduce(self, question: str, document_ids: list[int], llm_config: dict, max_concurrency: int = MAP_REDUCE_CONCURRENCY, trace: dict = None) -> str:
+        """
+        Answers a question from every chunk of the documents instead of the few most similar ones,
+        e.g. "summarize everything in this category".
+
+        Map: each chunk is summarized on its own. Summaries are cached by chunk hash, map prompt
+        version and LLM config, so re-running after an edit only maps the changed chunks.
+        Reduce: summaries are packed into groups that fit the context window and combined with
+        the question, level by level, until a single answer is left.
+
+        At most max_concurrency LLM calls run at a time, at batch priority. Raises
+        MapReduceTooLargeError above MAP_REDUCE_MAX_CHUNKS chunks or if the context window cannot
+        hold two summaries, and the provider's error if a call fails.
+        """
+        trace = trace if trace is not None else {}
+        started = time.perf_counter()
+        chunks = await asyncio.to_thread(self._get_document_chunks, document_ids)
+        trace["retrieve_ms"] = _elapsed_ms(started)
+        if not chunks:
+            return "I could not find any content in the selected documents."
+        if len(chunks) > MAP_REDUCE_MAX_CHUNKS:
+            raise MapReduceTooLargeError(f"The selected documents have {len(chunks)} chunks; map-reduce queries are limited to {MAP_REDUCE_MAX_CHUNKS}.")
+
+        context_window = llm_config.get("context_window") or DEFAULT_CONTEXT_WINDOW
+        reduce_prompt_tokens = count_tokens(REDUCE_PROMPT_TEMPLATE.format(context="", question=question))
+        token_budget = context_window - reduce_prompt_tokens - ANSWER_TOKEN_RESERVE
+        # Each reduce level must combine at least two summaries, or it would never get down to one.
+        if token_budget // 2 - count_tokens(PASSAGE_SEPARATOR) < 1:
+            raise MapReduceTooLargeError(f"The LLM's context window of {context_window} tokens is too small to combine summaries; map-reduce needs a larger one.")
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        llm_key = llm_client_cache.make_key(llm_config)
+        map_prompt = PromptTemplate.from_template(MAP_PROMPT_TEMPLATE)
+        reduce_prompt = PromptTemplate.from_template(REDUCE_PROMPT_TEMPLATE)
+        map_cache_hits = 0
+
+        async def call(context: str, prompt: PromptTemplate) -> str:
+            async with semaphore:
+                return await self._acall_llm_patiently(context, question, llm_config, trace=trace, prompt=prompt)
+
+        async def map_chunk(chunk: dict) -> str:
+            nonlocal map_cache_hits
+            key = (chunk_hash(chunk["text"]), MAP_PROMPT_HASH, llm_key)
+            summary = map_summary_cache.get(key)
+            if summary is not None:
+                map_cache_hits += 1
+                return summary
+            summary = await call(chunk["text"], map_prompt)
+            map_summary_cache.set(key, summary)
+            return summary
+
+        started = time.perf_counter()
+        summaries = await self._gather_or_cancel(map_chunk(chunk) for chunk in chunks)
+
+        groups = self._group_by_tokens(summaries, token_budget)
+        while len(groups) > 1:
+            summaries = await self._gather_or_cancel(call(PASSAGE_SEPARATOR.join(group), reduce_prompt) for group in groups)
+            previous_count, groups = len(groups), self._group_by_tokens(summaries, token_budget)
+            if len(groups) >= previous_count:
+                raise MapReduceTooLargeError(f"The summaries no longer fit the LLM's context window of {context_window} tokens in pairs; map-reduce needs a larger one.")
+        answer = await call(PASSAGE_SEPARATOR.join(groups[0]), reduce_prompt)
+
+        trace["llm_ms"] = _elapsed_ms(started)
+        trace["completion_tokens"] = count_tokens(answer)
+        trace["map_chunks"] = len(chunks)
+        trace["map_cache_hits"] = map_cache_hits
+        return answer
+
+    def query(self, question: str, document_ids: list[int], llm_config: dict, expand_neighbors: bool = False) -> str:
+        """
+        Performs a RAG query using a dynamically configured LLM chain.
+        """
+        passages = self.retrieve(question, document_ids, expand_neighbors=expand_neighbors)
+        if not passages:
+            return "I could not find any relevant information in the selected documents."
+        context = self._build_context(passages, question, llm_config)
 
-        # 4. Get answer from LLM
         try:
-            llm_chain = self._get_llm_chain(llm_config)
-            answer = llm_chain.invoke({"context": context, "question": question})
-            return answer.get('text', str(answer))
+            with self._lease_llm_chain(llm_config) as llm_chain:
+                answer = llm_chain.invoke({"context": context, "question": question})
+            return answer['text']
         except Exception as e:
             return f"Error during LLM query: {e}"
 
+    def _retrieve_on_the_fly(self, question: str, content: str, top_k: int = 5) -> list[dict]:
+        """
+        Indexes raw text in a temporary, in-memory vector store and returns the passages for the question.
+        """
+        chunks = self._split_with_offsets(content)
+
+        # Each call gets its own collection so concurrent on-the-fly queries do not collide.
+        ephemeral_client = chromadb.EphemeralClient()
+        collection_name = f"temp_on_the_fly_{uuid.uuid4().hex}"
+        ephemeral_collection = ephemeral_client.create_collection(name=collection_name)
+        try:
+            ephemeral_collection.add(
+                ids=[f"chunk_{c['chunk_index']}" for c in chunks],
+                documents=[c["text"] for c in chunks],
+                metadatas=[{"chunk_index": c["chunk_index"], "start": c["start"], "end": c["end"]} for c in chunks]
+            )
+            results = ephemeral_collection.query(
+                query_texts=[question],
+                n_results=top_k,
+                include=["documents", "metadatas", "distances"]
+            )
+        finally:
+            ephemeral_client.delete_collection(name=collection_name)
+        return self._to_passages(results)
+
+    async def aquery_on_the_fly(self, question: str, content: str, llm_config: dict, trace: dict = None) -> str:
+        """
+        Performs a RAG query on raw text content without persistent storage.
+        LLM failures are raised, as in aquery().
+        """
+        if not content:
+            return "The provided content is empty."
+
+        passages = await asyncio.to_thread(self._retrieve_on_the_fly, question, content)
+        if not passages:
+            return "I could not find any relevant information in the provided content."
+
+        context = self._build_context(passages, question, llm_config)
+        return await self._acall_llm(context, question, llm_config, trace=trace)
+
     def delete_document(self, document_id: int):
         """
         Deletes all chunks associated with a document from the vector store.
+        Re-indexing deletes the document first, so its copies elsewhere are released either way.
 
         Args:
             document_id (int): The ID of the document to delete.
         """
         self.collection.delete(where={"document_id": str(document_id)})
+        self.centroid_collection.delete(ids=[str(document_id)])
+        # Copies flagged against the removed chunks would otherwise stay hidden behind an original that is gone.
+        self._release_duplicates(document_id)
+        answer_cache.invalidate_document(document_id)
+        session_candidates.invalidate_document(document_id)
 
 # Example Usage (for testing)
 if __name__ == '__main__':
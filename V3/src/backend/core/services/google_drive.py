@@ -1,8 +1,15 @@
 import io
+import os
+import tempfile
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
+# Bytes requested from Drive per download request.
+DRIVE_DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_DOWNLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+# Downloads up to this size stay in memory; larger ones are spooled to a temporary file.
+DRIVE_SPOOL_MAX_BYTES = int(os.environ.get("DRIVE_SPOOL_MAX_BYTES", 8 * 1024 * 1024))
+
 class GoogleDriveService:
     def __init__(self, user_credentials_json: str):
         """
@@ -26,15 +33,28 @@ class GoogleDriveService:
         ).execute()
         return results.get('files', [])
 
-    def download_file(self, file_id: str) -> io.BytesIO:
+    def get_file_metadata(self, file_id: str) -> dict:
+        """
+        Returns the id, name and mimeType of a file in Google Drive.
+        :param file_id: The ID of the file.
+        """
+        return self.service.files().get(fileId=file_id, fields="id, name, mimeType").execute()
+
+    def download_file(self, file_id: str, export_mime_type: str = None):
         """
-        Downloads a file from Google Drive.
+        Downloads a file from Google Drive in chunks.
         :param file_id: The ID of the file to download.
-        :return: A BytesIO object containing the file's content.
+        :param export_mime_type: For Google Docs files, which have no content of their own, the
+                                 format to export them to, e.g. 'text/plain'.
+        :return: A file object positioned at the start of the content. Large files are kept on
+                 disk rather than in memory; the caller should close it when done.
         """
-        request = self.service.files().get_media(fileId=file_id)
-        file_buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_buffer, request)
+        if export_mime_type:
+            request = self.service.files().export_media(fileId=file_id, mimeType=export_mime_type)
+        else:
+            request = self.service.files().get_media(fileId=file_id)
+        file_buffer = tempfile.SpooledTemporaryFile(max_size=DRIVE_SPOOL_MAX_BYTES)
+        downloader = MediaIoBaseDownload(file_buffer, request, chunksize=DRIVE_DOWNLOAD_CHUNK_SIZE)
 
         done = False
         while done is False:
@@ -0,0 +1,215 @@
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+
+from src.backend.data.database import SessionLocal
+from src.backend.data.models import Document, IngestionJob, Notification
+from src.backend.core.services.text_store import ExtractedTextStore
+from src.backend.core.fingerprint import minhash_signature, estimate_jaccard, NEAR_DUPLICATE_JACCARD
+
+# Number of worker threads indexing documents.
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", 2))
+# Seconds a worker holds a job without renewing it; a crashed worker's jobs are retried after this.
+INGESTION_LEASE_SECONDS = int(os.environ.get("INGESTION_LEASE_SECONDS", 120))
+# Attempts per job before it is marked failed.
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", 3))
+# Delay before the first retry; doubled for every further attempt.
+INGESTION_RETRY_SECONDS = int(os.environ.get("INGESTION_RETRY_SECONDS", 30))
+# Seconds an idle worker waits before looking for jobs again, unless woken by a new job.
+INGESTION_POLL_SECONDS = float(os.environ.get("INGESTION_POLL_SECONDS", 5))
+
+def find_near_duplicates(db: Session, owner_id: int, signature: List[int], exclude_document_id: int = None) -> List[int]:
+    """Returns the ids of the owner's documents whose MinHash signature is close to the given one."""
+    if not signature:
+        return []
+    candidates = db.query(Document.id, Document.minhash).filter(Document.owner_id == owner_id, Document.minhash.isnot(None))
+    if exclude_document_id is not None:
+        candidates = candidates.filter(Document.id != exclude_document_id)
+    return [doc_id for doc_id, other in candidates.all() if estimate_jaccard(signature, other) >= NEAR_DUPLICATE_JACCARD]
+
+def enqueue_ingestion(db: Session, document: Document) -> IngestionJob:
+    """
+    Adds an ingestion job for the document to the session; it runs once the caller commits.
+    Call IngestionWorkerPool.wake() after committing so an idle worker starts on it at once.
+    """
+    job = IngestionJob(document=document, max_attempts=INGESTION_MAX_ATTEMPTS)
+    db.add(job)
+    return job
+
+class IngestionWorkerPool:
+    """
+    Worker threads that index uploaded documents: download, extract, chunk, embed and upsert.
+
+    Jobs live in the ingestion_jobs table, so they survive restarts and can be shared by
+    several API processes. A worker claims a job by taking a lease with a conditional update;
+    only one worker can win it. The lease is renewed while the job runs. If a worker dies, its
+    lease expires and the job is claimed again. Failed attempts are retried with exponential
+    backoff until max_attempts, after which the job is marked failed. The owner gets a
+    Notification when the document is ready or has failed for good.
+    """
+    def __init__(self, rag_system, storage_service, workers: int = INGESTION_WORKERS, session_factory=SessionLocal):
+        self.rag_system = rag_system
+        self.storage_service = storage_service
+        self.text_store = ExtractedTextStore(storage_service)
+        self.workers = workers
+        self.session_factory = session_factory
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            worker_id = f"{os.getpid()}-{i}-{uuid.uuid4().hex[:8]}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"ingestion-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def wake(self):
+        """Tells idle workers that a new job was committed."""
+        self._wake_event.set()
+
+    def _run(self, worker_id: str):
+        while not self._stop_event.is_set():
+            try:
+                job_id = self.claim_job(worker_id)
+                if job_id is not None:
+                    self.run_job(job_id, worker_id)
+                    continue
+            except Exception as e:
+                print(f"ERROR: Ingestion worker {worker_id} failed: {e}")
+            self._wake_event.wait(INGESTION_POLL_SECONDS)
+            self._wake_event.clear()
+
+    @staticmethod
+    def _claimable(now: datetime):
+        return or_(
+            and_(IngestionJob.status == "queued", IngestionJob.available_at <= now),
+            and_(IngestionJob.status == "running", IngestionJob.lease_expires_at < now),
+        )
+
+    def claim_job(self, worker_id: str) -> Optional[int]:
+        """Leases the oldest claimable job to the worker and returns its id, or None if there is none."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            candidates = db.query(IngestionJob.id).filter(self._claimable(now)).order_by(IngestionJob.id).limit(self.workers + 1).all()
+            for (job_id,) in candidates:
+                # Only one worker's conditional update can match; the others move on to the next job.
+                claimed = db.query(IngestionJob).filter(IngestionJob.id == job_id, self._claimable(now)).update({
+                    IngestionJob.status: "running",
+                    IngestionJob.lease_owner: worker_id,
+                    IngestionJob.lease_expires_at: now + timedelta(seconds=INGESTION_LEASE_SECONDS),
+                    IngestionJob.attempts: IngestionJob.attempts + 1,
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    return job_id
+            return None
+        finally:
+            db.close()
+
+    def _renew_lease(self, job_id: int, worker_id: str) -> bool:
+        db = self.session_factory()
+        try:
+            renewed = db.query(IngestionJob).filter(IngestionJob.id == job_id, IngestionJob.lease_owner == worker_id, IngestionJob.status == "running").update({
+                IngestionJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=INGESTION_LEASE_SECONDS),
+            }, synchronize_session=False)
+            db.commit()
+            return bool(renewed)
+        finally:
+            db.close()
+
+    def _keep_lease(self, job_id: int, worker_id: str, done: threading.Event):
+        while not done.wait(INGESTION_LEASE_SECONDS / 3):
+            try:
+                if not self._renew_lease(job_id, worker_id):
+                    return
+            except Exception as e:
+                print(f"WARNING: Could not renew the lease of ingestion job {job_id}: {e}")
+
+    def run_job(self, job_id: int, worker_id: str):
+        """Indexes the job's document and records the outcome, as long as the worker still holds the lease."""
+        done = threading.Event()
+        threading.Thread(target=self._keep_lease, args=(job_id, worker_id, done), daemon=True).start()
+        db = self.session_factory()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            document = job.document if job else None
+            if document is None:
+                return
+            try:
+                near_duplicate_ids = self._index_document(db, document)
+            except Exception as e:
+                db.rollback()
+                self._record_failure(db, job, worker_id, e)
+                return
+            done.set()
+            db.refresh(job)
+            if job.lease_owner != worker_id:
+                # The lease ran out and another worker took the job over; it records the outcome.
+                db.rollback()
+                return
+            job.status = "succeeded"
+            job.error = None
+            job.lease_owner = None
+            job.lease_expires_at = None
+            job.finished_at = datetime.utcnow()
+            message = f"Your document '{document.original_filename}' has been processed and is ready to query."
+            if near_duplicate_ids:
+                message += f" It is very similar to {len(near_duplicate_ids)} of your other documents."
+            db.add(Notification(user_id=document.owner_id, message=message))
+            db.commit()
+        finally:
+            done.set()
+            db.close()
+
+    def _index_document(self, db: Session, document: Document) -> List[int]:
+        """Extracts and indexes the document's current blob. Returns its near-duplicate documents."""
+        # Parsed once per version; a re-index of an unchanged version reads the stored text.
+        text = self.text_store.get_or_extract(document)
+        signature = minhash_signature(text)
+        # Start from a clean slate so a retry after a partial upsert does not index chunks twice.
+        self.rag_system.delete_document(document.id)
+        self.rag_system.process_document(document_id=document.id, document_text=text, owner_id=document.owner_id)
+        document.minhash = signature or None
+        return find_near_duplicates(db, document.owner_id, signature, exclude_document_id=document.id)
+
+    def _record_failure(self, db: Session, job: IngestionJob, worker_id: str, error: Exception):
+        db.refresh(job)
+        if job.lease_owner != worker_id:
+            return
+        print(f"ERROR: Ingestion job {job.id} for document {job.document_id} failed (attempt {job.attempts}): {error}")
+        job.error = str(error)
+        job.lease_owner = None
+        job.lease_expires_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            db.add(Notification(user_id=job.document.owner_id, message=f"Your document '{job.document.original_filename}' could not be processed: {error}"))
+        else:
+            job.status = "queued"
+            job.available_at = datetime.utcnow() + timedelta(seconds=INGESTION_RETRY_SECONDS * 2 ** (job.attempts - 1))
+        db.commit()
+
+_pool: Optional[IngestionWorkerPool] = None
+
+def start_ingestion_workers(rag_system, storage_service) -> IngestionWorkerPool:
+    """Starts the process-wide worker pool; called once on application startup."""
+    global _pool
+    if _pool is None:
+        _pool = IngestionWorkerPool(rag_system, storage_service)
+        _pool.start()
+    return _pool
+
+def wake_ingestion_workers():
+    """Wakes the worker pool, if it runs in this process, after jobs were committed."""
+    if _pool is not None:
+        _pool.wake()
@@ -1,9 +1,18 @@
 import os
+import hashlib
 import shutil # For creating/deleting directories
-from fastapi import UploadFile
+import requests
+from typing import BinaryIO, Optional
+from fastapi import UploadFile, HTTPException, status
 from google.cloud import storage # Keep import for type hinting, but won't be used if GCS is disabled
 from google.api_core import exceptions # Keep import for type hinting
 
+# Bytes read and written at a time when streaming a file into storage.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+class StorageQuotaExceededError(Exception):
+    """Raised by upload_stream when the stream is longer than the bytes the caller allowed."""
+
 class CloudStorageService:
     """
     A service for interacting with Google Cloud Storage or local file system.
@@ -64,6 +73,160 @@ class CloudStorageService:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to save locally: {e}")
 
 
+    def upload_stream(self, destination_filename: str, stream: BinaryIO, max_bytes: Optional[int] = None) -> tuple[int, str]:
+        """
+        Copies a binary stream to GCS or the local file system in UPLOAD_CHUNK_SIZE pieces,
+        so memory use does not depend on the file size. Returns the size in bytes and the
+        SHA-256 hex digest, both computed as the data passes.
+
+        If the stream turns out to be longer than max_bytes, writing stops, whatever was
+        written is deleted and StorageQuotaExceededError is raised.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        if self.use_gcs:
+            writer = self.bucket.blob(destination_filename).open("wb", chunk_size=max(UPLOAD_CHUNK_SIZE, 256 * 1024))
+        else:
+            writer = open(os.path.join(self.local_storage_dir, destination_filename), "wb")
+        try:
+            with writer:
+                for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise StorageQuotaExceededError(f"The file is larger than the {max_bytes} bytes of storage left.")
+                    sha256.update(chunk)
+                    writer.write(chunk)
+        except StorageQuotaExceededError:
+            self.delete(destination_filename)
+            raise
+        except Exception as e:
+            print(f"ERROR: Failed to stream '{destination_filename}' to storage: {e}")
+            self.delete(destination_filename)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to store file: {e}")
+        print(f"Successfully streamed '{destination_filename}' ({size} bytes) to storage.")
+        return size, sha256.hexdigest()
+
+    # --- Resumable uploads ---
+    # A resumable upload writes a file of known size in parts, strictly in order, across as many
+    # requests as the client needs. On GCS it is a resumable upload session; locally the parts are
+    # appended to a ".partial" file that is renamed once complete. Either way the file is never
+    # held in memory whole.
+
+    def _partial_path(self, destination_filename: str) -> str:
+        return os.path.join(self.local_storage_dir, f"{destination_filename}.partial")
+
+    def start_resumable(self, destination_filename: str, total_size: int) -> Optional[str]:
+        """Starts a resumable upload. Returns the GCS session URL, or None for local storage."""
+        if self.use_gcs:
+            try:
+                return self.bucket.blob(destination_filename).create_resumable_upload_session(size=total_size)
+            except Exception as e:
+                print(f"ERROR: Failed to start a resumable upload in GCS: {e}")
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to start upload: {e}")
+        open(self._partial_path(destination_filename), "wb").close()
+        return None
+
+    @staticmethod
+    def _gcs_persisted_bytes(response) -> int:
+        # GCS answers 308 with a "Range: bytes=0-N" header for the bytes it has kept so far.
+        if response.status_code in (200, 201):
+            return -1
+        if response.status_code != 308:
+            raise RuntimeError(f"GCS resumable upload returned {response.status_code}: {response.text}")
+        persisted = response.headers.get("Range")
+        return int(persisted.split("-")[-1]) + 1 if persisted else 0
+
+    def resumable_offset(self, destination_filename: str, session_url: Optional[str], total_size: int) -> int:
+        """Returns how many bytes of a resumable upload storage already holds."""
+        if self.use_gcs:
+            response = requests.put(session_url, headers={"Content-Range": f"bytes */{total_size}"})
+            persisted = self._gcs_persisted_bytes(response)
+            return total_size if persisted < 0 else persisted
+        path = self._partial_path(destination_filename)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        return total_size if os.path.exists(os.path.join(self.local_storage_dir, destination_filename)) else 0
+
+    def write_part(self, destination_filename: str, session_url: Optional[str], offset: int, content: bytes, total_size: int) -> int:
+        """
+        Writes one part of a resumable upload at the given byte offset and returns the number of
+        bytes stored in total. Writing a part again after a failed attempt is safe: anything
+        stored after the offset is replaced.
+        """
+        end = offset + len(content)
+        if self.use_gcs:
+            sent = offset
+            # GCS may keep only a prefix of a request; send the rest again until the part is stored.
+            while sent < end:
+                response = requests.put(
+                    session_url,
+                    data=content[sent - offset:],
+                    headers={"Content-Range": f"bytes {sent}-{end - 1}/{total_size}"},
+                )
+                persisted = self._gcs_persisted_bytes(response)
+                if persisted < 0:
+                    return total_size
+                if persisted <= sent:
+                    raise RuntimeError(f"GCS stored no bytes of the part at offset {sent}.")
+                sent = persisted
+            return end
+        with open(self._partial_path(destination_filename), "r+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(content)
+        if end == total_size:
+            os.replace(self._partial_path(destination_filename), os.path.join(self.local_storage_dir, destination_filename))
+        return end
+
+    def abort_resumable(self, destination_filename: str, session_url: Optional[str]):
+        """Discards a resumable upload and anything it stored."""
+        if self.use_gcs:
+            try:
+                requests.delete(session_url)
+            except Exception as e:
+                print(f"WARNING: Failed to cancel the GCS upload session for '{destination_filename}': {e}")
+        else:
+            path = self._partial_path(destination_filename)
+            if os.path.exists(path):
+                os.remove(path)
+        self.delete(destination_filename)
+
+    def hash_stored(self, filename: str) -> tuple[int, str]:
+        """Returns the size and SHA-256 hex digest of a stored file, reading it in UPLOAD_CHUNK_SIZE pieces."""
+        sha256 = hashlib.sha256()
+        size = 0
+        if self.use_gcs:
+            reader = self.bucket.blob(filename).open("rb", chunk_size=max(UPLOAD_CHUNK_SIZE, 256 * 1024))
+        else:
+            reader = open(os.path.join(self.local_storage_dir, filename), "rb")
+        with reader:
+            for chunk in iter(lambda: reader.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                sha256.update(chunk)
+        return size, sha256.hexdigest()
+
+    def download_to_file(self, filename: str, destination: BinaryIO) -> int:
+        """
+        Copies a stored file into a writable binary file object in UPLOAD_CHUNK_SIZE pieces,
+        so memory use does not depend on the file size. Returns the number of bytes copied.
+        """
+        size = 0
+        if self.use_gcs:
+            reader = self.bucket.blob(filename).open("rb", chunk_size=max(UPLOAD_CHUNK_SIZE, 256 * 1024))
+        else:
+            reader = open(os.path.join(self.local_storage_dir, filename), "rb")
+        with reader:
+            for chunk in iter(lambda: reader.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                destination.write(chunk)
+        return size
+
+    def exists(self, filename: str) -> bool:
+        """Returns whether a file is in GCS or the local file system."""
+        if self.use_gcs:
+            return self.bucket.blob(filename).exists()
+        return os.path.exists(os.path.join(self.local_storage_dir, filename))
+
     def download(self, source_filename: str) -> bytes:
         """
         Downloads a file from GCS or reads from local file system.
@@ -0,0 +1,66 @@
+import gzip
+import tempfile
+import unicodedata
+from typing import Optional
+
+from src.backend.data.models import Document
+from src.backend.core.extraction import extract_text
+
+# gzip level for stored text; extracted text compresses well even at low levels.
+TEXT_STORE_COMPRESSION_LEVEL = 6
+
+def normalize_text(text: str) -> str:
+    """Returns text in NFC form with Unix newlines and no NUL characters, as PDF extraction sometimes leaves."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\x00", "")
+    return unicodedata.normalize("NFC", text)
+
+class ExtractedTextStore:
+    """
+    Keeps the extracted text of each document version as a gzipped UTF-8 sidecar next to the
+    original file in storage.
+
+    The text is extracted once, usually by the ingestion job; viewing, exporting, appending to
+    and re-indexing the document then read the sidecar, which costs a small decompress instead
+    of downloading and parsing the original again. A sidecar is keyed by the blob name and
+    version, so a new version never reads the previous version's text.
+    """
+    def __init__(self, storage_service):
+        self.storage_service = storage_service
+
+    @staticmethod
+    def sidecar_name(filename: str, version: int) -> str:
+        return f"{filename}.v{version}.txt.gz"
+
+    def put(self, filename: str, version: int, text: str) -> str:
+        """Stores the text of a document version and returns it normalized."""
+        text = normalize_text(text)
+        self.storage_service.upload(self.sidecar_name(filename, version), gzip.compress(text.encode("utf-8"), compresslevel=TEXT_STORE_COMPRESSION_LEVEL))
+        return text
+
+    def get(self, document: Document) -> Optional[str]:
+        """Returns the stored text of the document's current version, or None if there is none yet."""
+        name = self.sidecar_name(document.filename, document.version)
+        if not self.storage_service.exists(name):
+            return None
+        return gzip.decompress(self.storage_service.download(name)).decode("utf-8")
+
+    def get_or_extract(self, document: Document) -> str:
+        """
+        Returns the text of the document's current version, extracting it from the original
+        file and storing it first if needed. Raises ValueError if the original is missing.
+        The original is streamed to a temporary file and extracted from disk, so it is never
+        held in memory whole.
+        """
+        text = self.get(document)
+        if text is not None:
+            return text
+        if not self.storage_service.exists(document.filename):
+            raise ValueError(f"File '{document.filename}' not found in storage.")
+        with tempfile.TemporaryFile() as original:
+            self.storage_service.download_to_file(document.filename, original)
+            original.seek(0)
+            text = extract_text(document.filename, original)
+        return self.put(document.filename, document.version, text)
+
+    def delete(self, filename: str, version: int):
+        self.storage_service.delete(self.sidecar_name(filename, version))
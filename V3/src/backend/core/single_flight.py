@@ -0,0 +1,64 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+# Seconds a follower waits for the leader's result before computing the answer itself.
+SINGLE_FLIGHT_FOLLOWER_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_FOLLOWER_TIMEOUT", 30))
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single in-flight computation.
+
+    The first caller (the leader) starts the computation as its own task; callers arriving
+    while it runs (followers) await the same task. The task is shielded, so a leader whose
+    request is cancelled does not take the followers down with it; it is only cancelled once
+    every waiter has gone. A follower that waits longer than follower_timeout stops waiting
+    and computes the result itself, so one slow leader cannot stall everyone behind it.
+
+    Must be used from a single event loop.
+    """
+    def __init__(self, follower_timeout: float = SINGLE_FLIGHT_FOLLOWER_TIMEOUT):
+        self.follower_timeout = follower_timeout
+        self._calls = {}
+        self.coalesced = 0
+        self.follower_timeouts = 0
+
+    async def do(self, key, factory: Callable[[], Awaitable]):
+        """
+        Returns the result of factory() for the key, sharing it with concurrent callers of the same key.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            return await self._wait(call, None)
+
+        self.coalesced += 1
+        try:
+            return await self._wait(call, self.follower_timeout)
+        except asyncio.TimeoutError:
+            self.follower_timeouts += 1
+            return await factory()
+
+    async def _wait(self, call: dict, timeout):
+        call["waiters"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call["task"]), timeout)
+        except asyncio.CancelledError:
+            if call["waiters"] == 1:
+                # Nobody else is waiting for the result any more.
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def _forget(self, key, call: dict):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+# Shared by every RAGSystem instance; coalesces identical questions that are being answered.
+query_single_flight = SingleFlight()
@@ -1,5 +1,6 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -9,6 +10,23 @@ connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswit
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def _async_database_url(url: str) -> str:
+    """
+    Maps a sync database URL onto the matching async driver.
+    """
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    if url.startswith("postgresql+psycopg2:"):
+        return url.replace("postgresql+psycopg2:", "postgresql+asyncpg:", 1)
+    return url
+
+# Used by the query endpoints, which await the database, retrieval and the LLM in turn.
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", _async_database_url(SQLALCHEMY_DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def create_db_and_tables():
@@ -18,9 +36,9 @@ def create_db_and_tables():
     try:
         if db.query(LLMConfig).count() == 0:
             default_configs = [
-                LLMConfig(name="OpenAI GPT-3.5", model_name="gpt-3.5-turbo", api_key_env="OPENAI_API_KEY", is_default=True),
-                LLMConfig(name="Anthropic Claude 2", model_name="claude-2", api_key_env="ANTHROPIC_API_KEY"),
-                LLMConfig(name="Together AI (Mixtral)", model_name="mistralai/Mixtral-8x7B-Instruct-v0.1", api_key_env="TOGETHER_API_KEY"),
+                LLMConfig(name="OpenAI GPT-3.5", model_name="gpt-3.5-turbo", api_key_env="OPENAI_API_KEY", is_default=True, context_window=16385),
+                LLMConfig(name="Anthropic Claude 2", model_name="claude-2", api_key_env="ANTHROPIC_API_KEY", context_window=100000),
+                LLMConfig(name="Together AI (Mixtral)", model_name="mistralai/Mixtral-8x7B-Instruct-v0.1", api_key_env="TOGETHER_API_KEY", context_window=32768),
             ]
             db.add_all(default_configs)
             db.commit()
@@ -33,3 +51,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, BigInteger, JSON, Boolean, Table
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, BigInteger, JSON, Boolean, Table, Index, Float
 from sqlalchemy.orm import relationship
 from src.backend.data.database import Base
 
@@ -27,6 +27,8 @@ class User(Base):
     notifications = relationship("Notification", back_populates="user", cascade="all, delete-orphan")
     gdrive_mappings = relationship("GoogleDriveFolderMapping", back_populates="owner", cascade="all, delete-orphan")
     audit_logs = relationship("AuditLog", back_populates="user", cascade="all, delete-orphan")
+    chat_sessions = relationship("ChatSession", back_populates="user", cascade="all, delete-orphan")
+    upload_sessions = relationship("UploadSession", back_populates="user", cascade="all, delete-orphan")
 
 class Document(Base):
     __tablename__ = "documents"
@@ -38,9 +40,51 @@ class Document(Base):
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    content_hash = Column(String(64), nullable=True) # SHA-256 of the uploaded file
+    minhash = Column(JSON, nullable=True) # MinHash signature of the extracted text, for near-duplicate detection
 
     owner = relationship("User", back_populates="documents")
     categories = relationship("Category", secondary=document_category_association, back_populates="documents")
+    ingestion_jobs = relationship("IngestionJob", back_populates="document", cascade="all, delete-orphan")
+
+    __table_args__ = (Index("ix_documents_owner_content_hash", "owner_id", "content_hash"),)
+
+class IngestionJob(Base):
+    """Extracts, chunks, embeds and indexes one document in the background; see core/services/ingestion.py."""
+    __tablename__ = "ingestion_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String, default="queued", nullable=False) # queued, running, succeeded or failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    available_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False) # Not picked up before this time (retry backoff)
+    lease_owner = Column(String, nullable=True) # Worker currently holding the job
+    lease_expires_at = Column(DateTime, nullable=True) # A running job whose lease expired is picked up again
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    document = relationship("Document", back_populates="ingestion_jobs")
+
+    __table_args__ = (Index("ix_ingestion_jobs_status_available_at", "status", "available_at"),)
+
+class UploadSession(Base):
+    """A resumable upload of one large file, sent in parts; see POST /documents/uploads."""
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True) # Random hex id; also what the client resumes with
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False) # Name of the blob being written
+    original_filename = Column(String, nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    part_size = Column(Integer, nullable=False)
+    received_bytes = Column(BigInteger, default=0, nullable=False)
+    gcs_session_url = Column(String, nullable=True) # Only when storing in GCS
+    category_ids = Column(JSON, nullable=True)
+    document_expires_at = Column(DateTime, nullable=True) # expires_at of the document created on completion
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False) # The upload can no longer be resumed after this
+
+    user = relationship("User", back_populates="upload_sessions")
 
 class Category(Base):
     __tablename__ = "categories"
@@ -49,7 +93,7 @@ class Category(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     owner = relationship("User", back_populates="categories")
-    documents = relationship("Document", secondary=document_category_association, back_populates="documents")
+    documents = relationship("Document", secondary=document_category_association, back_populates="categories")
     gdrive_mapping = relationship("GoogleDriveFolderMapping", back_populates="category", uselist=False, cascade="all, delete-orphan")
 
 class QueryLog(Base):
@@ -59,10 +103,49 @@ class QueryLog(Base):
     query_text = Column(String, nullable=False)
     answer_text = Column(String, nullable=False)
     queried_documents = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    llm_config_id = Column(Integer, ForeignKey("llm_configs.id", ondelete="SET NULL"), nullable=True) # Config that served the answer
+    # Per-stage timings in milliseconds; empty for stages the query did not go through
+    embed_ms = Column(Float, nullable=True)
+    retrieve_ms = Column(Float, nullable=True)
+    rerank_ms = Column(Float, nullable=True)
+    prompt_ms = Column(Float, nullable=True)
+    llm_ms = Column(Float, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cache_hit = Column(Boolean, default=False, nullable=False)
+    coalesced = Column(Boolean, default=False, nullable=False) # Answered by an identical in-flight query; no LLM figures of its own
+    fallback = Column(String, nullable=True) # How the answer was degraded, e.g. "extractive" when the LLM failed
+    llm_error = Column(String, nullable=True) # The LLM failure behind a fallback answer
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="queries")
 
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    title = Column(String, nullable=True)
+    document_ids = Column(JSON, nullable=False) # Documents every turn searches
+    llm_config_id = Column(Integer, ForeignKey("llm_configs.id", ondelete="SET NULL"), nullable=True) # None: routed per turn
+    summary = Column(String, default="", nullable=False) # Rolling summary of the turns marked summarized
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = relationship("User", back_populates="chat_sessions")
+    turns = relationship("ChatTurn", back_populates="session", cascade="all, delete-orphan", order_by="ChatTurn.id")
+
+class ChatTurn(Base):
+    __tablename__ = "chat_turns"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    question = Column(String, nullable=False)
+    answer = Column(String, nullable=False)
+    query_log_id = Column(Integer, ForeignKey("query_logs.id", ondelete="SET NULL"), nullable=True)
+    summarized = Column(Boolean, default=False, nullable=False) # Folded into the session's summary
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    session = relationship("ChatSession", back_populates="turns")
+
 class Notification(Base):
     __tablename__ = "notifications"
     id = Column(Integer, primary_key=True, index=True)
@@ -80,8 +163,20 @@ class LLMConfig(Base):
     model_name = Column(String, nullable=True)
     api_endpoint = Column(String, nullable=True)
     api_key_env = Column(String, nullable=False)
+    llm_type = Column(String, default="openai", nullable=False) # Provider: openai, anthropic, ollama, together or fake
+    llm_options = Column(JSON, nullable=True) # Provider-specific settings, e.g. latency and error rate for fake
     is_default = Column(Boolean, default=False, nullable=False)
     is_api = Column(Boolean, default=False, nullable=False)
+    context_window = Column(Integer, default=4096, nullable=False)
+    max_concurrency = Column(Integer, default=8, nullable=False) # Concurrent calls allowed to this config
+    max_queue = Column(Integer, default=100, nullable=False) # Calls that may wait for a slot before new ones are rejected
+    hedge_config_id = Column(Integer, ForeignKey("llm_configs.id", ondelete="SET NULL"), nullable=True) # Secondary for hedging and failover
+    cost_per_1k_prompt_tokens = Column(Float, nullable=True) # None if the price is unknown; 0.0 for free (e.g. local) models
+    cost_per_1k_completion_tokens = Column(Float, nullable=True)
+    routing_pinned = Column(Boolean, default=False, nullable=False) # Always chosen for queries that do not name a config
+    routing_excluded = Column(Boolean, default=False, nullable=False) # Never chosen by the router
+
+    hedge_config = relationship("LLMConfig", remote_side=[id])
 
 class Setting(Base):
     __tablename__ = "settings"
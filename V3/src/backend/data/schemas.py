@@ -1,6 +1,7 @@
-from pydantic import BaseModel, ConfigDict # Added ConfigDict
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field # Added ConfigDict
+from typing import Optional, Literal
 import datetime
+import os
 
 # --- User Schemas ---
 class UserBase(BaseModel):
@@ -21,7 +22,8 @@ class UserOut(UserBase):
     role: str
     has_google_credentials: bool = False
     storage_used: int # In bytes
-    storage_limit: int # In bytes
+    # In bytes; the limit is the same for every user, so it comes from the environment, not the user row.
+    storage_limit: int = Field(default_factory=lambda: int(os.environ.get("USER_STORAGE_LIMIT_MB", 1024)) * 1024 * 1024)
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -82,6 +84,35 @@ class DocumentOut(BaseModel):
 
     model_config = ConfigDict(from_attributes=True) # Updated
 
+class DocumentUploadOut(DocumentOut):
+    is_duplicate: bool = False # True if the file was already uploaded and the existing document was returned
+    # Near-duplicates need the extracted text, which only exists after indexing; see DocumentStatusOut.
+
+class DocumentStatusOut(BaseModel):
+    document_id: int
+    status: str # queued, running, succeeded or failed; "unknown" for documents indexed before jobs existed
+    attempts: int = 0
+    error: Optional[str] = None
+    queued_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    near_duplicate_ids: List[int] = [] # Known once the text has been extracted
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(..., gt=0)
+    category_ids: Optional[List[int]] = None
+    expires_at: Optional[datetime.datetime] = None # Of the document, once uploaded
+
+class UploadSessionOut(BaseModel):
+    id: str
+    original_filename: str
+    total_size: int
+    part_size: int
+    received_bytes: int
+    next_part: int # Part to send next; parts are numbered from 0 and sent in order
+    total_parts: int
+    expires_at: datetime.datetime
+
 class DocumentUpdate(BaseModel):
     content: str
 
@@ -115,15 +146,89 @@ class QueryInput(BaseModel):
     document_ids: Optional[list[int]] = None
     category_id: Optional[int] = None
     llm_config_id: Optional[int] = None
+    expand_neighbors: bool = False # Also send the chunks before and after each hit to the LLM
+    # "answer" uses the most relevant chunks; "map_reduce" reads every chunk, e.g. to summarize a whole category;
+    # "extractive" returns the best matching sentences without calling the LLM
+    mode: Literal["answer", "map_reduce", "extractive"] = "answer"
+
+class ExtractedSentence(BaseModel):
+    text: str
+    document_id: int
+    chunk_id: str
+    score: float
 
 class QueryOutput(BaseModel):
     answer: str
     query_id: int
+    sentences: Optional[list[ExtractedSentence]] = None # Set in extractive mode
+
+class BatchQueryInput(BaseModel):
+    questions: List[str]
+    document_ids: Optional[list[int]] = None
+    category_id: Optional[int] = None
+    llm_config_id: Optional[int] = None
+    expand_neighbors: bool = False
+
+class RetrieveInput(BaseModel):
+    question: str
+    document_ids: Optional[list[int]] = None
+    category_id: Optional[int] = None
+    top_k: int = Field(5, ge=1, le=50)
+    log_query: bool = False # Only write a QueryLog row when explicitly requested
+
+class RetrievedChunk(BaseModel):
+    chunk_id: str
+    document_id: int
+    text: str
+    score: float # Higher is more relevant
+    start: Optional[int] = None # Character offsets in the document, if indexed with offsets
+    end: Optional[int] = None
+
+class RetrieveOutput(BaseModel):
+    results: List[RetrievedChunk]
+    query_id: Optional[int] = None
+
+# --- Chat Session Schemas ---
+class ChatSessionCreate(BaseModel):
+    title: Optional[str] = None
+    document_ids: Optional[list[int]] = None
+    category_id: Optional[int] = None
+    llm_config_id: Optional[int] = None
+
+class ChatMessageInput(BaseModel):
+    question: str
+    expand_neighbors: bool = False
+
+class ChatTurnOut(BaseModel):
+    id: int
+    question: str
+    answer: str
+    query_log_id: Optional[int] = None
+    created_at: datetime.datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ChatSessionOut(BaseModel):
+    id: int
+    title: Optional[str] = None
+    document_ids: list[int]
+    llm_config_id: Optional[int] = None
+    summary: str = ""
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ChatSessionDetail(ChatSessionOut):
+    turns: list[ChatTurnOut] = []
 
 class QueryLogOut(BaseModel):
     id: int
     query_text: str
     answer_text: str
+    llm_config_id: Optional[int] = None
+    fallback: Optional[str] = None # Set when the answer was degraded, e.g. "extractive" if the LLM failed
+    coalesced: bool = False # Answered by an identical query that was already in flight
     created_at: datetime.datetime
 
     model_config = ConfigDict(from_attributes=True) # Updated
@@ -134,14 +239,28 @@ class LLMConfigBase(BaseModel):
     model_name: Optional[str] = None
     api_endpoint: Optional[str] = None
     api_key_env: str
+    llm_type: Literal["openai", "anthropic", "ollama", "together", "fake"] = "openai"
+    llm_options: Optional[dict] = None
     is_default: bool = False
     is_api: bool = False
+    context_window: int = 4096
+    max_concurrency: int = Field(8, ge=1)
+    max_queue: int = Field(100, ge=0)
+    hedge_config_id: Optional[int] = None
+    cost_per_1k_prompt_tokens: Optional[float] = Field(None, ge=0) # None if unknown; set 0.0 for free models
+    cost_per_1k_completion_tokens: Optional[float] = Field(None, ge=0)
 
 class LLMConfigCreate(LLMConfigBase):
     pass
 
+class LLMRoutingUpdate(BaseModel):
+    pinned: Optional[bool] = None
+    excluded: Optional[bool] = None
+
 class LLMConfig(LLMConfigBase):
     id: int
+    routing_pinned: bool = False
+    routing_excluded: bool = False
 
     model_config = ConfigDict(from_attributes=True) # Updated
 
@@ -5,8 +5,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from src.backend.data.database import create_db_and_tables
-from src.backend.api import auth, documents, query, admin, notifications, categories, history, user, gdrive, mappings
+from src.backend.api import auth, documents, query, admin, notifications, categories, history, user, gdrive, mappings, sessions
 from src.backend.core.services.expiration import start_background_tasks
+from src.backend.core.services.ingestion import start_ingestion_workers
 
 app = FastAPI(
     title="Advanced RAG System API",
@@ -20,6 +21,8 @@ def on_startup():
     create_db_and_tables()
     # Start background services
     start_background_tasks()
+    # Index uploaded documents outside the request that uploaded them
+    start_ingestion_workers(documents.rag_system, documents.storage_service)
 
 # Include the API routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
@@ -32,6 +35,7 @@ app.include_router(history.router, prefix="/history", tags=["History"])
 app.include_router(user.router, prefix="/user", tags=["User"])
 app.include_router(gdrive.router, prefix="/gdrive", tags=["Google Drive"])
 app.include_router(mappings.router, prefix="/mappings", tags=["Mappings"])
+app.include_router(sessions.router, prefix="/sessions", tags=["Chat Sessions"])
 
 @app.get("/", tags=["Root"])
 def read_root():
@@ -0,0 +1,34 @@
+import io
+from reportlab.pdfgen import canvas
+from src.backend.core import extraction
+
+def _make_pdf(pages: int) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for page_number in range(pages):
+        pdf.drawString(100, 750, f"Page number {page_number}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def test_pdf_page_ranges_are_joined_in_order(monkeypatch):
+    monkeypatch.setattr(extraction, "PDF_PAGES_PER_TASK", 2)
+    text = extraction.extract_text("report.PDF", _make_pdf(5))
+    positions = [text.index(f"Page number {page_number}") for page_number in range(5)]
+    assert positions == sorted(positions)
+
+def test_failing_page_is_skipped(monkeypatch, tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(_make_pdf(2))
+
+    original = extraction.pypdf.PageObject.extract_text
+    def extract_or_fail(page, *args, **kwargs):
+        text = original(page, *args, **kwargs)
+        if "Page number 0" in text:
+            raise ValueError("malformed page")
+        return text
+    monkeypatch.setattr(extraction.pypdf.PageObject, "extract_text", extract_or_fail)
+
+    texts, skipped = extraction._extract_page_range(str(path), 0, 2, page_timeout=0)
+    assert skipped == [0]
+    assert "Page number 1" in texts[0]
@@ -0,0 +1,69 @@
+import io
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.backend.main import app
+from src.backend.api import gdrive
+from src.backend.data.database import Base, get_db
+from src.backend.data.models import User, IngestionJob
+
+# --- Test Database Setup ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_gdrive.db"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+client = TestClient(app)
+
+class FakeDriveService:
+    files = {
+        "doc-1": ({"id": "doc-1", "name": "Meeting notes", "mimeType": "application/vnd.google-apps.document"}, b"Notes"),
+        "pdf-1": ({"id": "pdf-1", "name": "report.pdf", "mimeType": "application/pdf"}, b"%PDF-1.4"),
+        "img-1": ({"id": "img-1", "name": "photo.png", "mimeType": "image/png"}, b"\x89PNG"),
+    }
+
+    def __init__(self, credentials):
+        self.exports = []
+
+    def get_file_metadata(self, file_id):
+        return self.files[file_id][0]
+
+    def download_file(self, file_id, export_mime_type=None):
+        self.exports.append(export_mime_type)
+        return io.BytesIO(self.files[file_id][1])
+
+def test_ingest_queues_supported_drive_files(monkeypatch):
+    monkeypatch.setattr(gdrive, "GoogleDriveService", FakeDriveService)
+    client.post("/auth/register", json={"username": "gdrive_owner", "password": "password"})
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == "gdrive_owner").first()
+    user.google_credentials = {"token": "test"}
+    db.commit()
+    db.close()
+    token = client.post("/auth/login", data={"username": "gdrive_owner", "password": "password"}).json()["access_token"]
+
+    response = client.post("/gdrive/ingest", json={"file_ids": ["doc-1", "pdf-1", "img-1"]}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    ingested = response.json()
+    assert [doc["original_filename"] for doc in ingested] == ["Meeting notes.txt", "report.pdf"]
+    assert [doc["filename"].rsplit(".", 1)[1] for doc in ingested] == ["txt", "pdf"]
+
+    db = TestingSessionLocal()
+    for doc in ingested:
+        assert db.query(IngestionJob).filter(IngestionJob.document_id == doc["id"], IngestionJob.status == "queued").count() == 1
+        gdrive.storage_service.delete(doc["filename"])
+    db.close()
@@ -0,0 +1,123 @@
+import datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.backend.data.database import Base
+from src.backend.data.models import User, Document, IngestionJob, Notification
+from src.backend.core.services.ingestion import IngestionWorkerPool, enqueue_ingestion
+
+# --- Test Database Setup ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_ingestion.db"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+class FakeRAGSystem:
+    def __init__(self):
+        self.processed = []
+
+    def delete_document(self, document_id):
+        pass
+
+    def process_document(self, document_id, document_text, owner_id=None):
+        self.processed.append((document_id, document_text))
+
+class FakeStorage:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.sidecars = {}
+
+    def exists(self, filename):
+        # Every original holds self.content; empty content stands for a missing original.
+        return filename in self.sidecars or (bool(self.content) and not filename.endswith(".gz"))
+
+    def upload(self, filename, content):
+        self.sidecars[filename] = content
+
+    def download(self, filename):
+        return self.sidecars.get(filename, self.content)
+
+    def download_to_file(self, filename, destination):
+        destination.write(self.content)
+        return len(self.content)
+
+def _queue_document(name: str, max_attempts: int = 3) -> int:
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == "ingestion_owner").first()
+    if not user:
+        user = User(username="ingestion_owner", hashed_password="x")
+        db.add(user)
+        db.commit()
+    document = Document(filename=f"{name}.txt", original_filename=f"{name}.txt", owner_id=user.id, size=10)
+    db.add(document)
+    job = enqueue_ingestion(db, document)
+    job.max_attempts = max_attempts
+    db.commit()
+    job_id = job.id
+    db.close()
+    return job_id
+
+def _job(job_id: int) -> IngestionJob:
+    db = TestingSessionLocal()
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    db.expunge(job)
+    db.close()
+    return job
+
+def test_job_is_claimed_once_indexed_and_notified():
+    job_id = _queue_document("ready")
+    rag_system = FakeRAGSystem()
+    pool = IngestionWorkerPool(rag_system, FakeStorage(b"The sky is blue."), workers=1, session_factory=TestingSessionLocal)
+
+    assert pool.claim_job("worker-1") == job_id
+    assert pool.claim_job("worker-2") is None
+    pool.run_job(job_id, "worker-1")
+
+    job = _job(job_id)
+    assert job.status == "succeeded"
+    assert job.attempts == 1
+    assert rag_system.processed[-1][1] == "The sky is blue."
+    db = TestingSessionLocal()
+    assert db.query(Notification).filter(Notification.message.contains("'ready.txt' has been processed")).count() == 1
+    db.close()
+
+def test_failed_job_is_retried_later_then_marked_failed():
+    job_id = _queue_document("missing", max_attempts=2)
+    pool = IngestionWorkerPool(FakeRAGSystem(), FakeStorage(b""), workers=1, session_factory=TestingSessionLocal)
+
+    assert pool.claim_job("worker-1") == job_id
+    pool.run_job(job_id, "worker-1")
+    job = _job(job_id)
+    assert job.status == "queued"
+    assert job.available_at > datetime.datetime.utcnow()
+    assert pool.claim_job("worker-1") is None
+
+    db = TestingSessionLocal()
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update({IngestionJob.available_at: datetime.datetime.utcnow()})
+    db.commit()
+    db.close()
+    assert pool.claim_job("worker-1") == job_id
+    pool.run_job(job_id, "worker-1")
+    job = _job(job_id)
+    assert job.status == "failed"
+    assert "not found in storage" in job.error
+
+def test_expired_lease_is_taken_over():
+    job_id = _queue_document("stalled")
+    pool = IngestionWorkerPool(FakeRAGSystem(), FakeStorage(b"text"), workers=1, session_factory=TestingSessionLocal)
+    assert pool.claim_job("crashed-worker") == job_id
+
+    db = TestingSessionLocal()
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update({IngestionJob.lease_expires_at: datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+    db.commit()
+    db.close()
+
+    assert pool.claim_job("worker-2") == job_id
+    job = _job(job_id)
+    assert job.lease_owner == "worker-2"
+    assert job.attempts == 2
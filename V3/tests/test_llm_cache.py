@@ -0,0 +1,43 @@
+import httpx
+from src.backend.core.llm_cache import LLMClientCache
+from src.backend.core.rag_system import RAGSystem
+
+def _openai_config(config_id: int) -> dict:
+    return {"id": config_id, "type": "openai", "model_name": "gpt-4o-mini", "api_key_env": "TEST_OPENAI_API_KEY"}
+
+def _clients(chain) -> tuple[httpx.Client, httpx.AsyncClient]:
+    return chain.llm.client._client._client, chain.llm.async_client._client._client
+
+def test_openai_chain_is_cached_and_closed_on_invalidation_and_eviction(monkeypatch):
+    monkeypatch.setenv("TEST_OPENAI_API_KEY", "test-key")
+    cache = LLMClientCache(max_size=1)
+
+    with cache.lease(_openai_config(1), RAGSystem._create_llm_chain) as chain:
+        sync_client, async_client = _clients(chain)
+    assert isinstance(sync_client, httpx.Client)
+    assert isinstance(async_client, httpx.AsyncClient)
+    with cache.lease(_openai_config(1), RAGSystem._create_llm_chain) as cached:
+        assert cached is chain
+
+    cache.invalidate(1)
+    assert sync_client.is_closed and async_client.is_closed
+    with cache.lease(_openai_config(1), RAGSystem._create_llm_chain) as rebuilt:
+        assert rebuilt is not chain
+
+    # A second config pushes the first out of a cache of one.
+    with cache.lease(_openai_config(2), RAGSystem._create_llm_chain):
+        pass
+    assert all(client.is_closed for client in _clients(rebuilt))
+
+def test_dropped_chain_stays_open_until_its_last_call_ends(monkeypatch):
+    monkeypatch.setenv("TEST_OPENAI_API_KEY", "test-key")
+    cache = LLMClientCache(max_size=1)
+
+    with cache.lease(_openai_config(1), RAGSystem._create_llm_chain) as chain:
+        with cache.lease(_openai_config(1), RAGSystem._create_llm_chain):
+            cache.invalidate(1)
+            with cache.lease(_openai_config(2), RAGSystem._create_llm_chain):
+                pass
+        # Dropped from the cache, but a call is still using it.
+        assert not any(client.is_closed for client in _clients(chain))
+    assert all(client.is_closed for client in _clients(chain))
@@ -0,0 +1,20 @@
+from src.backend.core.llm_router import LLMRouter, call_cost
+
+def _config(config_id, prompt_price=None, completion_price=None):
+    return {"id": config_id, "name": f"router-{config_id}", "cost_per_1k_prompt_tokens": prompt_price, "cost_per_1k_completion_tokens": completion_price}
+
+def test_unknown_prices_are_not_treated_as_free():
+    unpriced, cheap, free = _config(9001), _config(9002, 0.5, 1.5), _config(9003, 0.0, 0.0)
+    assert call_cost(unpriced, 1000, 1000) is None
+    assert call_cost(free, 1000, 1000) == 0.0
+
+    router = LLMRouter()
+    assert router.choose([unpriced, cheap], default_id=unpriced["id"]) is cheap
+    assert router.choose([unpriced, cheap, free]) is free
+    # Without any priced config, the default is used as before.
+    assert router.choose([_config(9004), unpriced], default_id=unpriced["id"]) is unpriced
+
+def test_unpriced_calls_leave_cost_unknown():
+    router = LLMRouter()
+    router.record_success(_config(9005), latency_ms=100.0, prompt_tokens=500, completion_tokens=50)
+    assert router.stats()["9005"]["cost_per_call"] is None
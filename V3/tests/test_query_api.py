@@ -0,0 +1,346 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from src.backend.main import app
+from src.backend.api import query
+from src.backend.data.database import Base, get_db, get_async_db
+from src.backend.data.models import User, Document, QueryLog, LLMConfig
+from src.backend.core.llm_scheduler import LLMOverloadedError
+from src.backend.core.rag_system import LLMCallError
+
+# --- Test Database Setup ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_query.db"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test_query.db")
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+client = TestClient(app)
+
+# --- Mock Retrieval ---
+@pytest.fixture(autouse=True)
+def mock_retrieve(monkeypatch):
+    def fake_retrieve(question, document_ids, top_k=5):
+        return [
+            {"chunk_id": f"{doc_id}_0", "document_id": str(doc_id), "text": f"chunk of {doc_id}",
+             "chunk_index": 0, "start": 0, "end": 10, "score": 0.5}
+            for doc_id in document_ids
+        ][:top_k]
+    monkeypatch.setattr(query.rag_system, "retrieve", fake_retrieve)
+
+# --- Test Users and Data ---
+def _register_and_login(username: str) -> str:
+    client.post("/auth/register", json={"username": username, "password": "password"})
+    response = client.post("/auth/login", data={"username": username, "password": "password"})
+    return response.json()["access_token"]
+
+def _create_document(username: str) -> int:
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == username).first()
+    doc = Document(filename=f"{username}.txt", original_filename=f"{username}.txt", owner_id=user.id, size=10)
+    db.add(doc)
+    db.commit()
+    doc_id = doc.id
+    db.close()
+    return doc_id
+
+def _ensure_default_llm_config() -> int:
+    db = TestingSessionLocal()
+    config = db.query(LLMConfig).filter(LLMConfig.is_default == True).first()
+    if not config:
+        config = LLMConfig(name="Test LLM", model_name="test", api_key_env="TEST_API_KEY", is_default=True)
+        db.add(config)
+        db.commit()
+    config_id = config.id
+    db.close()
+    return config_id
+
+@pytest.fixture(scope="module")
+def owner_token():
+    return _register_and_login("query_owner")
+
+@pytest.fixture(scope="module")
+def other_token():
+    return _register_and_login("query_other")
+
+# --- Tests ---
+def test_retrieve_returns_chunks_without_logging(owner_token):
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+
+    db = TestingSessionLocal()
+    logs_before = db.query(QueryLog).count()
+
+    response = client.post("/query/retrieve", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["query_id"] is None
+    assert data["results"][0]["document_id"] == doc_id
+    assert data["results"][0]["chunk_id"] == f"{doc_id}_0"
+
+    assert db.query(QueryLog).count() == logs_before
+    db.close()
+
+def test_retrieve_logs_query_when_asked(owner_token):
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/retrieve", json={"question": "What?", "document_ids": [doc_id], "log_query": True}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["query_id"] is not None
+
+def test_retrieve_denies_other_users_documents(owner_token, other_token):
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {other_token}"}
+    response = client.post("/query/retrieve", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 403
+
+def test_batch_query_streams_answers_and_logs_once(owner_token, monkeypatch):
+    import json
+
+    async def fake_aquery_batch(questions, document_ids, llm_config, max_concurrency=4, expand_neighbors=False, traces=None):
+        for i in reversed(range(len(questions))):
+            yield i, f"answer {i}", None
+    monkeypatch.setattr(query.rag_system, "aquery_batch", fake_aquery_batch)
+
+    _ensure_default_llm_config()
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    payload = {"questions": ["Q0", "Q1", "Q2"], "document_ids": [doc_id]}
+    response = client.post("/query/batch", json=payload, headers=headers)
+    assert response.status_code == 200
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines[:-1]] == [2, 1, 0]
+    assert all(line["status"] == "ok" for line in lines[:-1])
+    assert lines[-1]["done"] is True
+    assert len(lines[-1]["query_ids"]) == 3
+
+    db = TestingSessionLocal()
+    logs = db.query(QueryLog).filter(QueryLog.id.in_(lines[-1]["query_ids"])).order_by(QueryLog.id).all()
+    assert [log.answer_text for log in logs] == ["answer 0", "answer 1", "answer 2"]
+    db.close()
+
+def test_batch_query_reports_failed_questions_without_logging_them(owner_token, monkeypatch):
+    import json
+
+    async def failing_aquery_batch(questions, document_ids, llm_config, max_concurrency=4, expand_neighbors=False, traces=None):
+        yield 0, "answer 0", None
+        yield 1, None, "Error during LLM query: provider down"
+    monkeypatch.setattr(query.rag_system, "aquery_batch", failing_aquery_batch)
+
+    _ensure_default_llm_config()
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/batch", json={"questions": ["Q0", "Q1"], "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 200
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[1] == {"index": 1, "question": "Q1", "status": "error", "error": "Error during LLM query: provider down"}
+    query_ids = lines[-1]["query_ids"]
+    assert query_ids[0] is not None and query_ids[1] is None
+
+    db = TestingSessionLocal()
+    assert db.query(QueryLog).filter(QueryLog.answer_text.like("Error during LLM query%")).count() == 0
+    db.close()
+
+def test_query_returns_503_when_llm_is_overloaded(owner_token, monkeypatch):
+    async def overloaded_aquery(*args, **kwargs):
+        raise LLMOverloadedError("Test LLM", retry_after=7)
+    monkeypatch.setattr(query.rag_system, "aquery", overloaded_aquery)
+
+    _ensure_default_llm_config()
+    db = TestingSessionLocal()
+    logs_before = db.query(QueryLog).count()
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert db.query(QueryLog).count() == logs_before
+    db.close()
+
+def test_query_maps_only_llm_failures_to_502(owner_token, monkeypatch):
+    _ensure_default_llm_config()
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+
+    async def failing_aquery(*args, **kwargs):
+        raise LLMCallError("provider unreachable")
+    monkeypatch.setattr(query.rag_system, "aquery", failing_aquery)
+    response = client.post("/query/", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 502
+    assert response.json()["detail"] == "Error during LLM query: provider unreachable"
+
+    # Anything else is a server error, not the LLM's fault.
+    async def broken_aquery(*args, **kwargs):
+        raise KeyError("document_id")
+    monkeypatch.setattr(query.rag_system, "aquery", broken_aquery)
+    with pytest.raises(KeyError):
+        client.post("/query/", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+
+def test_query_records_stage_timings_for_latency_analytics(owner_token, monkeypatch):
+    config_id = _ensure_default_llm_config()
+
+    async def traced_aquery(question, document_ids, llm_config, expand_neighbors=False, document_versions=None, trace=None):
+        trace.update({"llm_config_id": llm_config["id"], "embed_ms": 5.0, "retrieve_ms": 12.0, "rerank_ms": 1.0,
+                      "prompt_ms": 2.0, "llm_ms": 900.0, "prompt_tokens": 350, "completion_tokens": 40, "cache_hit": False})
+        return "traced answer"
+    monkeypatch.setattr(query.rag_system, "aquery", traced_aquery)
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    log = db.query(QueryLog).filter(QueryLog.id == response.json()["query_id"]).first()
+    assert log.llm_config_id == config_id
+    assert log.llm_ms == 900.0
+    assert log.prompt_tokens == 350
+
+    client.post("/auth/register", json={"username": "query_admin", "password": "password"})
+    admin = db.query(User).filter(User.username == "query_admin").first()
+    admin.role = "admin"
+    db.commit()
+    db.close()
+    admin_token = client.post("/auth/login", data={"username": "query_admin", "password": "password"}).json()["access_token"]
+
+    response = client.get("/admin/analytics/query_latency/", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["stages"]["llm_ms"]["p50"] == 900.0
+    by_config = {entry["llm_config_id"]: entry for entry in data["by_llm_config"]}
+    assert by_config[config_id]["stages"]["retrieve_ms"]["count"] == 1
+
+def test_query_logs_extractive_fallback_as_degraded(owner_token, monkeypatch):
+    _ensure_default_llm_config()
+
+    async def fallback_aquery(question, document_ids, llm_config, expand_neighbors=False, document_versions=None, trace=None):
+        trace.update({"fallback": "extractive", "llm_error": "provider down", "cache_hit": False})
+        return "The language model is unavailable right now."
+    monkeypatch.setattr(query.rag_system, "aquery", fallback_aquery)
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    log = db.query(QueryLog).filter(QueryLog.id == response.json()["query_id"]).first()
+    assert (log.fallback, log.llm_error, log.llm_config_id) == ("extractive", "provider down", None)
+    db.close()
+
+def test_map_reduce_mode_reads_every_chunk(owner_token, monkeypatch):
+    _ensure_default_llm_config()
+    calls = []
+
+    async def fake_amap_reduce(question, document_ids, llm_config, trace=None):
+        calls.append(document_ids)
+        return "summary of everything"
+    monkeypatch.setattr(query.rag_system, "amap_reduce", fake_amap_reduce)
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    payload = {"question": "Summarize everything", "document_ids": [doc_id], "mode": "map_reduce"}
+    response = client.post("/query/", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["answer"] == "summary of everything"
+    assert calls == [[doc_id]]
+
+    response = client.post("/query/stream", json=payload, headers=headers)
+    assert response.status_code == 400
+
+def test_stream_reports_llm_failure_as_error_event(owner_token, monkeypatch):
+    _ensure_default_llm_config()
+
+    async def failing_astream_query(question, document_ids, llm_config, expand_neighbors=False, document_versions=None, trace=None):
+        yield "retrieval", []
+        yield "token", "Partial"
+        yield "error", "Error during LLM query: provider down"
+    monkeypatch.setattr(query.rag_system, "astream_query", failing_astream_query)
+
+    db = TestingSessionLocal()
+    logs_before = db.query(QueryLog).count()
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/stream", json={"question": "What?", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 200
+    events = [block.split("\n")[0] for block in response.text.strip().split("\n\n")]
+    assert events == ["event: retrieval", "event: token", "event: error"]
+    assert 'data: {"detail": "Error during LLM query: provider down"}' in response.text
+    assert db.query(QueryLog).count() == logs_before
+    db.close()
+
+def test_extractive_mode_returns_sentences_without_llm(owner_token, monkeypatch):
+    _ensure_default_llm_config()
+
+    def fake_extract_answer(question, document_ids, expand_neighbors=False, timings=None):
+        return [{"text": "The sky is blue.", "document_id": str(document_ids[0]), "chunk_id": f"{document_ids[0]}_0", "score": 0.9}]
+    monkeypatch.setattr(query.rag_system, "extract_answer", fake_extract_answer)
+
+    async def failing_aquery(*args, **kwargs):
+        raise AssertionError("the LLM path must not be used in extractive mode")
+    monkeypatch.setattr(query.rag_system, "aquery", failing_aquery)
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    response = client.post("/query/", json={"question": "What color is the sky?", "document_ids": [doc_id], "mode": "extractive"}, headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["answer"] == "- The sky is blue."
+    assert data["sentences"][0]["document_id"] == doc_id
+
+def test_routing_uses_pinned_config_and_skips_excluded(owner_token, monkeypatch):
+    default_id = _ensure_default_llm_config()
+    db = TestingSessionLocal()
+    other = LLMConfig(name="Routed LLM", model_name="routed", api_key_env="TEST_API_KEY")
+    db.add(other)
+    db.commit()
+    other_id = other.id
+    client.post("/auth/register", json={"username": "routing_admin", "password": "password"})
+    admin = db.query(User).filter(User.username == "routing_admin").first()
+    admin.role = "admin"
+    db.commit()
+    db.close()
+    admin_headers = {"Authorization": f"Bearer {client.post('/auth/login', data={'username': 'routing_admin', 'password': 'password'}).json()['access_token']}"}
+
+    used_config_ids = []
+    async def recording_aquery(question, document_ids, llm_config, expand_neighbors=False, document_versions=None, trace=None):
+        used_config_ids.append(llm_config["id"])
+        return "routed answer"
+    monkeypatch.setattr(query.rag_system, "aquery", recording_aquery)
+
+    doc_id = _create_document("query_owner")
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    assert client.put(f"/admin/routing/{other_id}", json={"pinned": True}, headers=admin_headers).status_code == 200
+    client.post("/query/", json={"question": "Pinned?", "document_ids": [doc_id]}, headers=headers)
+    assert client.put(f"/admin/routing/{other_id}", json={"pinned": True, "excluded": True}, headers=admin_headers).status_code == 400
+    assert client.put(f"/admin/routing/{other_id}", json={"pinned": False, "excluded": True}, headers=admin_headers).status_code == 200
+    client.post("/query/", json={"question": "Excluded?", "document_ids": [doc_id]}, headers=headers)
+    assert used_config_ids == [other_id, default_id]
+
+    routing = client.get("/admin/routing/", headers=admin_headers).json()
+    assert {entry["llm_config_id"]: entry["excluded"] for entry in routing["configs"]}[other_id] is True
+    client.delete(f"/admin/configs/{other_id}", headers=admin_headers)
@@ -0,0 +1,411 @@
+import asyncio
+import hashlib
+import itertools
+import re
+import time
+from contextlib import nullcontext
+import numpy as np
+import pytest
+from langchain.prompts import PromptTemplate
+from langchain_core.language_models.fake import FakeStreamingListLLM
+from src.backend.core import rag_system as rag_module
+from src.backend.core.rag_system import RAGSystem, MapReduceTooLargeError
+from src.backend.core.context import count_tokens
+from src.backend.core.llm_scheduler import LLMOverloadedError
+
+# The tests below run the real RAGSystem. The embedding model and the ChromaDB collections are
+# replaced by the small in-memory stand-ins defined here.
+
+_WORD_RE = re.compile(r"\w+")
+
+class FakeEmbeddings:
+    """Bag-of-words vectors: texts sharing words are close, texts sharing none are orthogonal."""
+    dimensions = 64
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dimensions)
+        for word in _WORD_RE.findall(text.lower()):
+            vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+def _matches(metadata, where):
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            operator, value = next(iter(condition.items()))
+            if operator == "$in" and metadata.get(key) not in value:
+                return False
+            if operator == "$ne" and metadata.get(key) == value:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class FakeCollection:
+    """
+    The parts of a ChromaDB collection RAGSystem uses, with squared L2 distances. Like a
+    collection created with an embedding function, it embeds texts given without embeddings.
+    """
+    def __init__(self, embeddings: FakeEmbeddings):
+        self.embeddings = embeddings
+        self.records = {} # id -> (embedding, document, metadata)
+        self.queries = []
+
+    def add(self, ids, embeddings=None, documents=None, metadatas=None):
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(documents)
+        for i, record_id in enumerate(ids):
+            self.records[record_id] = (embeddings[i], documents[i] if documents else None, metadatas[i] if metadatas else {})
+
+    upsert = add
+
+    def get(self, ids=None, where=None, include=()):
+        found = [
+            (record_id, record) for record_id, record in self.records.items()
+            if (ids is None or record_id in ids) and _matches(record[2], where)
+        ]
+        return {
+            "ids": [record_id for record_id, _ in found],
+            "embeddings": [record[0] for _, record in found],
+            "documents": [record[1] for _, record in found],
+            "metadatas": [record[2] for _, record in found],
+        }
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None, include=()):
+        if query_embeddings is None:
+            query_embeddings = self.embeddings.embed_documents(query_texts)
+        self.queries.append(where)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        candidates = [(record_id, record) for record_id, record in self.records.items() if _matches(record[2], where)]
+        for query_embedding in query_embeddings:
+            scored = sorted(
+                ((float(np.sum((np.asarray(record[0]) - np.asarray(query_embedding)) ** 2)), record_id, record) for record_id, record in candidates),
+                key=lambda item: item[0],
+            )[:n_results]
+            results["ids"].append([record_id for _, record_id, _ in scored])
+            results["documents"].append([record[1] for _, _, record in scored])
+            results["metadatas"].append([record[2] for _, _, record in scored])
+            results["distances"].append([distance for distance, _, _ in scored])
+        return results
+
+    def delete(self, ids=None, where=None):
+        for record_id in self.get(ids=ids, where=where)["ids"]:
+            del self.records[record_id]
+
+class RecordingChain:
+    """Stands in for an LLM chain, answering with a fixed text and keeping the inputs of every call."""
+    def __init__(self, answer: str = "recorded answer", delay: float = 0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = []
+        self.prompt = PromptTemplate(input_variables=["context", "question"], template=rag_module.QA_PROMPT_TEMPLATE)
+        self.llm = FakeStreamingListLLM(responses=[answer])
+
+    def invoke(self, inputs):
+        self.calls.append(inputs)
+        return {"text": self.answer}
+
+    async def ainvoke(self, inputs):
+        await asyncio.sleep(self.delay)
+        return self.invoke(inputs)
+
+def _rag_system() -> tuple[RAGSystem, RecordingChain]:
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.embedding_model = FakeEmbeddings()
+    rag.collection = FakeCollection(rag.embedding_model)
+    rag.centroid_collection = FakeCollection(rag.embedding_model)
+    chain = RecordingChain()
+    rag._lease_llm_chain = lambda llm_config: nullcontext(chain)
+    return rag, chain
+
+def _fake_llm_rag_system() -> RAGSystem:
+    """A RAGSystem that answers through the configured LLM, such as the FakeLLM provider."""
+    rag, _ = _rag_system()
+    del rag._lease_llm_chain
+    return rag
+
+_fake_config_ids = itertools.count(1000)
+
+def _fake_llm_config(**options) -> dict:
+    """A FakeLLM config with an id of its own, so latency, cache and scheduler state is not shared between tests."""
+    return {"id": next(_fake_config_ids), "type": "fake", "context_window": 4096, "options": {"ttft_ms": 0, "tokens_per_second": 0, **options}}
+
+def _words(prefix: str, count: int) -> str:
+    """Distinct words, so no two chunks of a test document share any."""
+    return " ".join(f"{prefix}w{j}" for j in range(count))
+
+def _count_word(text: str, word: str) -> int:
+    return len(re.findall(rf"\b{word}\b", text))
+
+def test_context_merges_overlapping_chunks_and_fits_the_token_budget():
+    rag, chain = _rag_system()
+    rag.process_document(1, " ".join(f"{_words(f'p{i}', 8)}." for i in range(40)))
+    question = _words("p20", 8)
+    assert len(rag.collection.records) > 2
+
+    # The splitter overlaps neighbouring chunks; packed into a context, every sentence appears once.
+    rag.query(question, [1], {"context_window": 100000})
+    context = chain.calls[-1]["context"]
+    assert all(_count_word(context, f"p{i}w3") == 1 for i in range(40))
+
+    context_window = 700
+    rag.query(question, [1], {"context_window": context_window})
+    prompt = rag_module.QA_PROMPT_TEMPLATE.format(context=chain.calls[-1]["context"], question=question)
+    assert chain.calls[-1]["context"]
+    assert count_tokens(prompt) <= context_window - rag_module.ANSWER_TOKEN_RESERVE
+
+def test_neighbor_expansion_adds_the_chunks_around_each_hit():
+    rag, _ = _rag_system()
+    # Five paragraphs, each long enough to be a chunk of its own.
+    rag.process_document(1, "\n\n".join(f"{_words(f'n{i}', 110)}." for i in range(5)))
+    question = _words("n2", 110)
+
+    hits = rag.retrieve(question, [1], top_k=1)
+    assert [p["chunk_id"] for p in hits] == ["1_2"]
+    expanded = rag.retrieve(question, [1], top_k=1, expand_neighbors=True)
+    assert sorted(p["chunk_id"] for p in expanded) == ["1_1", "1_2", "1_3"]
+    # Neighbours take the score of the hit that pulled them in.
+    assert {p["score"] for p in expanded} == {hits[0]["score"]}
+
+def test_large_searches_are_routed_to_the_closest_documents(monkeypatch):
+    monkeypatch.setattr(rag_module, "ROUTING_MIN_DOCUMENTS", 2)
+    monkeypatch.setattr(rag_module, "ROUTING_TOP_DOCUMENTS", 1)
+    rag, chain = _rag_system()
+    for document_id in range(1, 5):
+        rag.process_document(document_id, f"{_words(f'r{document_id}', 30)}.")
+    # A chunk indexed before centroids existed has none; its document must stay searchable.
+    rag.collection.add(ids=["5_0"], embeddings=[rag.embedding_model.embed_query("legacy text")], documents=["legacy text"], metadatas=[{"document_id": "5", "chunk_index": 0}])
+
+    passages = rag.retrieve(_words("r3", 30), [1, 2, 3, 4, 5], top_k=1)
+    assert sorted(rag.collection.queries[-1]["document_id"]["$in"]) == ["3", "5"]
+    assert passages[0]["document_id"] == "3"
+
+    # Small searches skip routing.
+    rag.retrieve(_words("r3", 30), [1, 2], top_k=1)
+    assert sorted(rag.collection.queries[-1]["document_id"]["$in"]) == ["1", "2"]
+
+    rag.query(_words("r3", 30), [1, 2, 3, 4, 5], {"context_window": 4096})
+    assert sorted(rag.collection.queries[-1]["document_id"]["$in"]) == ["3", "5"]
+    assert "r3w0" in chain.calls[-1]["context"]
+
+def test_near_duplicate_chunks_are_skipped_at_ingest_and_retrieval():
+    rag, chain = _rag_system()
+    disclaimer = f"{_words('legal', 110)}."
+    # The disclaimer repeats within the document; only its first copy is stored.
+    rag.process_document(1, "\n\n".join([disclaimer, f"{_words('a', 110)}.", disclaimer]), owner_id=7)
+    assert sorted(rag.collection.records) == ["1_0", "1_1"]
+
+    # In another document of the same owner it is stored, but flagged as a copy of the original.
+    rag.process_document(2, "\n\n".join([f"{_words('b', 110)}.", disclaimer]), owner_id=7)
+    assert rag.collection.records["2_1"][2]["duplicate_of"] == "1_0"
+
+    question = _words("legal", 110)
+    assert "2_1" not in [p["chunk_id"] for p in rag.retrieve(question, [1, 2], top_k=2)]
+    assert rag.retrieve(question, [2], top_k=1)[0]["chunk_id"] == "2_1"
+
+    # So the LLM gets the disclaimer once, not once per document.
+    rag.query(question, [1, 2], {"context_window": 4096})
+    assert _count_word(chain.calls[-1]["context"], "legalw5") == 1
+
+async def _collect(events) -> list:
+    return [event async for event in events]
+
+def test_streamed_answer_matches_the_complete_answer():
+    rag, _ = _rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    chain = RecordingChain("The sky is blue.")
+    rag._lease_llm_chain = lambda llm_config: nullcontext(chain)
+
+    events = asyncio.run(_collect(rag.astream_query("What color is the sky?", [1], {"context_window": 4096})))
+    assert events[0][0] == "retrieval"
+    assert events[0][1][0]["chunk_id"] == "1_0"
+    tokens = [data for event, data in events[1:] if event == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == asyncio.run(rag.aquery("What color is the sky?", [1], {"context_window": 4096}))
+
+def test_cached_answers_are_dropped_when_a_document_is_reindexed():
+    rag, chain = _rag_system()
+    rag.process_document(31, "The meeting is on Monday in room four.")
+    # The answer cache is shared by the process; a config of its own keeps this test's entries apart.
+    llm_config = {"id": 36, "model_name": "answer-cache-test", "context_window": 4096}
+    question, versions = "When is the meeting?", {31: 1}
+
+    first = asyncio.run(rag.aquery(question, [31], llm_config, document_versions=versions))
+    assert len(chain.calls) == 1
+    assert asyncio.run(rag.aquery(question, [31], llm_config, document_versions=versions)) == first
+    assert len(chain.calls) == 1
+
+    rag.delete_document(31)
+    rag.process_document(31, "The meeting moved to Friday in room nine.")
+    asyncio.run(rag.aquery(question, [31], llm_config, document_versions=versions))
+    assert len(chain.calls) == 2
+    assert "Friday" in chain.calls[-1]["context"]
+
+def test_identical_concurrent_questions_share_one_llm_call():
+    rag, _ = _rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    chain = RecordingChain("The sky is blue.", delay=0.2)
+    rag._lease_llm_chain = lambda llm_config: nullcontext(chain)
+    llm_config = {"id": 37, "model_name": "single-flight-test", "context_window": 4096}
+
+    traces = [{} for _ in range(5)]
+
+    async def ask_together():
+        return await asyncio.gather(*(rag.aquery("What color is the sky?", [1], llm_config, trace=trace) for trace in traces))
+
+    assert asyncio.run(ask_together()) == ["The sky is blue."] * 5
+    assert len(chain.calls) == 1
+    # Only the caller that made the LLM call reports its figures; the others are marked coalesced.
+    leaders = [trace for trace in traces if not trace.get("coalesced")]
+    assert len(leaders) == 1 and leaders[0]["llm_ms"] > 0 and leaders[0]["prompt_tokens"] > 0
+    for trace in traces:
+        if trace is not leaders[0]:
+            assert "embed_ms" in trace
+            assert not {"llm_config_id", "retrieve_ms", "llm_ms", "prompt_tokens", "completion_tokens"} & trace.keys()
+
+def test_fake_llm_answers_are_deterministic():
+    llm_config = _fake_llm_config()
+    first = asyncio.run(_fake_llm_rag_system()._acall_llm("Some context.", "A question?", llm_config))
+    again = asyncio.run(_fake_llm_rag_system()._acall_llm("Some context.", "A question?", _fake_llm_config()))
+    other = asyncio.run(_fake_llm_rag_system()._acall_llm("Other context.", "A question?", llm_config))
+    assert first.startswith("[fake:")
+    assert first == again != other
+
+def test_calls_beyond_the_queue_are_rejected_as_overloaded():
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    llm_config = {**_fake_llm_config(ttft_ms=300), "max_concurrency": 1, "max_queue": 1}
+
+    async def ask_at_once():
+        questions = ["What color is the sky?", "What color is grass?", "When is the sky blue?"]
+        return await asyncio.gather(*(rag.aquery(q, [1], llm_config) for q in questions), return_exceptions=True)
+
+    results = asyncio.run(ask_at_once())
+    # One call runs, one waits for its slot and the third is turned away; the API answers it with a 503.
+    rejected = [result for result in results if isinstance(result, LLMOverloadedError)]
+    assert len(rejected) == 1 and rejected[0].retry_after >= 1
+    assert all(isinstance(result, str) for result in results if result is not rejected[0])
+
+def test_failing_primary_is_hedged_to_its_secondary():
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    secondary = _fake_llm_config()
+    primary = {**_fake_llm_config(error_rate=1.0), "hedge": secondary}
+    trace = {}
+
+    answer = asyncio.run(rag.aquery("What color is the sky?", [1], primary, trace=trace))
+    assert answer.startswith("[fake:")
+    assert trace["llm_config_id"] == secondary["id"]
+
+def test_slow_primary_is_hedged_after_its_p95_latency():
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    secondary = _fake_llm_config()
+    primary = {**_fake_llm_config(ttft_ms=5000), "hedge": secondary}
+    for _ in range(rag_module.llm_latency.min_samples):
+        rag_module.llm_latency.record(primary["id"], 0.05)
+    trace = {}
+
+    started = time.perf_counter()
+    asyncio.run(rag.aquery("What color is the sky?", [1], primary, trace=trace))
+    assert time.perf_counter() - started < 2
+    assert trace["llm_config_id"] == secondary["id"]
+
+def test_map_reduce_rejects_a_context_window_too_small_to_combine_summaries():
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "\n\n".join(f"Section {i} covers topic {i} in detail." for i in range(5)))
+    llm_config = _fake_llm_config()
+    llm_config["context_window"] = 520
+
+    with pytest.raises(MapReduceTooLargeError):
+        asyncio.run(rag.amap_reduce("Summarize everything", [1], llm_config))
+
+def test_map_reduce_finishes_with_a_small_context_window():
+    rag = _fake_llm_rag_system()
+    # Unrelated sentences, so no chunk is dropped as a near-duplicate of another.
+    sentences = [f"{' '.join(f'w{i}x{j}' for j in range(150))}." for i in range(12)]
+    rag.process_document(1, "\n\n".join(sentences))
+    llm_config = _fake_llm_config(answer_tokens=40)
+    llm_config["context_window"] = 700
+    trace = {}
+
+    answer = asyncio.run(rag.amap_reduce("Summarize everything", [1], llm_config, trace=trace))
+    assert answer.startswith("[fake:")
+    assert trace["map_chunks"] > 2
+
+def test_llm_failure_falls_back_to_extractive_answer_and_traces_it(monkeypatch):
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    llm_config = _fake_llm_config(error_rate=1.0)
+    trace = {}
+
+    answer = asyncio.run(rag.aquery("What color is the sky?", [1], llm_config, trace=trace))
+    assert answer.startswith(rag_module.EXTRACTIVE_FALLBACK_NOTICE)
+    assert "The sky is blue on clear days." in answer
+    assert trace["fallback"] == "extractive"
+    assert "Injected fake LLM failure" in trace["llm_error"]
+    assert "llm_config_id" not in trace
+
+    # Failing before the first token, a stream falls back the same way, or reports an error event when fallbacks are off.
+    events = asyncio.run(_collect(rag.astream_query("What color is the sky?", [1], _fake_llm_config(error_rate=1.0))))
+    assert events[-1][0] == "token" and events[-1][1].startswith(rag_module.EXTRACTIVE_FALLBACK_NOTICE)
+    monkeypatch.setattr(rag_module, "EXTRACTIVE_FALLBACK", False)
+    events = asyncio.run(_collect(rag.astream_query("What color is the sky?", [1], _fake_llm_config(error_rate=1.0))))
+    assert events[-1][0] == "error" and "Injected fake LLM failure" in events[-1][1]
+
+def test_copies_are_released_when_their_original_is_reindexed_or_deleted():
+    rag, _ = _rag_system()
+    disclaimer = f"{_words('legal', 110)}."
+    rag.process_document(1, "\n\n".join([f"{_words('a', 110)}.", disclaimer]), owner_id=7)
+    rag.process_document(2, "\n\n".join([f"{_words('b', 110)}.", disclaimer]), owner_id=7)
+    rag.process_document(3, "\n\n".join([f"{_words('c', 110)}.", disclaimer]), owner_id=7)
+    question = _words("legal", 110)
+    assert [p["chunk_id"] for p in rag.retrieve(question, [1, 2, 3], top_k=1)] == ["1_1"]
+
+    # Re-indexed without the disclaimer, document 1 no longer holds the original: document 2's copy takes its place.
+    rag.delete_document(1)
+    rag.process_document(1, f"{_words('a', 110)}.", owner_id=7)
+    assert "duplicate_of" not in rag.collection.records["2_1"][2]
+    assert rag.collection.records["3_1"][2]["duplicate_of"] == "2_1"
+    assert [p["chunk_id"] for p in rag.retrieve(question, [1, 2, 3], top_k=1)] == ["2_1"]
+
+    rag.delete_document(2)
+    assert "duplicate_of" not in rag.collection.records["3_1"][2]
+    assert [p["chunk_id"] for p in rag.retrieve(question, [1, 3], top_k=1)] == ["3_1"]
+
+def test_slow_history_summary_falls_back_to_plain_text(monkeypatch):
+    monkeypatch.setattr(rag_module, "SESSION_SUMMARY_TIMEOUT_SECONDS", 0.1)
+    rag = _fake_llm_rag_system()
+    turns = [("What color is the sky?", "Blue."), ("And grass?", "Green.")]
+
+    started = time.perf_counter()
+    summary = asyncio.run(rag.asummarize_history("", turns, _fake_llm_config(ttft_ms=5000), max_tokens=500))
+    assert time.perf_counter() - started < 2
+    assert summary == "User: What color is the sky?\nAssistant: Blue.\n\nUser: And grass?\nAssistant: Green."
+
+def test_overloaded_provider_is_waited_out_only_up_to_the_limit(monkeypatch):
+    monkeypatch.setattr(rag_module, "LLM_OVERLOAD_MAX_WAIT_SECONDS", 1.5)
+    rag = _fake_llm_rag_system()
+    rag.process_document(1, "The sky is blue on clear days. Grass is green in spring.")
+    attempts = []
+
+    async def overloaded(*args, **kwargs):
+        attempts.append(time.monotonic())
+        raise LLMOverloadedError("Test LLM", retry_after=1)
+    monkeypatch.setattr(rag, "_acall_llm", overloaded)
+
+    # One retry fits in the limit; the second would end past it, so the overload is raised for the API's 503.
+    with pytest.raises(LLMOverloadedError):
+        asyncio.run(rag.amap_reduce("Summarize everything", [1], _fake_llm_config()))
+    assert len(attempts) == 2
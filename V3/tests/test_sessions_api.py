@@ -0,0 +1,108 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from src.backend.main import app
+from src.backend.api import sessions
+from src.backend.data.database import Base, get_db, get_async_db
+from src.backend.data.models import User, Document, LLMConfig, ChatTurn
+from src.backend.core import conversation
+
+# --- Test Database Setup ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_sessions.db"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test_sessions.db")
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    db = TestingSessionLocal()
+    db.add(LLMConfig(name="Session LLM", model_name="test", api_key_env="TEST_API_KEY", is_default=True))
+    db.commit()
+    db.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+client = TestClient(app)
+
+def _register_and_login(username: str) -> str:
+    client.post("/auth/register", json={"username": username, "password": "password"})
+    response = client.post("/auth/login", data={"username": username, "password": "password"})
+    return response.json()["access_token"]
+
+def _create_document(username: str) -> int:
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == username).first()
+    doc = Document(filename=f"{username}.txt", original_filename=f"{username}.txt", owner_id=user.id, size=10)
+    db.add(doc)
+    db.commit()
+    doc_id = doc.id
+    db.close()
+    return doc_id
+
+@pytest.fixture(scope="module")
+def owner_token():
+    return _register_and_login("session_owner")
+
+def test_follow_ups_send_history_and_fold_old_turns_into_summary(owner_token, monkeypatch):
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    doc_id = _create_document("session_owner")
+    response = client.post("/sessions/", json={"title": "Chat", "document_ids": [doc_id]}, headers=headers)
+    assert response.status_code == 201
+    session_id = response.json()["id"]
+
+    histories = []
+    async def fake_achat(session_id, question, history, document_ids, llm_config, expand_neighbors=False, trace=None):
+        histories.append(history)
+        return f"answer to {question}"
+    async def fake_summarize(summary, turns, llm_config, max_tokens):
+        return "summary of " + ", ".join(question for question, _ in turns)
+    monkeypatch.setattr(sessions.rag_system, "achat", fake_achat)
+    monkeypatch.setattr(sessions.rag_system, "asummarize_history", fake_summarize)
+    monkeypatch.setattr(sessions, "SESSION_HISTORY_TOKENS", 1)
+    monkeypatch.setattr(sessions, "SESSION_RECENT_TURNS", 1)
+    monkeypatch.setattr(conversation, "count_tokens", lambda text: len(text.split()))
+
+    for question in ("first", "second", "third"):
+        response = client.post(f"/sessions/{session_id}/messages", json={"question": question}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["answer"] == f"answer to {question}"
+        assert response.json()["query_log_id"] is not None
+
+    assert histories[0] == ""
+    assert "User: first" in histories[1]
+    assert histories[2].startswith("Summary of the conversation so far: summary of first")
+
+    detail = client.get(f"/sessions/{session_id}", headers=headers).json()
+    assert [turn["question"] for turn in detail["turns"]] == ["first", "second", "third"]
+    assert detail["summary"] == "summary of second"
+    db = TestingSessionLocal()
+    assert [turn.summarized for turn in db.query(ChatTurn).filter(ChatTurn.session_id == session_id).order_by(ChatTurn.id)] == [True, True, False]
+    db.close()
+
+def test_sessions_are_private(owner_token):
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    doc_id = _create_document("session_owner")
+    session_id = client.post("/sessions/", json={"document_ids": [doc_id]}, headers=headers).json()["id"]
+
+    other_headers = {"Authorization": f"Bearer {_register_and_login('session_other')}"}
+    assert client.get(f"/sessions/{session_id}", headers=other_headers).status_code == 404
+    assert client.post("/sessions/", json={"document_ids": [doc_id]}, headers=other_headers).status_code == 403
+    assert client.delete(f"/sessions/{session_id}", headers=headers).status_code == 204
+    assert client.get(f"/sessions/{session_id}", headers=headers).status_code == 404
@@ -0,0 +1,32 @@
+import hashlib
+import io
+import os
+import pytest
+from src.backend.core.services import storage
+from src.backend.core.services.storage import CloudStorageService, StorageQuotaExceededError
+
+@pytest.fixture
+def local_storage(tmp_path, monkeypatch):
+    monkeypatch.delenv("CLOUD_STORAGE_BUCKET", raising=False)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "UPLOAD_CHUNK_SIZE", 4)
+    return CloudStorageService()
+
+def test_upload_stream_returns_size_and_hash(local_storage):
+    content = b"streamed in small pieces"
+    size, content_hash = local_storage.upload_stream("streamed.txt", io.BytesIO(content), max_bytes=len(content))
+    assert size == len(content)
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    assert local_storage.download("streamed.txt") == content
+
+def test_upload_stream_over_quota_leaves_nothing_behind(local_storage):
+    with pytest.raises(StorageQuotaExceededError):
+        local_storage.upload_stream("too_big.txt", io.BytesIO(b"x" * 100), max_bytes=10)
+    assert not os.path.exists(os.path.join(local_storage.local_storage_dir, "too_big.txt"))
+
+def test_download_to_file_copies_in_pieces(local_storage):
+    content = b"read back in small pieces"
+    local_storage.upload("stored.txt", content)
+    destination = io.BytesIO()
+    assert local_storage.download_to_file("stored.txt", destination) == len(content)
+    assert destination.getvalue() == content
@@ -0,0 +1,49 @@
+import gzip
+from types import SimpleNamespace
+from src.backend.core.services import text_store
+from src.backend.core.services.text_store import ExtractedTextStore
+
+class FakeStorage:
+    def __init__(self):
+        self.files = {}
+        self.downloads = []
+
+    def exists(self, filename):
+        return filename in self.files
+
+    def upload(self, filename, content):
+        self.files[filename] = content
+
+    def download(self, filename):
+        self.downloads.append(filename)
+        return self.files.get(filename, b"")
+
+    def download_to_file(self, filename, destination):
+        self.downloads.append(filename)
+        destination.write(self.files[filename])
+        return len(self.files[filename])
+
+    def delete(self, filename):
+        self.files.pop(filename, None)
+
+def test_text_is_extracted_once_per_version(monkeypatch):
+    storage = FakeStorage()
+    storage.upload("report.pdf", b"%PDF")
+    extracted = []
+    def fake_extract_text(filename, content):
+        # The original arrives as a file on disk, not as bytes in memory.
+        assert content.read() == b"%PDF"
+        extracted.append(filename)
+        return "Café report\r\nline two\x00"
+    monkeypatch.setattr(text_store, "extract_text", fake_extract_text)
+
+    store = ExtractedTextStore(storage)
+    document = SimpleNamespace(filename="report.pdf", version=1)
+    assert store.get(document) is None
+    assert store.get_or_extract(document) == "Café report\nline two"
+    assert store.get_or_extract(document) == "Café report\nline two"
+    assert extracted == ["report.pdf"]
+    assert gzip.decompress(storage.files["report.pdf.v1.txt.gz"]).decode("utf-8") == "Café report\nline two"
+
+    # A new version never reads the previous version's text.
+    assert store.get(SimpleNamespace(filename="report.pdf", version=2)) is None
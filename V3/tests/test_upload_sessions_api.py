@@ -0,0 +1,91 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.backend.main import app
+from src.backend.api import documents
+from src.backend.data.database import Base, get_db
+from src.backend.data.models import Document, IngestionJob, UploadSession
+
+# --- Test Database Setup ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_upload_sessions.db"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(documents, "UPLOAD_PART_SIZE", 4)
+
+client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def headers():
+    client.post("/auth/register", json={"username": "upload_owner", "password": "password"})
+    response = client.post("/auth/login", data={"username": "upload_owner", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def _send_part(upload_id: str, part_number: int, content: bytes, headers: dict):
+    return client.put(f"/documents/uploads/{upload_id}/parts/{part_number}", files={"part": ("part", content)}, headers=headers)
+
+# --- Tests ---
+def test_resumable_upload_creates_document(headers):
+    content = b"resumable upload!"
+    response = client.post("/documents/uploads", json={"filename": "big.txt", "size": len(content)}, headers=headers)
+    assert response.status_code == 201
+    upload = response.json()
+    assert upload["total_parts"] == 5
+
+    assert _send_part(upload["id"], 0, content[0:4], headers).json()["next_part"] == 1
+    # A part sent twice is accepted once; a part sent out of order is refused.
+    assert _send_part(upload["id"], 0, content[0:4], headers).json()["next_part"] == 1
+    assert _send_part(upload["id"], 2, content[8:12], headers).status_code == 409
+    assert client.post(f"/documents/uploads/{upload['id']}/complete", headers=headers).status_code == 409
+
+    # Resuming: the status says which part to send next.
+    next_part = client.get(f"/documents/uploads/{upload['id']}", headers=headers).json()["next_part"]
+    for part_number in range(next_part, upload["total_parts"]):
+        assert _send_part(upload["id"], part_number, content[part_number * 4:(part_number + 1) * 4], headers).status_code == 200
+
+    response = client.post(f"/documents/uploads/{upload['id']}/complete", headers=headers)
+    assert response.status_code == 200
+    document_id = response.json()["id"]
+
+    db = TestingSessionLocal()
+    document = db.query(Document).filter(Document.id == document_id).first()
+    assert document.size == len(content)
+    assert documents.storage_service.download(document.filename) == content
+    assert db.query(IngestionJob).filter(IngestionJob.document_id == document_id).count() == 1
+    assert db.query(UploadSession).filter(UploadSession.id == upload["id"]).first() is None
+    db.close()
+
+def test_wrong_sized_part_is_rejected(headers):
+    response = client.post("/documents/uploads", json={"filename": "short.txt", "size": 6}, headers=headers)
+    upload_id = response.json()["id"]
+    assert _send_part(upload_id, 0, b"abc", headers).status_code == 400
+    assert client.delete(f"/documents/uploads/{upload_id}", headers=headers).status_code == 204
+    assert client.get(f"/documents/uploads/{upload_id}", headers=headers).status_code == 404
+
+def test_deleted_document_is_removed_from_the_index(headers):
+    response = client.post("/documents/upload", files=[("files", ("notes.txt", b"The sky is blue.", "text/plain"))], headers=headers)
+    assert response.status_code == 200
+    document_id = response.json()[0]["id"]
+    documents.rag_system.process_document(document_id, "The sky is blue.")
+    assert documents.rag_system.collection.get(where={"document_id": str(document_id)})["ids"]
+
+    assert client.delete(f"/documents/{document_id}", headers=headers).status_code == 204
+    assert documents.rag_system.collection.get(where={"document_id": str(document_id)})["ids"] == []
+    assert documents.rag_system.centroid_collection.get(ids=[str(document_id)])["ids"] == []